@@ -0,0 +1,232 @@
+"""
+Re-download whatever :mod:`gaps` finds missing, using as few API requests as possible.
+
+Gap days are turned into a plan of date ranges for each source: consecutive days are
+always requested together and, where one request can return many days, nearby ranges
+are joined even if that means fetching some complete days again. The plan is then run
+with each source's requests in parallel, within that API's limits, before the
+downloaded days are processed in one go.
+"""
+import logging
+from argparse import ArgumentParser
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import date
+from pathlib import Path
+from threading import Lock
+from time import monotonic, sleep
+
+import pandas as pd
+import pendulum
+from configurator import Config
+
+import myenergi
+import tesla
+from common import add_log_level, configure_logging, root_from, TimestampArg
+from gaps import read_gaps, scan
+from ingest import Pipeline
+from loaders import SOURCES, TIMEZONE
+from metrics import add_metrics, export
+from octopus import BASE_URL, download_consumption
+
+
+@dataclass(frozen=True)
+class Limit:
+    # requests that may be in flight at once:
+    concurrency: int
+    # minimum seconds between starting requests:
+    interval: float
+    # most days one request may cover:
+    span: int
+    # complete days worth fetching again to save a request:
+    join: int = 0
+
+
+LIMITS = {
+    # one paged request returns up to PAGE_SIZE readings, so fetching a few good days
+    # is cheaper than another request:
+    'octopus': Limit(concurrency=2, interval=1, span=365, join=7),
+    # each day is an API call, so a request is a day to space out every call, and the
+    # Tesla API rate limits hard:
+    'tesla': Limit(concurrency=1, interval=2, span=1),
+    'zappi': Limit(concurrency=2, interval=0.5, span=1),
+}
+
+
+@dataclass(frozen=True, order=True)
+class Request:
+    source: str
+    start: date
+    end: date
+
+    @property
+    def days(self) -> int:
+        return (self.end - self.start).days + 1
+
+    def __str__(self):
+        return f'{self.source} {self.start} to {self.end} ({self.days} days)'
+
+
+def gap_days(gaps: pd.DataFrame) -> dict[str, list[date]]:
+    """
+    The day files touched by each run in a table from :func:`gaps.scan`, which cover
+    days in each source's own time zone.
+    """
+    days = {}
+    for source, runs in gaps.groupby('source'):
+        tz = SOURCES[source].tz
+        first = runs['start'].dt.tz_convert(tz).dt.date
+        last = (runs['end'] - pd.Timedelta(1)).dt.tz_convert(tz).dt.date
+        source_days = set()
+        for start, end in zip(first, last):
+            source_days.update(ts.date() for ts in pd.date_range(start, end, freq='D'))
+        days[source] = sorted(source_days)
+    return days
+
+
+def plan(gaps: pd.DataFrame, limits: dict[str, Limit] = LIMITS) -> list[Request]:
+    requests = []
+    for source, days in gap_days(gaps).items():
+        limit = limits[source]
+        start = end = days[0]
+        for day in days[1:]:
+            if (day - end).days <= limit.join + 1 and (day - start).days < limit.span:
+                end = day
+            else:
+                requests.append(Request(source, start, end))
+                start = end = day
+        requests.append(Request(source, start, end))
+    return sorted(requests)
+
+
+class Throttle:
+    """
+    Spaces out calls to :meth:`wait` by at least `interval` seconds across threads.
+    """
+
+    def __init__(self, interval: float, clock: Callable[[], float] = monotonic, sleep=sleep):
+        self.interval = interval
+        self.clock = clock
+        self.sleep = sleep
+        self.next = 0.
+        self.lock = Lock()
+
+    def wait(self) -> None:
+        with self.lock:
+            now = self.clock()
+            delay = self.next - now
+            self.next = max(now, self.next) + self.interval
+        if delay > 0:
+            self.sleep(delay)
+
+
+Fetcher = Callable[[Config, Request, Path], list[tuple[str, date]]]
+
+
+def fetch_octopus(config: Config, request: Request, root: Path) -> list[tuple[str, date]]:
+    start = pendulum.datetime(request.start.year, request.start.month, request.start.day, tz=TIMEZONE)
+    end = pendulum.datetime(request.end.year, request.end.month, request.end.day, tz=TIMEZONE)
+    octopus = config.octopus
+    return download_consumption(
+        octopus.account,
+        octopus.api_key,
+        root,
+        start.start_of('day'),
+        end.end_of('day'),
+        octopus.get('endpoint', 'electricity-meter-points'),
+        octopus.get('meter_serial'),
+        octopus.get('base_url', BASE_URL),
+    )
+
+
+def fetch_tesla(config: Config, request: Request, root: Path) -> list[tuple[str, date]]:
+    return tesla.fetch(config, pd.Timestamp(request.start), pd.Timestamp(request.end), root)
+
+
+def fetch_zappi(config: Config, request: Request, root: Path) -> list[tuple[str, date]]:
+    return myenergi.fetch(config, pd.Timestamp(request.start), pd.Timestamp(request.end), root)
+
+
+FETCHERS: dict[str, Fetcher] = {
+    'octopus': fetch_octopus,
+    'tesla': fetch_tesla,
+    'zappi': fetch_zappi,
+}
+
+
+@dataclass
+class Backfill:
+    config: Config
+    root: Path
+    limits: dict[str, Limit] = field(default_factory=lambda: LIMITS)
+    fetchers: dict[str, Fetcher] = field(default_factory=lambda: FETCHERS)
+
+    def fetch(self, throttle: Throttle, request: Request) -> list[tuple[str, date]]:
+        throttle.wait()
+        logging.info(f'Fetching {request}')
+        return self.fetchers[request.source](self.config, request, self.root)
+
+    def run(self, requests: Iterable[Request]) -> list[tuple[str, date]]:
+        """
+        Make `requests`, returning the days downloaded. Failed requests are logged
+        and left for the next run to pick up.
+        """
+        requests = list(requests)
+        sources = {request.source for request in requests}
+        executors = {s: ThreadPoolExecutor(self.limits[s].concurrency) for s in sources}
+        throttles = {s: Throttle(self.limits[s].interval) for s in sources}
+        downloaded = []
+        try:
+            futures = {
+                executors[r.source].submit(self.fetch, throttles[r.source], r): r
+                for r in requests
+            }
+            for future in as_completed(futures):
+                try:
+                    downloaded.extend(future.result())
+                except Exception:
+                    logging.exception(f'Could not fetch {futures[future]}')
+        finally:
+            for executor in executors.values():
+                executor.shutdown()
+        return downloaded
+
+
+def main():
+    config = Config.from_path('config.yaml')
+    root = root_from(config)
+
+    parser = ArgumentParser(description='Download the data needed to fill any gaps.')
+    timestamp = TimestampArg(root, 'octopus-%Y-%m-%d.csv')
+    timestamp.add_argument(parser, 'start')
+    timestamp.add_argument(parser, 'end')
+    parser.add_argument('--source', choices=SOURCES.keys(), action='append', dest='sources')
+    parser.add_argument('--gaps', type=Path, help='a gap table written by gaps.py --csv')
+    parser.add_argument('--dry-run', action='store_true', help='show the plan without running it')
+    parser.add_argument('--workers', type=int)
+    add_log_level(parser)
+    add_metrics(parser)
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+    export(args)
+
+    start = min(args.start, args.end).date()
+    end = max(args.start, args.end).date()
+    sources = args.sources or list(SOURCES)
+    if args.gaps:
+        gaps = read_gaps(args.gaps)
+        gaps = gaps[gaps['source'].isin(sources)]
+    else:
+        gaps = scan(root, start, end, sources, args.workers)
+    requests = plan(gaps)
+    for request in requests:
+        logging.info(f'Planned {request}')
+    if args.dry_run or not requests:
+        return
+    downloaded = Backfill(config, root).run(requests)
+    Pipeline(root, args.workers).run(downloaded)
+
+
+if __name__ == '__main__':
+    main()
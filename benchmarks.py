@@ -0,0 +1,315 @@
+"""
+Timings for the hot paths: building schedules, loading and converting day files and
+working out bills. Each run is appended to a results file so changes in speed can be
+tracked over time, and every run is compared with the last one for each benchmark.
+"""
+import importlib
+import io
+import json
+import logging
+import platform
+import re
+import statistics
+import subprocess
+from argparse import ArgumentParser
+from collections.abc import Callable
+from contextlib import redirect_stdout
+from datetime import date, datetime, timezone
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from timeit import Timer
+from typing import Any
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+import pendulum
+from configurator import Config
+
+import loaders
+import myenergi
+import tesla
+from common import add_log_level, configure_logging
+from octopus import Schedule
+from replay import replay_all
+from schedule import make_seasons_and_energy_charges
+from synthetic import Spec, generate, unit_rates
+
+London = ZoneInfo('Europe/London')
+
+Setup = Callable[[Path, int], Callable[[], Any]]
+BENCHMARKS: dict[str, Setup] = {}
+
+
+def benchmark(setup: Setup) -> Setup:
+    """
+    Register `setup`, which is passed a scratch directory and a number of days of data
+    to use and returns the callable to be timed.
+    """
+    BENCHMARKS[setup.__name__] = setup
+    return setup
+
+
+def days_from(start: str, days: int) -> list[pd.Timestamp]:
+    return list(pd.date_range(start, periods=days, freq='D'))
+
+
+def write(scratch: Path, days: int, *kinds: str, **spec) -> list[pd.Timestamp]:
+    """
+    Write complete synthetic day files from the start of 2024, returning their dates.
+    """
+    generate(Spec(date(2024, 1, 1), days, kinds=kinds, gap_rate=0, missing_rate=0, **spec), scratch, workers=1)
+    return days_from('2024-01-01', days)
+
+
+def dispatches(now: pd.Timestamp, count: int = 12) -> dict:
+    starts = pd.date_range(now.ceil('30min'), periods=count, freq='90min')
+    return {'plannedDispatches': [{
+        'startDtUtc': str(start.tz_convert('UTC')),
+        'endDtUtc': str((start + pd.Timedelta(minutes=30)).tz_convert('UTC')),
+        'chargeKwh': '-3.5',
+        'meta': {'source': 'smart-charge', 'location': 'AT_HOME'},
+    } for start in starts]}
+
+
+# a normal day and both DST changes:
+SCHEDULE_DAYS = ('2024-02-29T16:42', '2024-03-30T18:12', '2024-10-26T18:12')
+
+
+def schedule_for(text: str) -> tuple[pd.Timestamp, list[dict]]:
+    now = pd.Timestamp(text, tz=London)
+    return now, unit_rates(now)
+
+
+@benchmark
+def schedule_add(scratch: Path, days: int):
+    cases = [schedule_for(text) for text in SCHEDULE_DAYS]
+
+    def run():
+        for now, rates in cases:
+            schedule = Schedule(now)
+            for rate in rates:
+                schedule.add(pd.Timestamp(rate['validFrom']), pd.Timestamp(rate['validTo']), rate['value'])
+    return run
+
+
+@benchmark
+def schedule_final(scratch: Path, days: int):
+    schedules = []
+    for text in SCHEDULE_DAYS:
+        now, rates = schedule_for(text)
+        schedule = Schedule(now)
+        for rate in rates:
+            schedule.add(pd.Timestamp(rate['validFrom']), pd.Timestamp(rate['validTo']), rate['value'])
+        schedules.append(schedule)
+
+    def run():
+        for schedule in schedules:
+            schedule.final()
+            schedule.final_times(London)
+    return run
+
+
+@benchmark
+def seasons_and_energy_charges(scratch: Path, days: int):
+    cases = [(now, rates, dispatches(now)) for now, rates in map(schedule_for, SCHEDULE_DAYS)]
+
+    def run():
+        for now, rates, planned in cases:
+            make_seasons_and_energy_charges(now, rates, planned, London)
+    return run
+
+
+@benchmark
+def load_octopus(scratch: Path, days: int):
+    dates = write(scratch, days, 'octopus')
+
+    def run():
+        for day in dates:
+            loaders.load_octopus(scratch, day.date())
+    return run
+
+
+@benchmark
+def load_tesla(scratch: Path, days: int):
+    dates = write(scratch, days, 'tesla', tesla_csv='app')
+
+    def run():
+        for day in dates:
+            loaders.load_tesla(scratch, day.date())
+    return run
+
+
+def octopus_bill_module():
+    return importlib.import_module('octopus-bill')
+
+
+@benchmark
+def load_range(scratch: Path, days: int):
+    write(scratch, days, 'octopus')
+    start = pendulum.date(2024, 1, 1)
+    end = start.add(days=days)
+    octopus_bill = octopus_bill_module()
+
+    def run():
+        octopus_bill.load_data(start, end, scratch, loaders.load_octopus)
+    return run
+
+
+@benchmark
+def tesla_json_to_csv(scratch: Path, days: int):
+    dates = write(scratch, days, 'tesla')
+
+    def run():
+        tesla.json_to_csv(None, dates[0], dates[-1], scratch)
+    return run
+
+
+@benchmark
+def zappi_json_to_csv(scratch: Path, days: int):
+    config = Config({'myenergi': {'zappi_serial': Spec.zappi_serial}})
+    dates = write(scratch, days, 'zappi')
+
+    def run():
+        myenergi.json_to_csv(config, dates[0], dates[-1], scratch)
+    return run
+
+
+@benchmark
+def octopus_bill(scratch: Path, days: int):
+    write(scratch, days, 'octopus')
+    start = pendulum.date(2024, 1, 1)
+    end = start.add(days=days)
+    octopus_bill = octopus_bill_module()
+    data = octopus_bill.load_data(start, end, scratch, loaders.load_octopus)
+
+    def run():
+        octopus_bill.bill(start, end, data.copy(), standing=0.5, normal=0.3, cheap=0.075)
+    return run
+
+
+@benchmark
+def replay_snapshots(scratch: Path, days: int):
+    write(scratch, days, 'dispatches')
+
+    def run():
+        replay_all(scratch, workers=1)
+    return run
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def time_benchmark(name: str, days: int, repeat: int, number: int) -> dict:
+    with TemporaryDirectory() as scratch:
+        function = BENCHMARKS[name](Path(scratch), days)
+        # anything printed by the code being timed is just noise here:
+        with redirect_stdout(io.StringIO()):
+            times = Timer(function).repeat(repeat, number)
+    times = [t / number for t in times]
+    return {
+        'name': name,
+        'days': days,
+        'min': min(times),
+        'median': statistics.median(times),
+        'max': max(times),
+        'repeat': repeat,
+        'number': number,
+    }
+
+
+def run(
+        names: list[str], days: int, repeat: int, number: int
+) -> list[dict]:
+    context = {
+        'when': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+    }
+    results = []
+    for name in names:
+        logging.info(f'Running {name}')
+        try:
+            result = time_benchmark(name, days, repeat, number)
+        except Exception as e:
+            logging.exception(f'{name} failed')
+            result = {'name': name, 'days': days, 'error': repr(e)}
+        results.append(context | result)
+    return results
+
+
+def load_results(path: Path) -> list[dict]:
+    if not path.exists():
+        return []
+    return [json.loads(line) for line in path.read_text().splitlines() if line]
+
+
+def save_results(path: Path, results: list[dict]) -> None:
+    with path.open('a') as target:
+        for result in results:
+            target.write(json.dumps(result) + '\n')
+
+
+def previous_results(history: list[dict]) -> dict[tuple[str, int], dict]:
+    previous = {}
+    for result in history:
+        if 'error' not in result:
+            previous[result['name'], result['days']] = result
+    return previous
+
+
+def format_seconds(seconds: float) -> str:
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('µs', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:.3g}{unit}'
+    return f'{seconds / 1e-9:.3g}ns'
+
+
+def report(results: list[dict], previous: dict[tuple[str, int], dict]) -> str:
+    lines = []
+    width = max(len(result['name']) for result in results)
+    for result in results:
+        line = f"{result['name']:<{width}}  "
+        if 'error' in result:
+            lines.append(line + f"error: {result['error']}")
+            continue
+        line += f"min {format_seconds(result['min']):>8}  median {format_seconds(result['median']):>8}"
+        before = previous.get((result['name'], result['days']))
+        if before is not None:
+            change = (result['min'] - before['min']) / before['min']
+            line += f"  {change:+.1%} vs {before['commit'] or before['when']}"
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('patterns', nargs='*', help='regexes selecting the benchmarks to run')
+    parser.add_argument('--days', type=int, default=365, help='days of data to use')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--number', type=int, default=1)
+    parser.add_argument('--results', type=Path, default=Path('benchmarks.jsonl'))
+    parser.add_argument('--no-save', action='store_false', dest='save')
+    add_log_level(parser)
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    names = [
+        name for name in BENCHMARKS
+        if not args.patterns or any(re.search(p, name) for p in args.patterns)
+    ]
+    previous = previous_results(load_results(args.results))
+    results = run(names, args.days, args.repeat, args.number)
+    print(report(results, previous))
+    if args.save:
+        save_results(args.results, results)
+
+
+if __name__ == '__main__':
+    main()
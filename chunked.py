@@ -0,0 +1,215 @@
+"""
+Aggregations over any range of the storage directory that only ever hold a day of
+readings in memory per worker, for analysis over years of minute data that wouldn't
+fit in one DataFrame:
+
+.. code-block:: python
+
+  from chunked import aggregate
+
+  monthly = aggregate(root, 'zappi', date(2022, 1, 1), date(2025, 10, 1), 'MS', ['pect1_kw'])
+  sustained = aggregate(root, 'zappi', start, end, 'D', ['pect1_kw'], how=('max',), rolling='20min')
+
+Each day file is filtered, optionally turned into rolling means and reduced to the sum,
+min, max and count of each column in local periods of ``freq``. Those partial results
+are then combined in the same way as the :mod:`rollups`, so periods that span day
+files, such as months or the local days either side of a clock change, come out right.
+"""
+import logging
+from argparse import ArgumentParser
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from functools import partial
+from pathlib import Path
+
+import pandas as pd
+from configurator import Config
+
+import rollups
+from common import TimestampArg, add_log_level, configure_logging, root_from
+from loaders import SOURCES, TIMEZONE, load_day
+
+HOW = rollups.STATS + ('mean',)
+# a boolean expression for DataFrame.eval, or a function returning a boolean Series:
+Where = str | Callable[[pd.DataFrame], pd.Series] | None
+
+
+def read(root: Path, source: str, day: date, columns: list[str] | None, where: Where) -> pd.DataFrame | None:
+    """
+    The readings for `day` in local time, with only `columns` and the rows
+    matching `where`.
+    """
+    frame = load_day(root, SOURCES[source], day)
+    if frame is None:
+        return None
+    frame = frame.tz_convert(TIMEZONE).sort_index()
+    if where is not None:
+        frame = frame[frame.eval(where) if isinstance(where, str) else where(frame)]
+    if columns:
+        frame = frame[columns]
+    return frame
+
+
+def within(frame: pd.DataFrame, start: date, end: date) -> pd.DataFrame:
+    """
+    The rows of `frame` from the local `start` up to but not including the local `end`.
+    """
+    first, last = (pd.Timestamp(d, tz=TIMEZONE) for d in (start, end))
+    return frame[(frame.index >= first) & (frame.index < last)]
+
+
+def summarise(
+        root: Path,
+        source: str,
+        freq: str,
+        columns: list[str] | None,
+        where: Where,
+        rolling: str | None,
+        start: date,
+        end: date,
+        day: date,
+) -> pd.DataFrame | None:
+    """
+    The partial results for one day file: the sum, min, max and count of each
+    column in each period of `freq`, counting only readings from the local `start`
+    up to but not including the local `end`.
+    """
+    frame = read(root, source, day, columns, where)
+    if frame is None or frame.empty:
+        return None
+    if rolling:
+        # the end of the day before fills the windows at the start of this one:
+        previous = read(root, source, day - timedelta(days=1), columns, where)
+        first = frame.index[0]
+        if previous is not None:
+            frame = pd.concat([previous[previous.index >= first - pd.Timedelta(rolling)], frame])
+        frame = rollups.rolling_mean(frame, rolling, SOURCES[source].interval)
+        frame = frame[frame.index >= first]
+    frame = within(frame, start, end)
+    if frame.empty:
+        return None
+    # one call for each statistic across all the columns is much quicker than agg():
+    resampled = frame.resample(freq)
+    summary = pd.concat({stat: getattr(resampled, stat)() for stat in rollups.STATS}, axis=1)
+    summary.columns = [f'{column}_{stat}' for stat, column in summary.columns]
+    summary = summary[[f'{column}_{stat}' for column in frame.columns for stat in rollups.STATS]]
+    return summary[summary.filter(like='_count').sum(axis=1) > 0]
+
+
+def combine(partials: Iterable[pd.DataFrame], how: Iterable[str]) -> pd.DataFrame:
+    """
+    Combine partial results, giving ``{column}_{stat}`` for each stat in `how`.
+    """
+    partials = list(partials)
+    if not partials:
+        return pd.DataFrame(index=pd.DatetimeIndex([], tz=TIMEZONE))
+    table = pd.concat(partials)
+    table = table.groupby(level=0).agg({column: rollups.COMBINE[column.rsplit('_', 1)[1]] for column in table})
+    result = {}
+    for column in dict.fromkeys(c.rsplit('_', 1)[0] for c in table.columns):
+        count = table[f'{column}_count']
+        for stat in how:
+            if stat == 'mean':
+                result[f'{column}_mean'] = table[f'{column}_sum'] / count.where(count > 0)
+            else:
+                result[f'{column}_{stat}'] = table[f'{column}_{stat}']
+    return pd.DataFrame(result, index=table.index)
+
+
+def aggregate(
+        root: Path,
+        source: str,
+        start: date,
+        end: date,
+        freq: str,
+        columns: list[str] | None = None,
+        how: Iterable[str] = HOW,
+        where: Where = None,
+        rolling: str | None = None,
+        workers: int | None = 1,
+) -> pd.DataFrame:
+    """
+    Aggregate the readings of `source` from the local `start` up to but not including
+    the local `end` into local periods of `freq`.
+
+    Rows are first filtered with `where` and, if `rolling` is given, replaced by the
+    rolling mean over that window once it's full. Each column then gives
+    ``{column}_{stat}`` for each of `how`, which can be any of :data:`HOW`.
+
+    Day files are read one at a time, or on a pool of `workers` processes if that's
+    not 1, in which case `where` must be a string or a function that can be pickled.
+    """
+    how = tuple(how)
+    unknown = set(how) - set(HOW)
+    if unknown:
+        raise ValueError(f'unknown statistics: {sorted(unknown)}')
+    days = SOURCES[source].file_days(start, end)
+    summarise_day = partial(summarise, root, source, freq, columns, where, rolling, start, end)
+    if workers == 1:
+        partials = map(summarise_day, days)
+        return combine((p for p in partials if p is not None), how)
+    with ProcessPoolExecutor(workers) as executor:
+        # a month of days to each task keeps the per-task overhead down:
+        partials = executor.map(summarise_day, days, chunksize=31)
+        return combine((p for p in partials if p is not None), how)
+
+
+def chunks(
+        root: Path,
+        source: str,
+        start: date,
+        end: date,
+        columns: list[str] | None = None,
+        where: Where = None,
+) -> Iterator[tuple[date, pd.DataFrame]]:
+    """
+    The readings from the local `start` up to but not including the local `end`, one
+    day file at a time along with the day it's for, for anything :func:`aggregate`
+    can't do.
+    """
+    for day in SOURCES[source].file_days(start, end):
+        frame = read(root, source, day, columns, where)
+        if frame is not None:
+            frame = within(frame, start, end)
+            if not frame.empty:
+                yield day, frame
+
+
+def main():
+    config = Config.from_path('config.yaml')
+    root = root_from(config)
+
+    parser = ArgumentParser(description='Aggregate readings over a range of days, a day at a time.')
+    parser.add_argument('source', choices=SOURCES.keys())
+    timestamp = TimestampArg(root, 'octopus-%Y-%m-%d.csv')
+    timestamp.add_argument(parser, 'start')
+    timestamp.add_argument(parser, 'end')
+    parser.add_argument('--freq', default='MS', help='pandas frequency of the periods to aggregate into')
+    parser.add_argument('--column', action='append', dest='columns')
+    parser.add_argument('--how', action='append', choices=HOW)
+    parser.add_argument('--where', help='only use readings matching this, such as "pect1_kw > 0"')
+    parser.add_argument('--rolling', help='aggregate rolling means over this window, such as 20min')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--csv', type=Path, help='path to write the results to')
+    add_log_level(parser)
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    start = min(args.start, args.end).date()
+    # inclusive on the command line, like the other scripts:
+    end = max(args.start, args.end).date() + timedelta(days=1)
+    result = aggregate(
+        root, args.source, start, end, args.freq, args.columns, args.how or HOW,
+        args.where, args.rolling, args.workers,
+    )
+    if args.csv:
+        result.to_csv(args.csv)
+        logging.info(f'Wrote {len(result)} rows to {args.csv}')
+    else:
+        with pd.option_context('display.max_rows', None, 'display.width', None):
+            print(result.to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,31 @@
-import difflib
+# pandas and mailinglogger are only imported where needed, as importing them takes
+# longer than many of the scripts using this module take to run:
+from __future__ import annotations
+
+import asyncio
 import json
 import logging
+import random
 import re
 import sys
 from argparse import ArgumentParser
+from bisect import bisect_left, bisect_right
 from dataclasses import dataclass
 from datetime import timedelta, datetime
-from functools import wraps
 from logging.handlers import TimedRotatingFileHandler
 from pathlib import Path
-from time import sleep
-from typing import Callable, Iterator, ParamSpec, Self, Any, TypeVar
+from time import sleep, monotonic, time
+from typing import Callable, Iterator, ParamSpec, Self, Any, TypeVar, Awaitable, TYPE_CHECKING
 
 from configurator import Config
-from mailinglogger import MailingLogger
-from pandas import Timestamp, date_range, to_datetime
 
-Action = Callable[[Config, Timestamp, Timestamp, Path], None]
+import metrics
+from profiling import add_profile
+
+if TYPE_CHECKING:
+    from pandas import Timestamp
+
+Action = Callable[[Config, 'Timestamp', 'Timestamp', Path], None]
 ActionMapping = dict[str, Action]
 
 # Average Gregorian year = 365.2425 days (400 year cycle: 97 leap years + 303 regular years)
@@ -45,6 +54,7 @@ class TimestampArg:
     }
 
     def __call__(self, text: str) -> Timestamp:
+        from pandas import Timestamp, to_datetime
         if text == 'now':
             return Timestamp.now()
         index = self.name_to_index.get(text)
@@ -77,6 +87,7 @@ def add_log_level(parser):
                         choices=[name.lower() for name in LOG_LEVELS],
                         default='info')
     parser.add_argument('--unattended', action='store_true')
+    add_profile(parser)
 
 
 def configure_logging(log_level: str, unattended: bool = False) -> None:
@@ -106,6 +117,7 @@ def configure_logging(log_level: str, unattended: bool = False) -> None:
         handler.setFormatter(logging.Formatter(line_format, date_format))
         root.addHandler(handler)
         # email alerts
+        from mailinglogger import MailingLogger
         handler = MailingLogger(
             'support@simplistix.co.uk',
             ['chris@withers.org'],
@@ -129,12 +141,14 @@ def main(actions: ActionMapping, pattern) -> None:
     parser = ArgumentParser()
     parser.add_argument('action', choices=actions.keys())
     add_log_level(parser)
+    metrics.add_metrics(parser)
     timestamp = TimestampArg(root, pattern)
     timestamp.add_argument(parser, 'start')
     timestamp.add_argument(parser, 'end')
     args = parser.parse_args()
 
     configure_logging(args.log_level)
+    metrics.export(args)
 
     start = min(args.start, args.end)
     end = max(args.start, args.end)
@@ -142,6 +156,7 @@ def main(actions: ActionMapping, pattern) -> None:
 
 
 def file_paths(root: Path, pattern: str, start: Timestamp, end: Timestamp) -> Iterator[Path]:
+    from pandas import date_range
     for ts in date_range(start=end, end=start, freq='-1D'):
         path = root / ts.strftime(pattern)
         if not path.exists():
@@ -155,14 +170,55 @@ def json_from_paths(root: Path, pattern: str, start: Timestamp, end: Timestamp)
         yield path, json.loads(path.read_bytes())
 
 
+SNAPSHOT_PATTERN = '%Y-%m-%d-%H-%M-%S.json'
+SNAPSHOT_DASHES = SNAPSHOT_PATTERN.count('-') + 1
+
+
+def snapshot_time(path: Path) -> datetime:
+    """
+    The time a :class:`DiffDumper` snapshot was written, from its file name.
+    """
+    parts = path.name.rsplit('-', SNAPSHOT_DASHES)
+    return datetime.strptime('-'.join(parts[1:]), SNAPSHOT_PATTERN)
+
+
+SNAPSHOT = re.compile(r'.+-\d{4}-\d\d-\d\d-\d\d-\d\d-\d\d\.json')
+
+
+def snapshot_paths(root: Path, prefix: str) -> list[Path]:
+    return sorted(p for p in root.glob(f'{prefix}*.json') if SNAPSHOT.fullmatch(p.name))
+
+
+def select(paths: list[Path], start: datetime | None, end: datetime | None) -> list[Path]:
+    """
+    The slice of the sorted `paths` written after `start` and before `end`.
+    """
+    lo = 0 if start is None else bisect_right(paths, start, key=snapshot_time)
+    hi = len(paths) if end is None else bisect_left(paths, end, key=snapshot_time)
+    return paths[lo:hi]
+
+
 class DiffDumper:
+    """
+    Record `state` whenever it changes, either as a pretty-printed json file per
+    change or, if `segments` is true, in a :class:`~segments.SegmentLog`.
+    """
 
-    def __init__(self, target: Path, prefix: str):
+    def __init__(self, target: Path, prefix: str, segments: bool = False):
         self.target = target
         self.prefix = prefix
+        self.log = None
+        if segments:
+            from segments import SegmentLog
+            self.log = SegmentLog(target, prefix)
         self.state = self.load_latest()
 
     def load_latest(self):
+        if self.log is not None:
+            latest = self.log.latest()
+            if latest is not None:
+                logging.info(f'latest {self.prefix} from {latest[0]}')
+                return latest[1]
         sources = sorted(self.target.glob(f"{self.prefix}*.json"))
         if sources:
             latest = sources[-1]
@@ -172,8 +228,13 @@ class DiffDumper:
     def update(self, state, force: bool = False):
         if force or self.state != state:
             logging.debug(f"state changed for {self.prefix}")
-            dest = self.target / f"{self.prefix}-{datetime.now():%Y-%m-%d-%H-%M-%S}.json"
-            dest.write_text(json.dumps(state, indent=4))
+            now = datetime.now()
+            if self.log is not None:
+                # aware, so the hour repeated when DST ends is recorded in order:
+                dest = self.log.append(now.astimezone().replace(microsecond=0), state)
+            else:
+                dest = self.target / f"{self.prefix}-{now.strftime(SNAPSHOT_PATTERN)}"
+                dest.write_text(json.dumps(state, indent=4))
             logging.info(f'wrote {dest}')
             self.state = state
 
@@ -185,8 +246,14 @@ timedelta_P = ParamSpec('timedelta_P', bound=timedelta)
 
 class Run:
 
-    def __init__(self, callable_: Callable[P, None]):
+    def __init__(
+            self, callable_: Callable[P, None], retry: timedelta | None = None, name: str | None = None
+    ):
         self.callable_ = callable_
+        # how soon to try again after a failure, rather than waiting a whole period:
+        self.retry = retry
+        # used to label the metrics recorded for each run:
+        self.name = name or getattr(callable_, '__name__', type(callable_).__name__).lower()
         self.args = ()
         self.kw = {}
 
@@ -195,41 +262,221 @@ class Run:
         self.kw = kw
         return self
 
+    def run(self) -> None:
+        started = monotonic()
+        try:
+            self.callable_(*self.args, **self.kw)
+        except Exception:
+            metrics.RUN_FAILURES.labels(self.name).inc()
+            raise
+        finally:
+            metrics.RUN_SECONDS.labels(self.name).observe(monotonic() - started)
+            metrics.RUN_LAST.labels(self.name).set(time())
+            metrics.flush()
+
     def once(self) -> None:
-        self.callable_(*self.args, **self.kw)
+        self.run()
 
     def every(self, **kwargs: timedelta_P.kwargs) -> None:
         delay = timedelta(**kwargs).total_seconds()
+        retry = delay if self.retry is None else min(self.retry.total_seconds(), delay)
         try:
+            due = monotonic()
             while True:
+                # how far behind the plan this run is, from an overloaded host, a
+                # laptop that was asleep or a sleep that overran:
+                metrics.RUN_LATENESS.labels(self.name).observe(max(monotonic() - due, 0))
                 try:
-                    self.callable_(*self.args, **self.kw)
+                    self.run()
                 except Exception:
                     logging.exception(f'{self.callable_} failed')
-                sleep(delay)
+                    wait = retry
+                else:
+                    wait = delay
+                due = monotonic() + wait
+                sleep(wait)
         except KeyboardInterrupt:
             pass
 
 
-def diff(a: Any, b: Any, a_label: str = '', b_label: str = ''):
-    return ''.join(difflib.unified_diff(
-        str(a).splitlines(keepends=True),
-        str(b).splitlines(keepends=True),
-        a_label,
-        b_label
-    ))
-
-
-def log_timeouts_and_return_none(c: Callable[P, T]) -> Callable[P, T | None]:
-
-    @wraps(c)
-    def _run(*args: P.args, **kwargs: P.kwargs) -> T:
-        try:
-            return c(*args, **kwargs)
-        except TimeoutError:
-            message = f'Timeout getting {c.__name__}'
-            logging.warning(message)
-            logging.debug(message, exc_info=True)
+MISSING = object()
+
+
+def compact(value: Any) -> str:
+    return json.dumps(value, default=str)
+
+
+@dataclass
+class Change:
+    path: str
+    old: Any = MISSING
+    new: Any = MISSING
+
+    def describe(self, format_value: Callable[[Any], str] = compact) -> str:
+        if self.old is MISSING:
+            return f'+ {self.path}: {format_value(self.new)}'
+        if self.new is MISSING:
+            return f'- {self.path}: {format_value(self.old)}'
+        return f'~ {self.path}: {format_value(self.old)} -> {format_value(self.new)}'
+
+    def __str__(self):
+        return self.describe()
+
+
+def structural_diff(
+        a: Any, b: Any, path: str = '', atomic: Callable[[Any], bool] | None = None
+) -> Iterator[Change]:
+    """
+    Yield the paths at which two JSON-like structures differ.
+
+    Dictionaries are compared key by key. Lists of the same length are compared
+    item by item; otherwise the items found in only one of them are reported as
+    removed or added. Values for which `atomic` returns true are reported as a
+    whole rather than being recursed into.
+    """
+    if a == b:
+        return
+    if atomic is not None and (atomic(a) or atomic(b)):
+        yield Change(path, a, b)
+    elif isinstance(a, dict) and isinstance(b, dict):
+        for key, value in a.items():
+            key_path = f'{path}.{key}' if path else str(key)
+            if key not in b:
+                yield Change(key_path, old=value)
+            else:
+                yield from structural_diff(value, b[key], key_path, atomic)
+        for key, value in b.items():
+            if key not in a:
+                yield Change(f'{path}.{key}' if path else str(key), new=value)
+    elif isinstance(a, list) and isinstance(b, list):
+        if len(a) == len(b):
+            for i, (a_item, b_item) in enumerate(zip(a, b)):
+                yield from structural_diff(a_item, b_item, f'{path}[{i}]', atomic)
+        else:
+            unmatched = list(b)
+            for i, item in enumerate(a):
+                if item in unmatched:
+                    unmatched.remove(item)
+                else:
+                    yield Change(f'{path}[{i}]', old=item)
+            for i, item in enumerate(b):
+                if item in unmatched:
+                    unmatched.remove(item)
+                    yield Change(f'{path}[{i}]', new=item)
+    else:
+        yield Change(path, a, b)
+
+
+def diff(
+        a: Any,
+        b: Any,
+        a_label: str = '',
+        b_label: str = '',
+        format_value: Callable[[Any], str] = compact,
+        atomic: Callable[[Any], bool] | None = None,
+) -> str:
+    """
+    A line for each path at which `a` and `b` differ, as found by
+    :func:`structural_diff`, or an empty string if they're the same.
+    """
+    lines = [change.describe(format_value) for change in structural_diff(a, b, atomic=atomic)]
+    if lines and (a_label or b_label):
+        lines[:0] = [f'--- {a_label}', f'+++ {b_label}']
+    return ''.join(f'{line}\n' for line in lines)
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an API that has recently failed too often."""
+
+
+@dataclass
+class CircuitBreaker:
+    """Stop calling an API after `threshold` consecutive failures.
+
+    Once open, calls are refused for `reset_after` seconds, after which a single
+    trial call is let through: success closes the circuit, failure opens it again.
+    Other calls are refused while the trial is in progress, and another trial is let
+    through if it has neither succeeded nor failed after another `reset_after`.
+    """
+    name: str
+    threshold: int = 5
+    reset_after: float = 300
+    failures: int = 0
+    opened_at: float | None = None
+    clock: Callable[[], float] = monotonic
+
+    def check(self) -> None:
+        if self.opened_at is None:
             return
-
-    return _run
+        now = self.clock()
+        if now - self.opened_at < self.reset_after:
+            raise CircuitOpen(f'{self.name} circuit open after {self.failures} failures')
+        # half open: this call is the trial, so the rest wait for its outcome:
+        self.opened_at = now
+
+    def success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self.threshold:
+            if self.opened_at is None:
+                logging.warning(f'{self.name} circuit opened after {self.failures} failures')
+            self.opened_at = self.clock()
+
+
+@dataclass
+class Backoff:
+    """Retry an awaitable with bounded exponential backoff and jitter.
+
+    Retries stop when `attempts` is reached, when the next sleep would overrun
+    `deadline` (in event loop time), or when `breaker` refuses the call.
+    `retry_on` is either the exceptions to retry or a function saying whether an
+    exception should be retried.
+    """
+    retry_on: tuple[type[BaseException], ...] | Callable[[BaseException], bool]
+    breaker: CircuitBreaker
+    attempts: int = 5
+    initial: float = 0.5
+    maximum: float = 8
+
+    def retryable(self, e: BaseException) -> bool:
+        if isinstance(self.retry_on, tuple):
+            return isinstance(e, self.retry_on)
+        return self.retry_on(e)
+
+    def delay(self, attempt: int) -> float:
+        return min(self.initial * 2 ** attempt, self.maximum) * random.uniform(0.5, 1)
+
+    async def __call__(
+            self,
+            deadline: float | None,
+            c: Callable[P, Awaitable[T]],
+            *args: P.args,
+            **kwargs: P.kwargs,
+    ) -> T:
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            self.breaker.check()
+            try:
+                result = await c(*args, **kwargs)
+            except Exception as e:
+                if not self.retryable(e):
+                    raise
+                self.breaker.failure()
+                attempt += 1
+                delay = self.delay(attempt - 1)
+                if attempt >= self.attempts or (
+                        deadline is not None and loop.time() + delay >= deadline
+                ):
+                    raise
+                logging.warning(
+                    f'{self.breaker.name}: {c.__name__} failed with {e!r}, '
+                    f'retrying in {delay:.1f}s'
+                )
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.success()
+                return result
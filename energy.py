@@ -0,0 +1,320 @@
+"""
+One ``energy`` command for the interactive jobs, which runs them in a resident daemon
+when there is one and in-process otherwise:
+
+.. code-block:: bash
+
+  uv run energy.py daemon &
+  uv run energy.py bill 2024-01-01 2024-02-01
+
+The daemon keeps the config, authenticated API clients and the days of data it has
+read in memory, so only the first run of a command pays for imports, logging in and
+reading files. This module only imports the standard library until a command runs
+in-process, so that talking to the daemon is quick.
+"""
+import io
+import json
+import logging
+import os
+import socket
+import sys
+from argparse import SUPPRESS, ArgumentParser, Namespace
+from collections import OrderedDict
+from collections.abc import Callable
+from contextlib import redirect_stderr, redirect_stdout
+from datetime import date, timedelta
+from functools import cached_property
+from importlib import import_module
+from pathlib import Path
+from socketserver import StreamRequestHandler, UnixStreamServer
+from stat import S_ISDIR
+from threading import Thread
+from time import monotonic
+
+LOG_LEVELS = ('debug', 'info', 'warning', 'error')
+# the files read for each source by octopus-bill.py's loaders, used to spot changes:
+BILL_FILES = {'octopus': 'octopus-{}.csv', 'tesla': 'tesla-{}.csv'}
+# days of frames the daemon keeps in memory, the least recently used going first:
+MAX_FRAMES = 1000
+
+
+def default_socket() -> Path:
+    runtime = os.environ.get('XDG_RUNTIME_DIR') or f'/tmp/energy-{os.getuid()}'
+    return Path(os.environ.get('ENERGY_SOCKET', Path(runtime) / 'energy.sock'))
+
+
+def check_private(directory: Path) -> None:
+    """
+    Refuse to use a socket in `directory` unless it belongs to us and nobody else can
+    get into it, as anyone could have made a directory with the expected name in /tmp.
+    """
+    try:
+        info = directory.lstat()
+    except FileNotFoundError:
+        return
+    if not S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise SystemExit(f'{directory} must be a directory owned by you that only you can use')
+
+
+class Context:
+    """
+    Everything commands need that's worth keeping between them.
+    """
+
+    def __init__(self, config_path: Path = Path('config.yaml'), max_frames: int = MAX_FRAMES):
+        self.config_path = config_path
+        self.max_frames = max_frames
+        self.started = monotonic()
+        self.commands = 0
+        # set by the daemon, so that the stop command can stop it:
+        self.shutdown: Callable[[], None] | None = None
+        # (source, day) -> (mtime_ns, frame)
+        self.frames: OrderedDict[tuple[str, date], tuple[int, object]] = OrderedDict()
+
+    @cached_property
+    def config(self):
+        from configurator import Config
+        return Config.from_path(str(self.config_path))
+
+    @cached_property
+    def root(self) -> Path:
+        from common import root_from
+        return root_from(self.config)
+
+    @cached_property
+    def battery(self):
+        from tesla import tesla_client
+        battery, = tesla_client(self.config).battery_list()
+        return battery
+
+    @cached_property
+    def graphql(self):
+        # the token obtained by the first query is kept for those that follow:
+        from octopus import BASE_URL, OctopusGraphQLClient
+        return OctopusGraphQLClient(self.config.octopus.api_key, self.config.octopus.get('base_url', BASE_URL))
+
+    def loader(self, source: str) -> Callable[[Path, date], object]:
+        """
+        The octopus-bill.py loader for `source`, returning frames from memory unless
+        the file they were read from has changed, or ``None`` if there's no file.
+        """
+        load = import_module('octopus-bill').loaders[source]
+
+        def cached(storage: Path, day: date):
+            path = storage / BILL_FILES[source].format(day)
+            key = source, day
+            try:
+                mtime = path.stat().st_mtime_ns
+            except FileNotFoundError:
+                self.frames.pop(key, None)
+                return None
+            hit = self.frames.get(key)
+            if hit is None or hit[0] != mtime:
+                hit = self.frames[key] = mtime, load(storage, day)
+                while len(self.frames) > self.max_frames:
+                    self.frames.popitem(last=False)
+            self.frames.move_to_end(key)
+            return hit[1]
+
+        return cached
+
+
+def bill(context: Context, args: Namespace) -> None:
+    module = import_module('octopus-bill')
+    start, end = (module.date(d.isoformat()) for d in (args.start, args.end))
+    data = module.load_data(start, end, context.root, context.loader(args.source))
+    module.bill(start, end, data, **context.config.octopus.charges.data)
+
+
+def gaps(context: Context, args: Namespace) -> None:
+    import pandas as pd
+    from gaps import scan
+    from loaders import SOURCES
+    found = scan(context.root, args.start, args.end, args.sources or SOURCES, args.workers)
+    with pd.option_context('display.max_rows', None, 'display.width', None):
+        print(found.to_string(index=False) if not found.empty else 'No gaps found')
+
+
+def tariff(context: Context, args: Namespace) -> None:
+    from pprint import pprint
+    pprint(dict(context.battery.get_tariff()), sort_dicts=False)
+
+
+def dispatches(context: Context, args: Namespace) -> None:
+    import asyncio
+    from pprint import pprint
+    pprint(asyncio.run(context.graphql.dispatches(context.config.octopus.account)), sort_dicts=False)
+
+
+def status(context: Context, args: Namespace) -> None:
+    kept = [name for name in ('config', 'battery', 'graphql') if name in vars(context)]
+    print(f'pid: {os.getpid()}')
+    print(f'up: {timedelta(seconds=int(monotonic() - context.started))}')
+    print(f'commands run: {context.commands}')
+    print(f"kept: {', '.join(kept) or 'nothing yet'}")
+    print(f'days of data in memory: {len(context.frames)}')
+
+
+def stop(context: Context, args: Namespace) -> None:
+    if context.shutdown is None:
+        print('no daemon running')
+    else:
+        print(f'stopping {os.getpid()}')
+        context.shutdown()
+
+
+COMMANDS: dict[str, Callable[[Context, Namespace], None]] = {
+    'bill': bill,
+    'gaps': gaps,
+    'tariff': tariff,
+    'dispatches': dispatches,
+    'status': status,
+    'stop': stop,
+}
+
+
+def make_parser() -> ArgumentParser:
+    parser = ArgumentParser(prog='energy', description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--socket', type=Path, default=default_socket())
+    parser.add_argument('--config', type=Path, default=Path('config.yaml'))
+    parser.add_argument('--local', action='store_true', help="don't use the daemon")
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default='warning')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('bill', help='what the electricity for a range of days cost')
+    command.add_argument('start', type=date.fromisoformat)
+    command.add_argument('end', type=date.fromisoformat)
+    command.add_argument('--source', choices=BILL_FILES.keys(), default='octopus')
+
+    command = commands.add_parser('gaps', help='missing readings in the storage directory')
+    command.add_argument('start', type=date.fromisoformat)
+    command.add_argument('end', type=date.fromisoformat)
+    command.add_argument('--source', action='append', dest='sources')
+    command.add_argument('--workers', type=int)
+
+    commands.add_parser('tariff', help='the tariff the Powerwall is using')
+    commands.add_parser('dispatches', help='planned and completed Intelligent Octopus dispatches')
+    commands.add_parser('status', help='what the daemon has in memory')
+    commands.add_parser('stop', help='stop the daemon')
+
+    command = commands.add_parser('daemon', help='keep things in memory for the other commands')
+    # as it was before --config applied to every command:
+    command.add_argument('--config', type=Path, default=SUPPRESS)
+    return parser
+
+
+def execute(context: Context, argv: list[str]) -> tuple[int, str]:
+    """
+    Run the command in `argv`, returning its exit status and everything it printed
+    or logged.
+    """
+    output = io.StringIO()
+    handler = logging.StreamHandler(output)
+    handler.setFormatter(logging.Formatter('%(levelname)s:%(name)s:%(message)s'))
+    root = logging.getLogger()
+    level = root.level
+    status = 0
+    with redirect_stdout(output), redirect_stderr(output):
+        try:
+            args = make_parser().parse_args(argv)
+            handler.setLevel(args.log_level.upper())
+            root.addHandler(handler)
+            root.setLevel(min(level, handler.level))
+            context.commands += 1
+            COMMANDS[args.command](context, args)
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            logging.exception(f'{argv} failed')
+            status = 1
+        finally:
+            root.removeHandler(handler)
+            root.setLevel(level)
+    return status, output.getvalue()
+
+
+class Handler(StreamRequestHandler):
+
+    def handle(self) -> None:
+        request = json.loads(self.rfile.readline())
+        argv = request['argv']
+        started = monotonic()
+        config = self.server.context.config_path
+        if request.get('config', str(config)) != str(config):
+            status, output = 1, f"daemon is using {config}, use --local for {request['config']}\n"
+        else:
+            status, output = execute(self.server.context, argv)
+        logging.info(f'{argv} -> {status} in {monotonic() - started:.3f}s')
+        self.wfile.write(json.dumps({'status': status, 'output': output}).encode() + b'\n')
+
+
+class Server(UnixStreamServer):
+
+    def __init__(self, path: Path, context: Context):
+        self.context = context
+        # shutdown() waits for the request asking for it to finish:
+        context.shutdown = lambda: Thread(target=self.shutdown).start()
+        super().__init__(str(path), Handler)
+        # the config has API keys in it, so nobody else gets to use them through this:
+        os.chmod(path, 0o600)
+
+
+def request(path: Path, argv: list[str], config: Path | None = None) -> tuple[int, str] | None:
+    """
+    Ask the daemon listening on `path` to run `argv`, or return ``None`` if there
+    isn't one. The daemon refuses if `config` isn't the config it's using.
+    """
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(str(path))
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+    with client, client.makefile('rwb') as stream:
+        message = {'argv': argv} if config is None else {'argv': argv, 'config': str(config.resolve())}
+        stream.write(json.dumps(message).encode() + b'\n')
+        stream.flush()
+        response = json.loads(stream.readline())
+    return response['status'], response['output']
+
+
+def daemon(path: Path, config: Path) -> None:
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    check_private(path.parent)
+    if request(path, ['status']) is not None:
+        raise SystemExit(f'already running on {path}')
+    path.unlink(missing_ok=True)
+    context = Context(config.resolve())
+    with Server(path, context) as server:
+        logging.info(f'listening on {path}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            path.unlink(missing_ok=True)
+
+
+def main(argv: list[str] | None = None) -> None:
+    argv = sys.argv[1:] if argv is None else argv
+    args = make_parser().parse_args(argv)
+    if args.command == 'daemon':
+        from common import configure_logging
+        configure_logging(args.log_level)
+        # so that commands asking for more detail don't also fill the daemon's log:
+        for handler in logging.getLogger().handlers:
+            handler.setLevel(args.log_level.upper())
+        daemon(args.socket, args.config)
+        return
+    response = None
+    if not args.local:
+        check_private(args.socket.parent)
+        response = request(args.socket, argv, args.config)
+    if response is None:
+        response = execute(Context(args.config), argv)
+    status, output = response
+    sys.stdout.write(output)
+    raise SystemExit(status)
+
+
+if __name__ == '__main__':
+    main()
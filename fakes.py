@@ -0,0 +1,448 @@
+"""
+Stand-ins for the Octopus, Tesla and myenergi APIs that serve the day files in a
+storage directory from localhost, so downloads, backfills and the sync loop can be run
+and timed end to end without network access or real accounts.
+
+Each fake runs an aiohttp server on its own thread and can be made slow, rate limited
+or unresponsive using :class:`Faults`. The clients are pointed at them using the
+``base_url``, ``cache_file`` and ``director`` settings in :meth:`Fakes.config`.
+"""
+import asyncio
+import json
+import logging
+from abc import ABC, abstractmethod
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Event, Thread
+from time import monotonic, time
+from typing import Self
+
+import pandas as pd
+import yaml
+from aiohttp import web
+from configurator import Config
+
+from common import add_log_level, configure_logging
+from loaders import TIMEZONE
+from octopus import PAGE_SIZE
+from synthetic import AGREEMENT, METER_SERIAL, MPAN, Spec, unit_rates
+
+ACCOUNT = 'A-FAKE0001'
+API_KEY = 'sk_fake'
+EMAIL = 'fake@example.com'
+SITE_ID = 1000000001
+HUB_SERIAL = '10000001'
+# the GraphQL API's own message, which the client looks for to know to get a new token:
+JWT_EXPIRED = 'Signature of the JWT has expired.'
+# the most readings the real API returns when no page size is asked for:
+DEFAULT_PAGE_SIZE = 100
+
+
+@dataclass
+class Faults:
+    # seconds added to every response:
+    latency: float = 0
+    # refuse every nth request with a 429:
+    throttle_every: int = 0
+    retry_after: int = 1
+    # every nth request takes `stall` seconds to answer, so clients time out:
+    stall_every: int = 0
+    stall: float = 60
+
+
+class FakeServer(ABC):
+    """
+    An aiohttp application served from a background thread on a free local port.
+    Use as a context manager, or call :meth:`start` and :meth:`stop`.
+    """
+
+    def __init__(self, root: Path, faults: Faults | None = None):
+        self.root = root
+        self.faults = faults or Faults()
+        self.requests: list[str] = []
+        self.url: str | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: Thread | None = None
+        self._runner: web.AppRunner | None = None
+
+    @abstractmethod
+    def routes(self) -> list[web.RouteDef]:
+        """The routes the fake serves."""
+
+    async def _apply_faults(self, request: web.Request, handler) -> web.StreamResponse:
+        self.requests.append(f'{request.method} {request.path_qs}')
+        count = len(self.requests)
+        faults = self.faults
+        if faults.latency:
+            await asyncio.sleep(faults.latency)
+        if faults.throttle_every and count % faults.throttle_every == 0:
+            return web.json_response(
+                {'detail': 'Request was throttled.'},
+                status=429,
+                headers={'Retry-After': str(faults.retry_after)},
+            )
+        if faults.stall_every and count % faults.stall_every == 0:
+            await asyncio.sleep(faults.stall)
+        return await handler(request)
+
+    async def _setup(self) -> None:
+        @web.middleware
+        async def faults(request: web.Request, handler) -> web.StreamResponse:
+            return await self._apply_faults(request, handler)
+
+        app = web.Application(middlewares=[faults])
+        app.add_routes(self.routes())
+        self._runner = web.AppRunner(app, access_log=None, shutdown_timeout=0.1)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, '127.0.0.1', 0).start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f'http://{host}:{port}'
+
+    def start(self) -> Self:
+        self._loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self._loop.run_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._setup(), self._loop).result()
+        logging.debug(f'{type(self).__name__} serving on {self.url}')
+        return self
+
+    async def _cleanup(self) -> None:
+        await self._runner.cleanup()
+        # requests still stalled are abandoned:
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self._cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self) -> Self:
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+def graphql_error(message: str) -> web.Response:
+    return web.json_response({'data': None, 'errors': [{'message': message}]})
+
+
+class FakeOctopus(FakeServer):
+    """
+    The REST account and consumption endpoints, serving the ``octopus-*.csv`` files,
+    and the GraphQL endpoint used by ``octopus-tesla-sync.py``, serving the latest
+    dispatch snapshot. REST paths are under ``/v1`` as on the real API.
+    """
+
+    def __init__(
+            self,
+            root: Path,
+            faults: Faults | None = None,
+            page_size: int = PAGE_SIZE,
+            token_lifetime: float = 3600,
+    ):
+        super().__init__(root, faults)
+        # the largest page that will be returned, whatever is asked for:
+        self.page_size = page_size
+        self.token_lifetime = token_lifetime
+        # token -> monotonic time it expires:
+        self.tokens: dict[str, float] = {}
+        self._readings: tuple[tuple, list[dict]] | None = None
+
+    @property
+    def base_url(self) -> str:
+        return self.url + '/v1'
+
+    def routes(self) -> list[web.RouteDef]:
+        return [
+            web.get('/v1/accounts/{account}/', self.account),
+            web.get('/v1/{endpoint}/{mpxn}/meters/{serial}/consumption/', self.consumption),
+            web.post('/v1/graphql/', self.graphql),
+        ]
+
+    async def account(self, request: web.Request) -> web.Response:
+        if request.match_info['account'] != ACCOUNT:
+            return web.json_response({'detail': 'Not found.'}, status=404)
+        return web.json_response({'number': ACCOUNT, 'properties': [{
+            'electricity_meter_points': [{
+                'mpan': MPAN,
+                'meters': [{'serial_number': METER_SERIAL}],
+                'agreements': [{
+                    'tariff_code': AGREEMENT['tariffCode'],
+                    'valid_from': '2023-01-01T00:00:00Z',
+                    'valid_to': None,
+                }],
+            }],
+            'gas_meter_points': [],
+        }]})
+
+    def readings(self, start: str | None, end: str | None, ascending: bool) -> list[dict]:
+        key = start, end, ascending
+        if self._readings is not None and self._readings[0] == key:
+            return self._readings[1]
+        start = start and pd.Timestamp(start)
+        end = end and pd.Timestamp(end)
+        paths = []
+        for path in sorted(self.root.glob('octopus-*.csv')):
+            day = pd.Timestamp(path.name[8:18])
+            # a day file holds local days, so allow for being a day either side:
+            if (start and day.date() < start.date() - pd.Timedelta(days=1)) or \
+                    (end and day.date() > end.date() + pd.Timedelta(days=1)):
+                continue
+            paths.append(path)
+        columns = ['interval_start', 'interval_end', 'consumption']
+        if not paths:
+            return []
+        frame = pd.concat([pd.read_csv(path, usecols=columns) for path in paths])
+        frame['utc'] = pd.to_datetime(frame['interval_start'], utc=True)
+        frame = frame.drop_duplicates('utc')
+        if start:
+            frame = frame[frame['utc'] >= start]
+        if end:
+            frame = frame[frame['utc'] < end]
+        readings = frame.sort_values('utc', ascending=ascending)[columns].to_dict('records')
+        self._readings = key, readings
+        return readings
+
+    async def consumption(self, request: web.Request) -> web.Response:
+        query = request.query
+        readings = self.readings(
+            query.get('period_from'), query.get('period_to'), query.get('order_by') == 'period'
+        )
+        page = int(query.get('page', 1))
+        size = min(int(query.get('page_size', DEFAULT_PAGE_SIZE)), self.page_size)
+        start = (page - 1) * size
+        more = start + size < len(readings)
+        return web.json_response({
+            'count': len(readings),
+            'next': str(request.url.update_query(page=page + 1)) if more else None,
+            'previous': str(request.url.update_query(page=page - 1)) if page > 1 else None,
+            'results': readings[start:start + size],
+        })
+
+    def expire_tokens(self) -> None:
+        for token in self.tokens:
+            self.tokens[token] = 0
+
+    def dispatches(self) -> dict:
+        snapshots = sorted(self.root.glob('octopus-dispatches-*.json'))
+        if not snapshots:
+            return {'plannedDispatches': [], 'completedDispatches': []}
+        state = json.loads(snapshots[-1].read_text())
+        # older snapshots only recorded the dispatches:
+        return state.get('dispatches', state)
+
+    def tariff(self) -> dict:
+        return {'account': {'electricityAgreements': [{
+            'validFrom': '2023-01-01T00:00:00+00:00',
+            'validTo': None,
+            'tariff': AGREEMENT | {'unitRates': unit_rates(pd.Timestamp.now(tz=TIMEZONE))},
+        }]}}
+
+    async def graphql(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        operation = body.get('operationName')
+        if operation == 'krakenTokenAuthentication':
+            if body['variables']['apiKey'] != API_KEY:
+                return graphql_error('Invalid data.')
+            token = f'fake-jwt-{len(self.tokens)}'
+            self.tokens[token] = monotonic() + self.token_lifetime
+            return web.json_response({'data': {'obtainKrakenToken': {'token': token}}})
+        expires = self.tokens.get(request.headers.get('Authorization'))
+        if expires is None:
+            return graphql_error('Authentication credentials were not provided.')
+        if expires <= monotonic():
+            return graphql_error(JWT_EXPIRED)
+        if operation == 'getCombinedData':
+            return web.json_response({'data': self.dispatches()})
+        if operation == 'getProperties':
+            return web.json_response({'data': self.tariff()})
+        return graphql_error(f'Unknown operation {operation!r}')
+
+
+class FakeTesla(FakeServer):
+    """
+    The owner API endpoints used for a single battery, serving the ``tesla-*.json``
+    files as calendar history and keeping whatever tariff is set.
+    """
+
+    def __init__(self, root: Path, faults: Faults | None = None, tz: str = TIMEZONE):
+        super().__init__(root, faults)
+        self.tz = tz
+        self.tariff: dict = {'code': 'FAKE', 'seasons': {}}
+
+    def routes(self) -> list[web.RouteDef]:
+        site = '/api/1/energy_sites/{site_id}'
+        return [
+            web.get('/api/1/products', self.products),
+            web.get(site + '/site_info', self.site_info),
+            web.get(site + '/calendar_history', self.calendar_history),
+            web.get(site + '/tariff_rate', self.get_tariff),
+            web.post(site + '/time_of_use_settings', self.set_tariff),
+        ]
+
+    def write_cache(self, path: Path, email: str = EMAIL) -> None:
+        """
+        Write a teslapy token cache for `email` that won't need refreshing.
+        """
+        token = {
+            'access_token': 'fake-access-token',
+            'refresh_token': 'fake-refresh-token',
+            'token_type': 'Bearer',
+            'expires_in': 8 * 3600,
+            'expires_at': time() + 365 * 24 * 3600,
+        }
+        path.write_text(json.dumps({email: {'url': 'https://auth.tesla.com/', 'sso': token}}))
+
+    @staticmethod
+    def authorised(request: web.Request) -> bool:
+        return request.headers.get('Authorization', '').startswith('Bearer ')
+
+    @staticmethod
+    def response(data, status=200) -> web.Response:
+        return web.json_response({'response': data}, status=status)
+
+    async def products(self, request: web.Request) -> web.Response:
+        if not self.authorised(request):
+            return self.response(None, status=401)
+        return self.response([{
+            'energy_site_id': SITE_ID,
+            'resource_type': 'battery',
+            'site_name': 'Synthetic',
+            'id': 'STE00000000-00000',
+        }])
+
+    async def site_info(self, request: web.Request) -> web.Response:
+        return self.response({
+            'id': 'STE00000000-00000',
+            'site_name': 'Synthetic',
+            'installation_time_zone': self.tz,
+            'backup_reserve_percent': 20,
+            'max_site_meter_power_ac': 1000000000,
+        })
+
+    async def calendar_history(self, request: web.Request) -> web.Response:
+        day = pd.Timestamp(request.query['end_date']).date()
+        path = self.root / f'tesla-{day:%Y-%m-%d}.json'
+        if not path.exists():
+            return self.response({})
+        return self.response(json.loads(path.read_text())['data'])
+
+    async def get_tariff(self, request: web.Request) -> web.Response:
+        return self.response(self.tariff)
+
+    async def set_tariff(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.tariff = body['tou_settings']['tariff_content']
+        return self.response({'code': 201, 'message': 'Updated'})
+
+
+class FakeMyEnergi(FakeServer):
+    """
+    The director, which says which server to use, and the day endpoint, serving the
+    ``zappi-*.json`` files. Both are the same server here.
+    """
+
+    def __init__(self, root: Path, faults: Faults | None = None, zappi_serial: str = Spec.zappi_serial):
+        super().__init__(root, faults)
+        self.zappi_serial = zappi_serial
+
+    def routes(self) -> list[web.RouteDef]:
+        return [
+            web.get('/cgi-jstatus-{which}', self.status),
+            web.get(r'/cgi-jday-Z{serial:\d+}-{year:\d+}-{month:\d+}-{day:\d+}', self.day),
+        ]
+
+    async def status(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            [{'zappi': [{'sno': int(self.zappi_serial)}]}],
+            headers={'x_myenergi-asn': request.host},
+        )
+
+    async def day(self, request: web.Request) -> web.Response:
+        serial = request.match_info['serial']
+        path = self.root / 'zappi-{year}-{month}-{day}.json'.format(**request.match_info)
+        if serial != self.zappi_serial or not path.exists():
+            return web.json_response({f'U{serial}': []})
+        return web.Response(text=path.read_text(), content_type='application/json')
+
+
+class Fakes:
+    """
+    All three fakes, serving the same storage directory with the same faults.
+    """
+
+    def __init__(self, root: Path, faults: Faults | None = None, **octopus):
+        self.octopus = FakeOctopus(root, faults, **octopus)
+        self.tesla = FakeTesla(root, faults)
+        self.myenergi = FakeMyEnergi(root, faults)
+        self.servers = [self.octopus, self.tesla, self.myenergi]
+
+    def __enter__(self) -> Self:
+        for server in self.servers:
+            server.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        for server in self.servers:
+            server.stop()
+
+    def config(self, storage: Path, cache_file: Path) -> Config:
+        """
+        Configuration that downloads from the fakes into `storage`, writing the Tesla
+        token cache to `cache_file`.
+        """
+        self.tesla.write_cache(cache_file)
+        return Config({
+            'directories': {'incoming': str(storage), 'storage': str(storage)},
+            'octopus': {'api_key': API_KEY, 'account': ACCOUNT, 'base_url': self.octopus.base_url},
+            'tesla': {'email': EMAIL, 'base_url': self.tesla.url + '/', 'cache_file': str(cache_file)},
+            'myenergi': {
+                'hub_serial': HUB_SERIAL,
+                'api_key': API_KEY,
+                'zappi_serial': self.myenergi.zappi_serial,
+                'director': self.myenergi.url,
+            },
+        })
+
+
+def main():
+    parser = ArgumentParser(description='Serve a storage directory through stand-ins for the APIs.')
+    parser.add_argument('root', type=Path, help='storage directory to serve')
+    parser.add_argument('storage', type=Path, help='storage directory to download into')
+    parser.add_argument('--config', type=Path, default=Path('config.fakes.yaml'),
+                        help='where to write config that uses the fakes')
+    parser.add_argument('--latency', type=float, default=Faults.latency)
+    parser.add_argument('--throttle-every', type=int, default=Faults.throttle_every)
+    parser.add_argument('--retry-after', type=int, default=Faults.retry_after)
+    parser.add_argument('--stall-every', type=int, default=Faults.stall_every)
+    parser.add_argument('--stall', type=float, default=Faults.stall)
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE)
+    parser.add_argument('--token-lifetime', type=float, default=3600)
+    add_log_level(parser)
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    faults = Faults(args.latency, args.throttle_every, args.retry_after, args.stall_every, args.stall)
+    with Fakes(args.root, faults, page_size=args.page_size, token_lifetime=args.token_lifetime) as fakes:
+        args.config.parent.mkdir(parents=True, exist_ok=True)
+        args.storage.mkdir(parents=True, exist_ok=True)
+        config = fakes.config(args.storage.resolve(), args.config.resolve().with_suffix('.cache.json'))
+        # written in one go, as soak.py waits for it to appear:
+        tmp = args.config.with_name(f'.{args.config.name}')
+        tmp.write_text(yaml.safe_dump(config.data))
+        tmp.replace(args.config)
+        logging.info(f'Wrote {args.config}, serving until interrupted')
+        try:
+            Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Find missing readings across the storage directory, for any range and any of the
+sources in :data:`loaders.SOURCES`, producing a table of gaps with one row for each
+run of consecutive missing slots.
+"""
+import logging
+from argparse import ArgumentParser
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+from configurator import Config
+
+from common import add_log_level, configure_logging, root_from, TimestampArg
+from ingest import read_stats, stats_path
+from loaders import SOURCES, TIMEZONE, Source, load_day
+
+COLUMNS = ['source', 'start', 'end', 'missing']
+
+
+def expected_slots(day: date, interval: pd.Timedelta, tz: str = TIMEZONE) -> pd.DatetimeIndex:
+    """
+    The start of every slot on `day` in `tz`, in UTC, allowing for DST changes.
+    """
+    start = pd.Timestamp(day, tz=tz)
+    end = pd.Timestamp(day + pd.Timedelta(days=1), tz=tz)
+    return pd.date_range(start, end, freq=interval, inclusive='left').tz_convert('UTC')
+
+
+def missing_slots(
+        timestamps: pd.DatetimeIndex, day: date, interval: pd.Timedelta, tz: str = TIMEZONE
+) -> pd.DatetimeIndex:
+    return expected_slots(day, interval, tz).difference(timestamps.tz_convert('UTC'))
+
+
+def runs(source: str, missing: pd.DatetimeIndex, interval: pd.Timedelta) -> pd.DataFrame:
+    """
+    Collapse missing slots into rows of `source`, `start`, `end` and `missing`,
+    where `end` is the end of the last missing slot.
+    """
+    if missing.empty:
+        return pd.DataFrame(columns=COLUMNS)
+    slots = pd.Series(missing.sort_values())
+    grouped = slots.groupby((slots.diff() != interval).cumsum())
+    return pd.DataFrame({
+        'source': source,
+        'start': grouped.min(),
+        'end': grouped.max() + interval,
+        'missing': grouped.size(),
+    }).reset_index(drop=True)
+
+
+def complete_from_stats(root: Path, source: Source, day: date, expected: pd.DatetimeIndex) -> bool:
+    """
+    Use the statistics sidecar, if it's up to date, to spot a complete day without
+    loading its data.
+    """
+    raw_path = source.raw_path(root, day)
+    stats = read_stats(root, source.name, day)
+    if raw_path is None or stats is None:
+        return False
+    if stats_path(root, source.name, day).stat().st_mtime_ns < raw_path.stat().st_mtime_ns:
+        return False
+    return (
+        stats['rows'] == len(expected)
+        and pd.Timestamp(stats['first']) == expected[0]
+        and pd.Timestamp(stats['last']) == expected[-1]
+    )
+
+
+def check_days(root: Path, source_name: str, days: list[date]) -> pd.DataFrame:
+    source = SOURCES[source_name]
+    found = []
+    for day in days:
+        expected = expected_slots(day, source.interval, source.tz)
+        if complete_from_stats(root, source, day, expected):
+            continue
+        frame = load_day(root, source, day)
+        if frame is None:
+            missing = expected
+        else:
+            missing = expected.difference(frame.index)
+        found.append(runs(source.name, missing, source.interval))
+    return merge(found)
+
+
+def merge(tables: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Combine gap tables, joining runs that carry on from one day to the next.
+    """
+    tables = [t for t in tables if not t.empty]
+    if not tables:
+        return pd.DataFrame(columns=COLUMNS)
+    table = pd.concat(tables).sort_values(['source', 'start'], ignore_index=True)
+    new_run = (table['source'] != table['source'].shift()) | (table['start'] != table['end'].shift())
+    return table.groupby(new_run.cumsum()).agg(
+        {'source': 'first', 'start': 'first', 'end': 'last', 'missing': 'sum'}
+    ).reset_index(drop=True)
+
+
+def scan(
+        root: Path,
+        start: date,
+        end: date,
+        sources: Iterable[str] = SOURCES,
+        workers: int | None = None,
+) -> pd.DataFrame:
+    """
+    The gaps in each of `sources` from `start` to `end` inclusive.
+    """
+    days = [ts.date() for ts in pd.date_range(start, end, freq='D')]
+    # a month at a time keeps the per-task overhead down:
+    chunks = [
+        (source, days[i:i + 31]) for source in sources for i in range(0, len(days), 31)
+    ]
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(check_days, root, source, chunk) for source, chunk in chunks]
+        return merge(future.result() for future in futures)
+
+
+def read_gaps(path: Path) -> pd.DataFrame:
+    gaps = pd.read_csv(path)
+    gaps['start'] = pd.to_datetime(gaps['start'], utc=True)
+    gaps['end'] = pd.to_datetime(gaps['end'], utc=True)
+    return gaps
+
+
+def main():
+    config = Config.from_path('config.yaml')
+    root = root_from(config)
+
+    parser = ArgumentParser(description='Report missing readings in the storage directory.')
+    timestamp = TimestampArg(root, 'octopus-%Y-%m-%d.csv')
+    timestamp.add_argument(parser, 'start')
+    timestamp.add_argument(parser, 'end')
+    parser.add_argument('--source', choices=SOURCES.keys(), action='append', dest='sources')
+    parser.add_argument('--csv', type=Path, help='path to write the gap table to')
+    parser.add_argument('--workers', type=int)
+    add_log_level(parser)
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    start = min(args.start, args.end).date()
+    end = max(args.start, args.end).date()
+    gaps = scan(root, start, end, args.sources or SOURCES, args.workers)
+    if args.csv:
+        gaps.to_csv(args.csv, index=False)
+        logging.info(f'Wrote {len(gaps)} gaps to {args.csv}')
+    else:
+        with pd.option_context('display.max_rows', None, 'display.width', None):
+            print(gaps.to_string(index=False) if not gaps.empty else 'No gaps found')
+
+
+if __name__ == '__main__':
+    main()
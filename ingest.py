@@ -0,0 +1,158 @@
+"""
+The work done once a day file for a source has arrived, so later reads find it
+pre-processed:
+
+- the raw file is read and the resulting frame pickled for fast loading,
+- a per-day statistics sidecar is written under ``stats/``,
+- the hourly, daily and monthly rollups, and the table of daily peaks, are refreshed.
+
+The first two are done for each day in parallel on a process pool; the rollups
+for each source are then updated once for the whole batch. Days whose raw file
+hasn't changed since they were last processed are skipped.
+"""
+import json
+import logging
+from collections import defaultdict
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+from pathlib import Path
+from time import perf_counter
+
+import pandas as pd
+from configurator import Config
+from pandas import Timestamp, date_range
+
+import rollups
+from common import main, collect
+from loaders import SOURCES, TIMEZONE, load_day, save_day
+from metrics import PROCESS_DAYS, PROCESS_SECONDS
+
+
+def stats_path(root: Path, source: str, day: date) -> Path:
+    return root / 'stats' / f'{source}-{day:%Y-%m-%d}.json'
+
+
+def day_stats(frame: pd.DataFrame) -> dict:
+    stats = {
+        'rows': len(frame),
+        'first': frame.index.min().isoformat() if len(frame) else None,
+        'last': frame.index.max().isoformat() if len(frame) else None,
+        'columns': {},
+    }
+    for column, values in frame.items():
+        stats['columns'][column] = {
+            'sum': float(values.sum()),
+            'min': float(values.min()),
+            'max': float(values.max()),
+            'mean': float(values.mean()),
+            'count': int(values.count()),
+        }
+    return stats
+
+
+def read_stats(root: Path, source: str, day: date) -> dict | None:
+    path = stats_path(root, source, day)
+    if path.exists():
+        return json.loads(path.read_text())
+    return None
+
+
+def changed(root: Path, source: str, day: date) -> bool:
+    """
+    Whether there's a raw file for `day` that's newer than its statistics sidecar,
+    which is written last when a day is processed.
+    """
+    raw_path = SOURCES[source].raw_path(root, day)
+    if raw_path is None:
+        return False
+    try:
+        processed = stats_path(root, source, day).stat().st_mtime_ns
+    except FileNotFoundError:
+        return True
+    return raw_path.stat().st_mtime_ns > processed
+
+
+def local_readings(root: Path, source: str, day: date, frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    The readings for the whole of each local day that `frame`, from the file for
+    `day`, has readings in. For a source whose files cover UTC days, some of those
+    are in the files either side.
+    """
+    local = frame.tz_convert(TIMEZONE)
+    days = sorted(set(local.index.date))
+    if not days:
+        return local
+    start, end = days[0], days[-1] + timedelta(days=1)
+    frames = [
+        frame if file_day == day else load_day(root, SOURCES[source], file_day)
+        for file_day in SOURCES[source].file_days(start, end)
+    ]
+    readings = pd.concat([f for f in frames if f is not None]).tz_convert(TIMEZONE)
+    return readings[(readings.index >= pd.Timestamp(start, tz=TIMEZONE))
+                    & (readings.index < pd.Timestamp(end, tz=TIMEZONE))]
+
+
+def process_day(root: Path, source: str, day: date) -> tuple[pd.DataFrame, pd.DataFrame] | None:
+    """
+    Convert and write the statistics for one day, returning its hourly rollup and
+    the rows of the peaks table for the local days it has readings in.
+    """
+    frame = save_day(root, SOURCES[source], day)
+    if frame is None:
+        return None
+    path = stats_path(root, source, day)
+    path.parent.mkdir(exist_ok=True)
+    path.write_text(json.dumps(day_stats(frame), indent=4))
+    readings = local_readings(root, source, day, frame)
+    return rollups.hourly(frame), rollups.day_peaks(readings, SOURCES[source].interval)
+
+
+class Pipeline:
+
+    def __init__(self, root: Path, workers: int | None = None):
+        self.root = root
+        self.workers = workers
+
+    def run(self, days: Iterable[tuple[str, date]], force: bool = False) -> None:
+        started = perf_counter()
+        days = set(days)
+        todo = [(source, day) for source, day in days if force or changed(self.root, source, day)]
+        if len(todo) < len(days):
+            logging.debug(f'{len(days) - len(todo)} days have no new data')
+        hours = defaultdict(dict)
+        peaks = defaultdict(dict)
+        with ProcessPoolExecutor(self.workers) as executor:
+            futures = {
+                executor.submit(process_day, self.root, source, day): (source, day)
+                for source, day in todo
+            }
+            for future in as_completed(futures):
+                source, day = futures[future]
+                try:
+                    processed = future.result()
+                except Exception:
+                    logging.exception(f'Could not process {source} for {day}')
+                else:
+                    if processed is not None:
+                        hours[source][day], peaks[source][day] = processed
+                        logging.debug(f'processed {source} for {day}')
+        for source, source_hours in hours.items():
+            rollups.update(self.root, source, source_hours)
+            rollups.update_peaks(self.root, source, peaks[source])
+            PROCESS_DAYS.labels(source).inc(len(source_hours))
+            logging.info(f'processed {len(source_hours)} days of {source}')
+        PROCESS_SECONDS.observe(perf_counter() - started)
+
+
+def process(config: Config, start: Timestamp, end: Timestamp, root: Path, force: bool = False) -> None:
+    days = [ts.date() for ts in date_range(start, end, freq='D')]
+    Pipeline(root).run(((source, day) for source in SOURCES for day in days), force)
+
+
+def reprocess(config: Config, start: Timestamp, end: Timestamp, root: Path) -> None:
+    process(config, start, end, root, force=True)
+
+
+if __name__ == '__main__':
+    main(collect(process, reprocess), 'octopus-%Y-%m-%d.csv')
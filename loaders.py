@@ -1,20 +1,281 @@
+import json
+import logging
+import os
+from dataclasses import dataclass
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
 import pandas as pd
 
+# how far a float column can move when stored as float32, in its own units:
+FLOAT32_TOLERANCE = 1e-3
+MiB = 1024 * 1024
+INT32 = np.iinfo('int32')
+
 
-def load_octopus(storage, date):
-    return pd.read_csv(storage / f'octopus-{date}.csv',
-                       index_col='interval_start', parse_dates=['interval_start', 'interval_end'])
+def load_octopus(storage, date, columns=None, compacted=False):
+    parse_dates = ['interval_start']
+    if columns is None or 'interval_end' in columns:
+        parse_dates.append('interval_end')
+    octopus = pd.read_csv(storage / f'octopus-{date}.csv',
+                          usecols=None if columns is None else ['interval_start', *columns],
+                          index_col='interval_start', parse_dates=parse_dates)
+    return compact(octopus) if compacted else octopus
 
 
-def load_tesla(storage, date):
-    tesla = pd.read_csv(storage / f'tesla-{date}.csv',
-                        index_col='Date time',
-                        parse_dates=['Date time'],
-                        date_parser=lambda col: pd.to_datetime(col, utc=True))
+def load_tesla(storage, date, columns=None, compacted=False):
+    # the grid column is always needed, to work out consumption:
+    usecols = None if columns is None else ['Date time', 'Grid (kW)', *(
+        c for c in columns if c not in ('Grid (kW)', 'consumption')
+    )]
+    tesla = pd.read_csv(storage / f'tesla-{date}.csv', index_col='Date time', usecols=usecols)
+    tesla.index = pd.to_datetime(tesla.index, utc=True)
     # blank out any energy sent back to the grid, octopus is consumption only:
     tesla[tesla['Grid (kW)']<0] = 0
     # Tesla provide power flow every 5 mins, let's assume that represents the continous
     # consumption for the next 5 mins, and then resample to half-hours to match Octopus:
-    tesla = (tesla*5/60).resample('30T').sum()
+    tesla = (tesla*5/60).resample('30min').sum()
     tesla['consumption'] = tesla['Grid (kW)']
-    return tesla
+    tesla = tesla if columns is None else tesla[columns]
+    return compact(tesla) if compacted else tesla
+
+
+TIMEZONE = 'Europe/London'
+
+# The Tesla app's export uses different names, and kW rather than W:
+TESLA_APP_COLUMNS = {
+    'Home (kW)': 'load_power',
+    'Solar (kW)': 'solar_power',
+    'Powerwall (kW)': 'battery_power',
+    'Grid (kW)': 'grid_power',
+}
+
+ZAPPI_DATE_PARTS = {'yr': 'year', 'mon': 'month', 'dom': 'day', 'hr': 'hour', 'min': 'minute'}
+ZAPPI_KW_FIELDS = ('imp', 'h1b', 'h1d', 'exp', 'nect1', 'pect1', 'gen', 'gep')
+
+
+def compact(frame: pd.DataFrame, tolerance: float = FLOAT32_TOLERANCE) -> pd.DataFrame:
+    """
+    `frame` with each column in a smaller type that holds its values: integers in
+    int32 where they fit, floats as float32 where that moves none of them by more than
+    `tolerance`, and strings that repeat as categoricals.
+
+    Floats stay floats even when they're all whole numbers, and integers go no smaller
+    than int32, so that arithmetic on the result doesn't overflow.
+    """
+    compacted = {}
+    for column, values in frame.items():
+        if pd.api.types.is_bool_dtype(values):
+            pass
+        elif pd.api.types.is_integer_dtype(values):
+            if values.min() >= INT32.min and values.max() <= INT32.max:
+                values = values.astype('int32')
+        elif pd.api.types.is_float_dtype(values):
+            single = values.astype('float32')
+            if not (single.astype('float64') - values).abs().max() > tolerance:
+                values = single
+        elif pd.api.types.is_string_dtype(values) or values.dtype == object:
+            if values.nunique() <= len(values) // 2:
+                values = values.astype('category')
+        compacted[column] = values
+    return pd.DataFrame(compacted, index=frame.index)
+
+
+def memory(frame: pd.DataFrame) -> int:
+    """
+    The bytes used by `frame`, including its index and the contents of any strings.
+    """
+    return int(frame.memory_usage(deep=True).sum())
+
+
+def numeric(frame: pd.DataFrame) -> pd.DataFrame:
+    return frame.select_dtypes('number').rename_axis('timestamp').sort_index()
+
+
+def read_octopus(path: Path) -> pd.DataFrame:
+    frame = pd.read_csv(path).drop(columns=['mpan', 'mprn', 'meter_serial'], errors='ignore')
+    frame.index = pd.DatetimeIndex(pd.to_datetime(frame.pop('interval_start'), utc=True))
+    return numeric(frame)
+
+
+def read_tesla(path: Path) -> pd.DataFrame:
+    if path.suffix == '.json':
+        frame = pd.DataFrame(json.loads(path.read_bytes())['data']['time_series'])
+        timestamps = frame.pop('timestamp')
+    else:
+        frame = pd.read_csv(path)
+        if 'Date time' in frame.columns:
+            timestamps = frame.pop('Date time')
+            frame = frame.rename(columns=TESLA_APP_COLUMNS)
+            frame[list(TESLA_APP_COLUMNS.values())] *= 1000
+        else:
+            timestamps = frame.pop('timestamp')
+    frame.index = pd.DatetimeIndex(pd.to_datetime(timestamps, utc=True))
+    return numeric(frame)
+
+
+def read_zappi(path: Path) -> pd.DataFrame:
+    if path.suffix == '.json':
+        data = json.loads(path.read_bytes())
+        records, = (value for key, value in data.items() if key.startswith('U'))
+        frame = pd.DataFrame(records)
+        parts = frame[[p for p in ZAPPI_DATE_PARTS if p in frame.columns]]
+        parts = parts.rename(columns=ZAPPI_DATE_PARTS).reindex(
+            columns=list(ZAPPI_DATE_PARTS.values()), fill_value=0
+        ).fillna(0)
+        frame = frame.drop(columns=[*ZAPPI_DATE_PARTS, 'dow'], errors='ignore')
+        frame.index = pd.DatetimeIndex(pd.to_datetime(parts, utc=True))
+        # match myenergi.json_to_csv:
+        frame = frame.reindex(columns=frame.columns.union(ZAPPI_KW_FIELDS, sort=False))
+        frame[list(ZAPPI_KW_FIELDS)] = frame[list(ZAPPI_KW_FIELDS)].fillna(0)
+        frame['volts'] = frame['v1'].fillna(0) / 10 if 'v1' in frame.columns else 0.
+        for key in ZAPPI_KW_FIELDS:
+            frame[f'{key}_kw'] = (frame[key] / 60) / 1000
+    else:
+        frame = pd.read_csv(path)
+        frame.index = pd.DatetimeIndex(pd.to_datetime(frame.pop('datetime'), utc=True))
+    return numeric(frame)
+
+
+@dataclass(frozen=True)
+class Source:
+    """
+    A kind of interval data downloaded into the storage directory as one file per day.
+    """
+    name: str
+    interval: pd.Timedelta
+    # raw day file names, in order of preference:
+    patterns: tuple[str, ...]
+    read: Callable[[Path], pd.DataFrame]
+    # the time zone whose days the files cover:
+    tz: str = TIMEZONE
+
+    def raw_path(self, root: Path, day: date) -> Path | None:
+        for pattern in self.patterns:
+            path = root / day.strftime(pattern)
+            if path.exists():
+                return path
+        return None
+
+    def frame_path(self, root: Path, day: date) -> Path:
+        return root / 'frames' / f'{self.name}-{day:%Y-%m-%d}.pkl'
+
+    def file_days(self, start: date, end: date) -> list[date]:
+        """
+        The days of the files holding the readings from the local `start` up to but
+        not including the local `end`, which start a day earlier in summer for files
+        covering UTC days.
+        """
+        first, after = (pd.Timestamp(d, tz=TIMEZONE).tz_convert(self.tz) for d in (start, end))
+        first, last = first.date(), (after - self.interval).date()
+        return [first + timedelta(days=i) for i in range((last - first).days + 1)]
+
+
+SOURCES = {source.name: source for source in (
+    Source(
+        'octopus',
+        pd.Timedelta(minutes=30),
+        ('octopus-%Y-%m-%d.csv', 'octopus-%Y-%m-%d-suspect.csv'),
+        read_octopus,
+    ),
+    Source(
+        'tesla',
+        pd.Timedelta(minutes=5),
+        ('tesla-%Y-%m-%d.json', 'tesla-%Y-%m-%d.csv'),
+        read_tesla,
+    ),
+    Source(
+        'zappi',
+        pd.Timedelta(minutes=1),
+        ('zappi-%Y-%m-%d.json', 'zappi-%Y-%m-%d.csv'),
+        read_zappi,
+        # the myenergi API works in UTC days:
+        'UTC',
+    ),
+)}
+
+
+def load_day(
+        root: Path,
+        source: Source,
+        day: date,
+        columns: list[str] | None = None,
+        compacted: bool = False,
+) -> pd.DataFrame | None:
+    """
+    The numeric data for `day` from `source`, indexed by UTC timestamp, or ``None`` if
+    there's no file for that day. The pickled frame written by :func:`save_day` is used
+    unless the raw file has changed since.
+
+    Only `columns` are returned, if given, and they're passed through :func:`compact`
+    if `compacted` is true.
+    """
+    raw_path = source.raw_path(root, day)
+    frame_path = source.frame_path(root, day)
+    frame = None
+    try:
+        frame_mtime = frame_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        pass
+    else:
+        if raw_path is None or raw_path.stat().st_mtime_ns <= frame_mtime:
+            frame = pd.read_pickle(frame_path)
+    if frame is None:
+        if raw_path is None:
+            return None
+        frame = source.read(raw_path)
+    if columns is not None:
+        frame = frame[columns]
+    return compact(frame) if compacted else frame
+
+
+def load_range(
+        root: Path,
+        source: Source,
+        start: date,
+        end: date,
+        columns: list[str] | None = None,
+        compacted: bool = True,
+) -> pd.DataFrame:
+    """
+    The data from `source` for the days from `start` up to but not including `end`,
+    one day at a time so that only the columns and types wanted are ever held for more
+    than a day. How much memory the result takes is logged.
+    """
+    frames = []
+    loaded = 0
+    for i in range((end - start).days):
+        frame = load_day(root, source, start + timedelta(days=i), columns)
+        if frame is not None:
+            loaded += memory(frame)
+            frames.append(compact(frame) if compacted else frame)
+    if not frames:
+        return pd.DataFrame(index=pd.DatetimeIndex([], tz='UTC', name='timestamp'), columns=columns)
+    # days whose columns compacted to different types are combined in a wider one:
+    frame = pd.concat(frames)
+    if compacted:
+        frame = compact(frame)
+    logging.info(
+        f'{source.name} from {start} to {end}: {len(frame):,} rows of {len(frame.columns)} columns '
+        f'in {memory(frame) / MiB:.1f}MiB, {loaded / MiB:.1f}MiB before compacting'
+    )
+    return frame
+
+
+def save_day(root: Path, source: Source, day: date) -> pd.DataFrame | None:
+    """
+    Read the raw file for `day` and pickle the resulting frame for fast loading.
+    """
+    raw_path = source.raw_path(root, day)
+    if raw_path is None:
+        return None
+    frame = source.read(raw_path)
+    frame_path = source.frame_path(root, day)
+    frame_path.parent.mkdir(exist_ok=True)
+    # replaced in one go, as the neighbouring days may be read while it's written:
+    tmp = frame_path.with_name(f'.{frame_path.name}.{os.getpid()}')
+    frame.to_pickle(tmp)
+    tmp.replace(frame_path)
+    return frame
@@ -0,0 +1,128 @@
+"""
+Data for plotting long ranges at the detail a plot can show, rather than pushing
+millions of readings into matplotlib.
+
+A range is cut into no more buckets than there are points to spare, and each
+column is reduced to its min, max and mean over each bucket, so peaks survive however
+far out the plot is zoomed. Buckets of an hour or more are built from the hourly,
+daily and monthly :mod:`rollups`, so a multi-year plot reads a few tables rather than
+a file for every day; shorter buckets are built from the readings themselves.
+Bucket sizes are rounded up to ones that line up with those periods, such as 5 minutes,
+6 hours or a day, so a plot may get somewhat fewer points than it allows.
+"""
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+
+import rollups
+from loaders import SOURCES, TIMEZONE, load_day
+
+# about the width of a plot in pixels:
+POINTS = 2000
+# bucket sizes, the longest each can be, and the rollup level they can be built from:
+STEPS = (
+    ('1min', pd.Timedelta(minutes=1), None),
+    ('2min', pd.Timedelta(minutes=2), None),
+    ('5min', pd.Timedelta(minutes=5), None),
+    ('10min', pd.Timedelta(minutes=10), None),
+    ('15min', pd.Timedelta(minutes=15), None),
+    ('30min', pd.Timedelta(minutes=30), None),
+    ('h', pd.Timedelta(hours=1), 'hour'),
+    ('2h', pd.Timedelta(hours=2), 'hour'),
+    ('3h', pd.Timedelta(hours=3), 'hour'),
+    ('6h', pd.Timedelta(hours=6), 'hour'),
+    ('12h', pd.Timedelta(hours=12), 'hour'),
+    ('D', pd.Timedelta(hours=25), 'day'),
+    ('2D', pd.Timedelta(hours=49), 'day'),
+    ('7D', pd.Timedelta(days=7, hours=1), 'day'),
+    ('14D', pd.Timedelta(days=14, hours=1), 'day'),
+    ('MS', pd.Timedelta(days=31), 'month'),
+    ('3MS', pd.Timedelta(days=92), 'month'),
+    ('YS', pd.Timedelta(days=366), 'month'),
+)
+
+
+def step_for(width: pd.Timedelta) -> tuple[str, str | None]:
+    """
+    The smallest bucket size no shorter than `width`, along with the rollup level to
+    build it from, or ``None`` if the readings themselves are needed.
+    """
+    for freq, longest, level in STEPS:
+        if longest >= width:
+            return freq, level
+    return freq, level
+
+
+def readings(root: Path, source: str, start: date, end: date, columns: list[str] | None) -> pd.DataFrame:
+    """
+    The readings from the local `start` up to but not including `end`, as rows of
+    one-reading rollups so they can be bucketed in the same way as the rollup tables.
+    """
+    days = SOURCES[source].file_days(start, end)
+    frames = [f for f in (load_day(root, SOURCES[source], d, columns or None) for d in days) if f is not None]
+    if not frames:
+        return pd.DataFrame(index=pd.DatetimeIndex([], tz=TIMEZONE))
+    frame = pd.concat(frames).tz_convert(TIMEZONE)
+    first, last = (pd.Timestamp(d, tz=TIMEZONE) for d in (start, end))
+    frame = frame[(frame.index >= first) & (frame.index < last)]
+    return pd.concat({
+        f'{column}_{stat}': values if stat != 'count' else values.notna().astype(int)
+        for column, values in frame.items()
+        for stat in rollups.STATS
+    }, axis=1)
+
+
+def bucket(table: pd.DataFrame, freq: str) -> pd.DataFrame:
+    """
+    Combine the rows of a table shaped like a rollup into local buckets of `freq`,
+    giving the min, max and mean of each column.
+    """
+    if table.empty:
+        return pd.DataFrame(index=pd.DatetimeIndex([], tz=TIMEZONE))
+    how = {column: rollups.COMBINE[column.rsplit('_', 1)[1]] for column in table.columns}
+    combined = table.resample(freq).agg(how)
+    result = {}
+    for column in dict.fromkeys(c.rsplit('_', 1)[0] for c in table.columns):
+        count = combined[f'{column}_count']
+        result[f'{column}_min'] = combined[f'{column}_min'].where(count > 0)
+        result[f'{column}_max'] = combined[f'{column}_max'].where(count > 0)
+        result[f'{column}_mean'] = combined[f'{column}_sum'] / count.where(count > 0)
+    return pd.DataFrame(result).dropna(how='all')
+
+
+def plot_data(
+        root: Path,
+        source: str,
+        start: date,
+        end: date,
+        columns: list[str] | None = None,
+        points: int = POINTS,
+) -> pd.DataFrame:
+    """
+    The min, max and mean of each column of `source` in no more than `points`
+    buckets from `start` up to but not including `end`, indexed by the local start of
+    each bucket. Columns are named ``{column}_min``, ``{column}_max`` and
+    ``{column}_mean``.
+    """
+    first, last = (pd.Timestamp(d, tz=TIMEZONE) for d in (start, end))
+    freq, level = step_for(max((last - first) / points, SOURCES[source].interval))
+    if level is None:
+        table = readings(root, source, start, end, columns)
+    else:
+        table = rollups.read(root, source, level, start, end)
+        if columns:
+            table = table[[f'{column}_{stat}' for column in columns for stat in rollups.STATS]]
+    return bucket(table, freq)
+
+
+def plot(ax, data: pd.DataFrame, column: str, label: str | None = None, **kw) -> None:
+    """
+    Plot the mean of `column` from :func:`plot_data` on `ax`, shading between its
+    min and max.
+    """
+    line, = ax.plot(data.index, data[f'{column}_mean'], label=label or column, **kw)
+    ax.fill_between(
+        data.index, data[f'{column}_min'], data[f'{column}_max'],
+        color=line.get_color(), alpha=0.3, linewidth=0,
+    )
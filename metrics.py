@@ -0,0 +1,328 @@
+"""
+A small set of counters, gauges and histograms for seeing where the time goes in
+long-running processes, exported in the Prometheus text format either as a file for
+the node exporter's textfile collector or over HTTP from a local port.
+"""
+import atexit
+import logging
+import os
+import sys
+from abc import ABC, abstractmethod
+from argparse import ArgumentParser, Namespace
+from bisect import bisect_left
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock, Thread
+from time import perf_counter
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+# seconds, from a fast local call to a slow API:
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric(ABC):
+    kind: str
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), registry: 'Registry | None' = None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.lock = Lock()
+        self.children: dict[tuple[str, ...], object] = {}
+        (REGISTRY if registry is None else registry).register(self)
+
+    def labels(self, *values: str) -> '_Child':
+        assert len(values) == len(self.label_names), f'{self.name} needs {self.label_names}'
+        return _Child(self, tuple(str(v) for v in values))
+
+    @abstractmethod
+    def new(self):
+        """The state for a new set of label values."""
+
+    def child(self, values: tuple[str, ...]):
+        with self.lock:
+            state = self.children.get(values)
+            if state is None:
+                state = self.children[values] = self.new()
+            return state
+
+    def state(self, values: tuple[str, ...]):
+        """
+        A copy of the state for `values`, without adding them if they've not been seen.
+        """
+        with self.lock:
+            state = self.children.get(values)
+            return self.new() if state is None else list(state)
+
+    def snapshot(self) -> list[tuple[tuple[str, ...], list]]:
+        """
+        A copy of the state for every set of label values, taken under the lock so
+        that rendering from another thread sees consistent values.
+        """
+        with self.lock:
+            return sorted((values, list(state)) for values, state in self.children.items())
+
+    @abstractmethod
+    def samples(self) -> Iterator[str]:
+        """The sample lines for every set of label values."""
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class _Child:
+    """
+    One set of label values for a metric, which is where values are recorded.
+    """
+
+    def __init__(self, metric: Metric, values: tuple[str, ...]):
+        self.metric = metric
+        self.values = values
+
+    def inc(self, amount: float = 1) -> None:
+        self.metric._inc(self.values, amount)
+
+    def set(self, value: float) -> None:
+        self.metric._set(self.values, value)
+
+    def observe(self, value: float) -> None:
+        self.metric._observe(self.values, value)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def new(self):
+        return [0.]
+
+    def _inc(self, values: tuple[str, ...], amount: float = 1) -> None:
+        state = self.child(values)
+        with self.lock:
+            state[0] += amount
+
+    def inc(self, amount: float = 1) -> None:
+        self._inc((), amount)
+
+    def value(self, *values: str) -> float:
+        return self.state(tuple(values))[0]
+
+    def samples(self) -> Iterator[str]:
+        for values, state in self.snapshot():
+            yield f'{self.name}{format_labels(self.label_names, values)} {format_value(state[0])}'
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def _set(self, values: tuple[str, ...], value: float) -> None:
+        state = self.child(values)
+        with self.lock:
+            state[0] = value
+
+    def set(self, value: float) -> None:
+        self._set((), value)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 registry: 'Registry | None' = None, buckets: Sequence[float] = BUCKETS):
+        super().__init__(name, help, labels, registry)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def new(self):
+        # a count for each bucket, then the sum:
+        return [0] * len(self.buckets) + [0.]
+
+    def _observe(self, values: tuple[str, ...], value: float) -> None:
+        state = self.child(values)
+        with self.lock:
+            state[bisect_left(self.buckets, value)] += 1
+            state[-1] += value
+
+    def observe(self, value: float) -> None:
+        self._observe((), value)
+
+    def count(self, *values: str) -> int:
+        return sum(self.state(tuple(values))[:-1])
+
+    def samples(self) -> Iterator[str]:
+        for values, state in self.snapshot():
+            total = 0
+            for bound, count in zip(self.buckets, state):
+                total += count
+                labels = format_labels(self.label_names, values, f'le="{format_value(bound)}"')
+                yield f'{self.name}_bucket{labels} {total}'
+            labels = format_labels(self.label_names, values)
+            yield f'{self.name}_sum{labels} {format_value(state[-1])}'
+            yield f'{self.name}_count{labels} {total}'
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics: list[Metric] = []
+        self.textfile: Path | None = None
+
+    def register(self, metric: Metric) -> None:
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+    def write(self, path: Path | None = None) -> None:
+        """
+        Write the current values to `path`, or the configured textfile, replacing it
+        in one go so a collector never reads a partial file.
+        """
+        path = path or self.textfile
+        if path is None:
+            return
+        tmp = path.with_name(f'.{path.name}.{os.getpid()}')
+        tmp.write_text(self.render())
+        tmp.replace(path)
+
+    def serve(self, port: int, host: str = '127.0.0.1') -> 'ThreadingHTTPServer':
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+        logging.info(f'serving metrics on http://{host}:{server.server_port}/metrics')
+        return server
+
+
+REGISTRY = Registry()
+
+API_SECONDS = Histogram(
+    'energy_api_request_seconds', 'Time taken by API requests.', ['api', 'operation']
+)
+API_ERRORS = Counter(
+    'energy_api_errors_total', 'API requests that failed, by kind of failure.', ['api', 'kind']
+)
+RUN_SECONDS = Histogram('energy_run_seconds', 'Time taken by each run of a repeated task.', ['name'])
+RUN_LATENESS = Histogram(
+    'energy_run_lateness_seconds', 'How much later than planned each run of a repeated task started.',
+    ['name'], buckets=(0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300),
+)
+RUN_FAILURES = Counter('energy_run_failures_total', 'Runs of a repeated task that failed.', ['name'])
+RUN_LAST = Gauge('energy_run_last_timestamp_seconds', 'When a repeated task last finished.', ['name'])
+DOWNLOAD_SECONDS = Counter(
+    'energy_download_seconds_total', 'Time spent downloading data.', ['source']
+)
+DOWNLOAD_ROWS = Counter('energy_download_rows_total', 'Rows of data downloaded.', ['source'])
+PROCESS_SECONDS = Histogram('energy_process_seconds', 'Time taken to process a batch of downloaded days.')
+PROCESS_DAYS = Counter('energy_process_days_total', 'Downloaded days processed.', ['source'])
+
+
+def failure_kind(exception: BaseException) -> str:
+    # requests and asyncio aren't imported here as, if nothing else has imported them,
+    # they can't have raised the exception:
+    asyncio = sys.modules.get('asyncio')
+    if asyncio and isinstance(exception, asyncio.CancelledError):
+        # cancelled by a deadline or a failing sibling task, not a failure of the API:
+        return 'cancelled'
+    requests = sys.modules.get('requests')
+    if isinstance(exception, TimeoutError) or (requests and isinstance(exception, requests.Timeout)):
+        return 'timeout'
+    response = getattr(exception, 'response', None)
+    status = getattr(response, 'status_code', None) or getattr(exception, 'code', None)
+    if status == 429:
+        return 'throttled'
+    # the Kraken GraphQL API reports an expired token as a query error:
+    errors = getattr(exception, 'errors', None)
+    if errors and isinstance(errors[0], dict) and 'JWT has expired' in str(errors[0].get('message')):
+        return 'token_expired'
+    return 'error'
+
+
+@contextmanager
+def api_call(api: str, operation: str) -> Iterator[None]:
+    """
+    Time the API call made in the block, counting it as a failure if it raises.
+    """
+    start = perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        API_ERRORS.labels(api, failure_kind(e)).inc()
+        raise
+    finally:
+        API_SECONDS.labels(api, operation).observe(perf_counter() - start)
+
+
+@contextmanager
+def downloading(source: str) -> Iterator[list[int]]:
+    """
+    Time downloading data from `source`, counting the rows added to the list yielded,
+    so that throughput is the rate of one total over the other.
+    """
+    rows = []
+    start = perf_counter()
+    try:
+        yield rows
+    finally:
+        DOWNLOAD_SECONDS.labels(source).inc(perf_counter() - start)
+        DOWNLOAD_ROWS.labels(source).inc(sum(rows))
+
+
+def add_metrics(parser: ArgumentParser) -> None:
+    parser.add_argument('--metrics-file', type=Path,
+                        help='write metrics here, for a Prometheus textfile collector')
+    parser.add_argument('--metrics-port', type=int, help='serve metrics over HTTP on this port')
+
+
+def export(args: Namespace, registry: Registry = REGISTRY) -> None:
+    """
+    Start exporting metrics as requested by the options from :func:`add_metrics`.
+    A textfile is written when :func:`flush` is called and at exit.
+    """
+    if args.metrics_file:
+        registry.textfile = args.metrics_file
+        atexit.register(registry.write)
+    if args.metrics_port is not None:
+        registry.serve(args.metrics_port)
+
+
+def flush(registry: Registry = REGISTRY) -> None:
+    try:
+        registry.write()
+    except OSError:
+        logging.exception('Could not write metrics')
@@ -1,7 +1,9 @@
 import csv
 import logging
+from datetime import date
 from pathlib import Path
 from pprint import pformat
+from urllib.parse import urlsplit
 
 import requests
 from configurator import Config
@@ -9,6 +11,8 @@ from pandas import date_range, Timestamp
 from requests.auth import HTTPDigestAuth
 
 from common import main, collect, json_from_paths
+from ingest import Pipeline
+from metrics import api_call, downloading
 
 # lifted from https://github.com/ashleypittman/mec/blob/master/get_zappi_history.py
 # in combination with https://github.com/twonk/MyEnergi-App-Api
@@ -31,27 +35,40 @@ FIELD_NAMES = {
 
 
 PATTERN = 'zappi-%Y-%m-%d.json'
+DIRECTOR = 'https://director.myenergi.net'
 
 
-def download(config: Config, start: Timestamp, end: Timestamp, root: Path) -> None:
+def fetch(config: Config, start: Timestamp, end: Timestamp, root: Path) -> list[tuple[str, date]]:
     myenergi_config = config.myenergi
     session = requests.Session()
     session.auth = HTTPDigestAuth(myenergi_config.hub_serial, myenergi_config.api_key)
     session.headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
 
-    response = session.get(f'https://director.myenergi.net/cgi-jstatus-*')
+    director = myenergi_config.get('director', DIRECTOR).rstrip('/')
+    with api_call('myenergi', 'jstatus'):
+        response = session.get(f'{director}/cgi-jstatus-*')
     response.raise_for_status()
     server = response.headers['x_myenergi-asn']
     logging.debug(pformat(response.json()))
 
-    url_template = f'https://{server}/cgi-jday-Z{myenergi_config.zappi_serial}-%Y-%m-%d'
+    scheme = urlsplit(director).scheme
+    url_template = f'{scheme}://{server}/cgi-jday-Z{myenergi_config.zappi_serial}-%Y-%m-%d'
 
+    downloaded = []
     for ts in date_range(start=end, end=start, freq='-1D'):
-        response = session.get(ts.strftime(url_template))
-        response.raise_for_status()
+        with downloading('zappi') as rows, api_call('myenergi', 'jday'):
+            response = session.get(ts.strftime(url_template))
+            response.raise_for_status()
+            rows.extend(len(value) for value in response.json().values() if isinstance(value, list))
         path = root / ts.strftime(PATTERN)
         path.write_text(response.text)
         logging.info(f'Downloaded {path}')
+        downloaded.append(('zappi', ts.date()))
+    return downloaded
+
+
+def download(config: Config, start: Timestamp, end: Timestamp, root: Path) -> None:
+    Pipeline(root).run(fetch(config, start, end, root))
 
 
 def json_to_csv(config: Config, start: Timestamp, end: Timestamp, root: Path) -> None:
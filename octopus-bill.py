@@ -9,6 +9,7 @@ from pandas import DataFrame
 
 from common import root_from
 from loaders import load_octopus, load_tesla
+from profiling import add_profile
 
 loaders = {
     'octopus': load_octopus,
@@ -27,6 +28,7 @@ def parse_args():
     parser.add_argument('--source', choices=loaders.keys(), default='octopus')
     parser.add_argument('--csv', type=FileType(mode='w'),
                         help='path to dump concatenated data to')
+    add_profile(parser)
     return parser.parse_args()
 
 
@@ -39,7 +41,7 @@ def load_data(start, end, storage: Path, load_source) -> DataFrame:
 
 
 def bill(start, end, df, standing, normal, cheap, vat=1.05):
-    df['cheap'] = [time(0, 30) <= index.time() <= time(4) for index, row in df.iterrows()]
+    df['cheap'] = [time(0, 30) <= t <= time(4) for t in df.index.time]
 
     print(f'from {df.index.min()} to {df.index.max()}')
     print(f'total: {df.consumption.sum():.1f}')
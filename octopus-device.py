@@ -1,13 +1,13 @@
 from pprint import pprint
 
 from configurator import Config
-from octopus import OctopusGraphQLClient
+from octopus import BASE_URL, OctopusGraphQLClient
 
 config = Config.from_path('config.yaml')
 api_key = config.octopus.api_key
 account = config.octopus.account
 
-graphql_client = OctopusGraphQLClient(api_key)
+graphql_client = OctopusGraphQLClient(api_key, config.octopus.get('base_url', BASE_URL))
 
 
 pprint(graphql_client.query(
@@ -1,7 +1,4 @@
-import csv
-import logging
 from argparse import ArgumentParser
-from itertools import groupby
 from pathlib import Path
 
 import pendulum
@@ -9,45 +6,8 @@ from configurator import Config
 from pendulum import DateTime
 
 from common import add_log_level, configure_logging
-from octopus import OctopusRESTClient
-
-
-def from_octopus(
-        client,
-        mpan,
-        meter_serials,
-        endpoint: str,
-        start=None,
-        end=None,
-):
-    params = {'order_by': 'period'}
-    for name, value in (('period_from', start), ('period_to', end)):
-        if value is not None:
-            params[name] = str(value)
-    for meter_serial in meter_serials:
-        data = client.get(f"/{endpoint}/{mpan}/meters/{meter_serial}/consumption/", **params)
-        while True:
-            for reading in data['results']:
-                reading['meter_serial'] = meter_serial
-                yield reading
-            if data['next']:
-                data = client.get(data['next'])
-            else:
-                break
-
-
-READINGS_PER_DAY = int(24*60/30)
-
-
-def extract_tz_offset(row):
-    return pendulum.parse(row['interval_start']).utcoffset().total_seconds()
-
-
-def expected_readings_per_day(readings):
-    first_offset = extract_tz_offset(readings[0])
-    last_offset = extract_tz_offset(readings[-1])
-    # take DST changes into account:
-    return READINGS_PER_DAY - (last_offset - first_offset)/60/30
+from ingest import Pipeline
+from octopus import BASE_URL, download_consumption
 
 
 def download(
@@ -58,52 +18,12 @@ def download(
         end: DateTime = None,
         endpoint: str = 'electricity-meter-points',
         meter_serial: str = None,
+        base_url: str = BASE_URL,
 ):
-
-    client = OctopusRESTClient(api_key)
-    mpxn_type = 'mpan' if endpoint.startswith('electricity') else 'mprn'
-    meter_point = client.meter_point(account, endpoint.replace('-', '_'))
-    if meter_point is None:
-        logging.error(f'No {endpoint} in account {account}')
-        return
-    mpxn = meter_point[mpxn_type]
-
-    if meter_serial:
-        serial_numbers = [meter_serial]
-    else:
-        serial_numbers = [m['serial_number'] for m in meter_point['meters']]
-
-    for date, group in groupby(
-            from_octopus(
-                client,
-                mpxn,
-                serial_numbers,
-                endpoint,
-                start,
-                end
-            ),
-            lambda row: pendulum.parse(row['interval_start']).date()
-    ):
-        readings = sorted(group, key=lambda row: pendulum.parse(row['interval_start']))
-        suffix = ''
-        if len(readings) != expected_readings_per_day(readings):
-            logging.warning(
-                f'{date} is suspect as {len(readings)} readings instead of {READINGS_PER_DAY}'
-            )
-            suffix = '-suspect'
-
-        target_path = Path(target).expanduser() / f'octopus-{date}{suffix}.csv'
-        with target_path.open('w') as target_file:
-            headers = [
-                mpxn_type, 'meter_serial', 'interval_start', 'interval_end', 'consumption'
-            ]
-            writer = csv.DictWriter(target_file, headers)
-            writer.writerow({h: h for h in headers})
-            for reading in readings:
-                reading[mpxn_type] = mpxn
-                writer.writerow(reading)
-
-        logging.info(f'Downloaded {target_path}')
+    target = Path(target).expanduser()
+    Pipeline(target).run(
+        download_consumption(account, api_key, target, start, end, endpoint, meter_serial, base_url)
+    )
 
 
 def date(text):
@@ -8,6 +8,7 @@ from pendulum import DateTime, Date
 
 from common import root_from
 from loaders import load_octopus, load_tesla
+from profiling import add_profile
 
 
 def date(text):
@@ -18,6 +19,7 @@ def parse_args():
     parser = ArgumentParser()
     parser.add_argument('--date', type=date)
     parser.add_argument('--threshold', type=float, default=0.11)
+    add_profile(parser)
     return parser.parse_args()
 
 
@@ -32,8 +34,8 @@ def find_dates(storage: Path):
 
 def reconcile(storage: Path, date: Date, threshold: float):
     print(date)
-    tesla = load_tesla(storage, date)
-    octopus = load_octopus(storage, date)
+    tesla = load_tesla(storage, date, ['consumption'])
+    octopus = load_octopus(storage, date, ['consumption'])
     diff = (octopus['consumption'] - tesla['consumption'])
     bad = diff[diff.abs() > threshold]
     if not bad.empty:
@@ -1,23 +1,31 @@
+import asyncio
 import logging
 from argparse import ArgumentParser
 from copy import deepcopy
-from dataclasses import dataclass
-from datetime import datetime
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
 from pprint import pformat
 from zoneinfo import ZoneInfo
 
 from configurator import Config
 from gql.transport.aiohttp import log as gql_logger
 from pandas import Timestamp
-from teslapy import Tesla, Battery
+from requests import ConnectionError, HTTPError, Timeout
+from teslapy import Battery
 
-from common import DiffDumper, add_log_level, configure_logging, Run, diff, root_from
-from octopus import OctopusGraphQLClient
-from tesla import installation_time_zone
-from schedule import make_seasons_and_energy_charges
+from common import (
+    DiffDumper, add_log_level, configure_logging, Run, diff, root_from, Backoff, CircuitBreaker
+)
+from metrics import add_metrics, export
+from octopus import BASE_URL, OctopusGraphQLClient, GRAPHQL_RETRYABLE
+from tesla import installation_time_zone, tesla_client
+from schedule import make_seasons_and_energy_charges, format_tou_period, is_tou_period
 
 gql_logger.setLevel(logging.WARNING)
 
+# seconds allowed for a whole sync cycle, including retries:
+DEADLINE = 45
+
 
 def make_demand_charges() -> dict:
     return {
@@ -29,6 +37,17 @@ def make_demand_charges() -> dict:
     }
 
 
+def tesla_retryable(e: BaseException) -> bool:
+    """
+    Whether a Tesla API call that raised `e` is worth retrying: timeouts, failures to
+    connect and responses saying the server is struggling, but not other 4xx errors.
+    """
+    if isinstance(e, HTTPError):
+        status = getattr(e.response, 'status_code', 0)
+        return status >= 500 or status == 429
+    return isinstance(e, (TimeoutError, Timeout, ConnectionError))
+
+
 @dataclass(repr=False)
 class Syncer:
     graphql_client: OctopusGraphQLClient
@@ -39,73 +58,111 @@ class Syncer:
     sync: bool
     force: bool
     tesla_tariff: dict | None = None
+    deadline: float = DEADLINE
+    octopus: Backoff = field(
+        default_factory=lambda: Backoff(GRAPHQL_RETRYABLE, CircuitBreaker('octopus'))
+    )
+    tesla: Backoff = field(
+        default_factory=lambda: Backoff(tesla_retryable, CircuitBreaker('tesla'))
+    )
 
     def __call__(self):
+        asyncio.run(self.cycle())
+
+    async def get_tesla_tariff(self, deadline: float) -> dict:
+        return await self.tesla(deadline, asyncio.to_thread, self.battery.get_tariff)
+
+    async def set_tesla_tariff(self, deadline: float, tariff: dict) -> None:
+        await self.tesla(deadline, asyncio.to_thread, self.battery.set_tariff, tariff)
+
+    async def cycle(self):
         now = Timestamp(datetime.now().astimezone())
-        # get the octopus tariff
-        dispatches = self.graphql_client.dispatches(self.account)
-        tariff = self.graphql_client.tariff(self.account)
-        if dispatches is None or tariff is None:
-            # timeouts :-/
-            return
-
-        logging.debug(pformat(tariff))
-        unit_rates_schedule = tariff.pop('unitRates')
-
-        # dump to json if things have changed:
-        if self.dumper is not None:
-            self.dumper.update(
-                {'dispatches': dispatches, 'unit_rates': unit_rates_schedule, 'agreement': tariff},
-                force=self.force
+        deadline = asyncio.get_running_loop().time() + self.deadline
+        async with asyncio.timeout_at(deadline), self.graphql_client:
+            # get the octopus tariff, along with the current tesla tariff config if needed:
+            tesla_tariff = None
+            async with asyncio.TaskGroup() as group:
+                dispatches = group.create_task(
+                    self.octopus(deadline, self.graphql_client.dispatches, self.account)
+                )
+                tariff = group.create_task(
+                    self.octopus(deadline, self.graphql_client.tariff, self.account)
+                )
+                if self.sync and not self.tesla_tariff:
+                    tesla_tariff = group.create_task(self.get_tesla_tariff(deadline))
+            dispatches = dispatches.result()
+            tariff = tariff.result()
+            if tesla_tariff is not None:
+                self.tesla_tariff = tesla_tariff.result()
+
+            logging.debug(pformat(tariff))
+            unit_rates_schedule = tariff.pop('unitRates')
+
+            # dump to json if things have changed:
+            if self.dumper is not None:
+                self.dumper.update(
+                    {'dispatches': dispatches, 'unit_rates': unit_rates_schedule, 'agreement': tariff},
+                    force=self.force
+                )
+
+            if not self.sync:
+                logging.warning('not updating Tesla schedule!')
+                return
+
+            # build the tariff we think we need:
+            required_tariff = deepcopy(self.tesla_tariff)
+            required_tariff['code'] = tariff['tariffCode']
+            required_tariff['utility'] = 'Octopus'
+            required_tariff['name'] = tariff['fullName']
+            required_tariff['demand_charges'] = make_demand_charges()
+            required_tariff.update(
+                make_seasons_and_energy_charges(now, unit_rates_schedule, dispatches, self.timezone)
             )
-
-        if not self.sync:
-            logging.warning('not updating Tesla schedule!')
-            return
-
-        # get the current tesla tariff config:
-        if not self.tesla_tariff:
-            self.tesla_tariff = self.battery.get_tariff()
-
-        # build the tariff we think we need:
-        required_tariff = deepcopy(self.tesla_tariff)
-        required_tariff['code'] = tariff['tariffCode']
-        required_tariff['utility'] = 'Octopus'
-        required_tariff['name'] = tariff['fullName']
-        required_tariff['demand_charges'] = make_demand_charges()
-        required_tariff.update(
-            make_seasons_and_energy_charges(now, unit_rates_schedule, dispatches, self.timezone)
-        )
-        # update the tariff via the tesla API if it's changed:
-        if self.tesla_tariff != required_tariff or self.force:
-            planned_dispatches = dispatches['plannedDispatches']
-            logging.info(f'Planned dispatches:\n{pformat(planned_dispatches, sort_dicts=False)}')
-            self.battery.set_tariff(required_tariff)
-            diff_text = diff(self.tesla_tariff, required_tariff, )
-            logging.info(f'Tesla tariff updated:\n{diff_text}')
-            self.tesla_tariff = self.battery.get_tariff()
+            # update the tariff via the tesla API if it's changed:
+            if self.tesla_tariff != required_tariff or self.force:
+                planned_dispatches = dispatches['plannedDispatches']
+                logging.info(f'Planned dispatches:\n{pformat(planned_dispatches, sort_dicts=False)}')
+                await self.set_tesla_tariff(deadline, required_tariff)
+                diff_text = diff(
+                    self.tesla_tariff, required_tariff,
+                    format_value=format_tou_period, atomic=is_tou_period,
+                )
+                logging.info(f'Tesla tariff updated:\n{diff_text}')
+                # if this fails, the next cycle will fetch it afresh:
+                self.tesla_tariff = None
+                self.tesla_tariff = await self.get_tesla_tariff(deadline)
 
 
 def main():
     parser = ArgumentParser()
     add_log_level(parser)
+    parser.add_argument('--segments', action='store_true',
+                        help='record changes in a segment log rather than json files')
     parser.add_argument('--run-every', type=int)
     parser.add_argument('--no-dump', action='store_false', dest='dump')
     parser.add_argument('--no-sync', action='store_false', dest='sync', help='never sync')
     parser.add_argument('--force', action='store_true', help='force dump and sync')
+    parser.add_argument('--deadline', type=float, default=DEADLINE,
+                        help='seconds allowed for each sync cycle, including retries')
+    parser.add_argument('--retry-after', type=float, default=30,
+                        help='seconds to wait before trying again after a failed cycle')
+    add_metrics(parser)
 
     args = parser.parse_args()
     configure_logging(args.log_level, args.unattended)
+    export(args)
 
     config = Config.from_path('config.yaml')
     storage = root_from(config)
     api_key = config.octopus.api_key
     account = config.octopus.account
 
-    graphql_client = OctopusGraphQLClient(api_key)
-    dumper = DiffDumper(storage, prefix='octopus-dispatches') if args.dump else None
+    graphql_client = OctopusGraphQLClient(api_key, config.octopus.get('base_url', BASE_URL))
+    dumper = None
+    if args.dump:
+        dumper = DiffDumper(storage, prefix='octopus-dispatches', segments=args.segments)
 
-    tesla = Tesla(config.tesla.email)
+    tesla = tesla_client(config)
     battery, = tesla.battery_list()
 
     syncer = Syncer(
@@ -116,9 +173,10 @@ def main():
         installation_time_zone(battery),
         args.sync,
         args.force,
+        deadline=args.deadline,
     )
 
-    run = Run(syncer)
+    run = Run(syncer, retry=timedelta(seconds=args.retry_after), name='sync')
 
     if args.run_every:
         run.every(minutes=args.run_every)
@@ -1,21 +1,35 @@
+import asyncio
+import csv
 import logging
+from asyncio import AbstractEventLoop
 from collections import deque
 from dataclasses import dataclass
-from datetime import datetime, timedelta, time
+from datetime import UTC, date, datetime, timedelta, time
+from email.utils import parsedate_to_datetime
 from decimal import Decimal
-from itertools import chain
+from itertools import chain, groupby
+from math import isfinite
+from pathlib import Path
 from pprint import pformat
-from typing import Any, Iterable
+from time import sleep
+from typing import Any, Iterable, Self
+from weakref import WeakKeyDictionary
 from zoneinfo import ZoneInfo
 
+import pendulum
 import requests
+from aiohttp import ClientError
 from gql import Client, gql
+from gql.client import AsyncClientSession
 from gql.transport.aiohttp import AIOHTTPTransport
-from gql.transport.exceptions import TransportQueryError
-from pandas import Timestamp, date_range, Timedelta
+from gql.transport.exceptions import (
+    TransportQueryError, TransportServerError, TransportConnectionFailed
+)
+from pandas import Timestamp, date_range, Timedelta, to_datetime
+from pendulum import DateTime
 from requests import JSONDecodeError
 
-from common import log_timeouts_and_return_none
+from metrics import API_ERRORS, api_call, downloading
 
 
 @dataclass
@@ -25,6 +39,30 @@ class Rates:
 
 
 BASE_URL = "https://api.octopus.energy/v1/"
+# requests refused with a 429 before giving up:
+THROTTLED_ATTEMPTS = 5
+
+
+def retry_after(header: str | None, default: float = 1) -> float:
+    """
+    The seconds to wait from a Retry-After header, which can be a number of seconds
+    or an HTTP date, or `default` if it's missing or can't be parsed.
+    """
+    if header is None:
+        return default
+    try:
+        seconds = float(header)
+    except ValueError:
+        pass
+    else:
+        return max(seconds, 0) if isfinite(seconds) else default
+    try:
+        when = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return default
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=UTC)
+    return max((when - datetime.now(UTC)).total_seconds(), 0)
 
 
 class OctopusRESTClient:
@@ -37,7 +75,21 @@ class OctopusRESTClient:
     def get(self, url, **params):
         if not url.startswith(self.base_url):
             url = self.base_url + url
-        response = self.session.get(url, params=params)
+        path = url[len(self.base_url):]
+        operation = 'consumption' if '/consumption/' in path else path.split('/')[1]
+        for attempt in range(THROTTLED_ATTEMPTS):
+            with api_call('octopus', operation):
+                response = self.session.get(url, params=params)
+            if response.status_code != 429:
+                break
+            API_ERRORS.labels('octopus', 'throttled').inc()
+            if attempt == THROTTLED_ATTEMPTS - 1:
+                raise requests.HTTPError(
+                    f'HTTP 429 for {path} {THROTTLED_ATTEMPTS} times, giving up', response=response
+                )
+            wait = retry_after(response.headers.get('retry-after'))
+            logging.warning(f'HTTP 429, sleeping for {wait:.0f}s')
+            sleep(wait)
         try:
             data = response.json()
         except JSONDecodeError:
@@ -71,20 +123,160 @@ class OctopusRESTClient:
         return self.current_tariff_code(account, 'electricity_meter_points')
 
 
+# the most readings the API will return in one page:
+PAGE_SIZE = 25000
+
+
+def from_octopus(
+        client,
+        mpan,
+        meter_serials,
+        endpoint: str,
+        start=None,
+        end=None,
+):
+    params = {'order_by': 'period', 'page_size': PAGE_SIZE}
+    for name, value in (('period_from', start), ('period_to', end)):
+        if value is not None:
+            params[name] = str(value)
+    for meter_serial in meter_serials:
+        data = client.get(f"/{endpoint}/{mpan}/meters/{meter_serial}/consumption/", **params)
+        while True:
+            for reading in data['results']:
+                reading['meter_serial'] = meter_serial
+                yield reading
+            if data['next']:
+                data = client.get(data['next'])
+            else:
+                break
+
+
+def missing_readings(day: date, readings: list[dict]) -> int:
+    # imported here so the sync script doesn't pull in the processing pipeline:
+    from gaps import missing_slots
+    from loaders import SOURCES
+    source = SOURCES['octopus']
+    timestamps = to_datetime([row['interval_start'] for row in readings], utc=True)
+    return len(missing_slots(timestamps, day, source.interval))
+
+
+def download_consumption(
+        account,
+        api_key,
+        target,
+        start: DateTime | None = None,
+        end: DateTime | None = None,
+        endpoint: str = 'electricity-meter-points',
+        meter_serial: str = None,
+        base_url: str = BASE_URL,
+) -> list[tuple[str, date]]:
+    """
+    Write a file for each day of consumption from `start` to `end`, marking any
+    that have readings missing as suspect, and return the days written.
+    """
+
+    client = OctopusRESTClient(api_key, base_url)
+    mpxn_type = 'mpan' if endpoint.startswith('electricity') else 'mprn'
+    meter_point = client.meter_point(account, endpoint.replace('-', '_'))
+    if meter_point is None:
+        logging.error(f'No {endpoint} in account {account}')
+        return []
+    mpxn = meter_point[mpxn_type]
+
+    if meter_serial:
+        serial_numbers = [meter_serial]
+    else:
+        serial_numbers = [m['serial_number'] for m in meter_point['meters']]
+
+    downloaded = []
+    with downloading('octopus') as rows:
+        for day, group in groupby(
+                from_octopus(
+                    client,
+                    mpxn,
+                    serial_numbers,
+                    endpoint,
+                    start,
+                    end
+                ),
+                lambda row: pendulum.parse(row['interval_start']).date()
+        ):
+            readings = sorted(group, key=lambda row: pendulum.parse(row['interval_start']))
+            rows.append(len(readings))
+            suffix = ''
+            missing = missing_readings(day, readings)
+            if missing:
+                logging.warning(
+                    f'{day} is suspect as {len(readings)} readings with {missing} missing'
+                )
+                suffix = '-suspect'
+
+            target_path = Path(target).expanduser() / f'octopus-{day}{suffix}.csv'
+            with target_path.open('w') as target_file:
+                headers = [
+                    mpxn_type, 'meter_serial', 'interval_start', 'interval_end', 'consumption'
+                ]
+                writer = csv.DictWriter(target_file, headers)
+                writer.writerow({h: h for h in headers})
+                for reading in readings:
+                    reading[mpxn_type] = mpxn
+                    writer.writerow(reading)
+
+            logging.info(f'Downloaded {target_path}')
+            downloaded.append(('octopus', day))
+
+    return downloaded
+
+
+# Errors worth retrying: anything else is a bug or a problem with the query itself.
+GRAPHQL_RETRYABLE = (
+    TimeoutError, ClientError, TransportServerError, TransportConnectionFailed
+)
+
+
 class OctopusGraphQLClient:
+    """
+    Async client for the Octopus Kraken GraphQL API.
+
+    Use as an async context manager to share one connection between concurrent
+    queries; outside of that, each query connects and disconnects.
+    """
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, base_url=BASE_URL):
         self._api_key = api_key
-        self._transport = AIOHTTPTransport(BASE_URL + "/graphql/", headers={})
+        self._transport = AIOHTTPTransport(base_url.rstrip('/') + "/graphql/", headers={})
         self._client = Client(transport=self._transport)
+        self._session: AsyncClientSession | None = None
+        # concurrent queries that all find they need a token should only get one; a lock
+        # only works in one event loop and each asyncio.run() starts a new one:
+        self._token_locks: WeakKeyDictionary[AbstractEventLoop, asyncio.Lock] = WeakKeyDictionary()
+
+    async def __aenter__(self) -> Self:
+        self._session = await self._client.connect_async()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._session = None
+        await self._client.close_async()
+
+    async def _query(
+            self, operation_name: str, query: str, params: dict[str, Any]
+    ) -> dict[str, Any]:
+        if self._session is None:
+            async with self:
+                return await self._query(operation_name, query, params)
+        # the session copies the transport's headers when it connects, so a token
+        # obtained since then has to be sent with each request:
+        with api_call('octopus-graphql', operation_name):
+            return await self._session.execute(
+                gql(query),
+                variable_values=params,
+                operation_name=operation_name,
+                extra_args={'headers': dict(self._transport.headers)},
+            )
 
-    def _query(self, operation_name: str, query: str, params: dict[str, Any]) -> dict[str, Any]:
-        return self._client.execute(
-            gql(query), variable_values=params, operation_name=operation_name
-        )
-
-    def obtain_token(self) -> str:
-        result = self._query(
+    async def obtain_token(self) -> str:
+        result = await self._query(
             "krakenTokenAuthentication",
             query=(
                 '''
@@ -99,29 +291,45 @@ class OctopusGraphQLClient:
         )
         return result['obtainKrakenToken']['token']
 
-    def set_token(self):
+    async def set_token(self):
         logging.debug('setting token')
+        token = await self.obtain_token()
         headers = self._transport.headers
         headers.pop('Authorization', None)
-        headers['Authorization'] = self.obtain_token()
-
-    def query(self, operation_name: str, query: str, params: dict[str, Any]) -> dict[str, Any]:
+        headers['Authorization'] = token
+
+    async def replace_token(self, stale: str | None) -> None:
+        """
+        Get a new token, unless another query already replaced `stale` while this one
+        was waiting for the lock.
+        """
+        lock = self._token_locks.setdefault(asyncio.get_running_loop(), asyncio.Lock())
+        async with lock:
+            if self._transport.headers.get('Authorization') == stale:
+                await self.set_token()
+
+    async def query_async(
+            self, operation_name: str, query: str, params: dict[str, Any]
+    ) -> dict[str, Any]:
         if 'Authorization' not in self._transport.headers:
-            self.set_token()
+            await self.replace_token(None)
+        token = self._transport.headers['Authorization']
         try:
-            return self._query(operation_name, query, params)
+            return await self._query(operation_name, query, params)
         except TransportQueryError as e:
             message = e.errors[0]['message']
             if message == 'Signature of the JWT has expired.':
-                self.set_token()
-                return self._query(operation_name, query, params)
+                await self.replace_token(token)
+                return await self._query(operation_name, query, params)
             else:
                 e.add_note(f'message was: {message!r}')
                 raise
 
-    @log_timeouts_and_return_none
-    def dispatches(self, account: str) -> dict[str, list[dict[str, Any]]]:
-        return self.query(
+    def query(self, operation_name: str, query: str, params: dict[str, Any]) -> dict[str, Any]:
+        return asyncio.run(self.query_async(operation_name, query, params))
+
+    async def dispatches(self, account: str) -> dict[str, list[dict[str, Any]]]:
+        return await self.query_async(
             "getCombinedData",
             query='''
                 query getCombinedData($accountNumber: String!) {
@@ -148,9 +356,8 @@ class OctopusGraphQLClient:
             params={"accountNumber": account},
         )
 
-    @log_timeouts_and_return_none
-    def tariff(self, account: str) -> dict:
-        data = self.query(
+    async def tariff(self, account: str) -> dict:
+        data = await self.query_async(
             'getProperties',
             query="""
                 query getProperties($accountNumber: String!) {
@@ -210,14 +417,15 @@ class Schedule:
         assert now.tzinfo is not None
         self.start = now.floor('30min', ambiguous=bool(now.fold))
         self.end = timestamp_on_different_day(self.start, offset=1)
-        self.entries: dict[Timestamp, float | None] = {
-            d: None for d in date_range(
-                start=self.start,
-                end=self.end,
-                freq=SLOT_SIZE,
-                inclusive='left',
-            )
-        }
+        self.slots = date_range(
+            start=self.start,
+            end=self.end,
+            freq=SLOT_SIZE,
+            inclusive='left',
+        )
+        self.entries: dict[Timestamp, float | None] = dict.fromkeys(self.slots)
+        self._keys = list(self.entries)
+        self._instants = self.slots.as_unit('ns').asi8
 
     def add(self, start: Timestamp, end: Timestamp, cost: float) -> None:
         assert start.tzinfo is not None
@@ -227,11 +435,13 @@ class Schedule:
         if end < self.start or start > self.end:
             return
 
-        current = max(start.floor('30min', ambiguous=bool(start)), self.start)
-        while current < min(end.ceil('30min', ambiguous=bool(end.fold)), self.end):
-            assert current in self.entries, current
-            self.entries[current] = cost
-            current += SLOT_SIZE
+        # slots are found by position, which compares instants, so this works for rates
+        # in any timezone, including in the repeated hour when DST ends:
+        first = max(start.floor('30min', ambiguous=bool(start)), self.start)
+        last = min(end.ceil('30min', ambiguous=bool(end.fold)), self.end)
+        first, last = self._instants.searchsorted([first.as_unit('ns').value, last.as_unit('ns').value])
+        for key in self._keys[first:last]:
+            self.entries[key] = cost
 
     @staticmethod
     def _compress(items: Iterable[tuple[Timestamp, float]]) -> list[ScheduleEntry]:
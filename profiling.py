@@ -0,0 +1,167 @@
+"""
+Profiling for any script, without editing it, using options added by :func:`add_profile`:
+
+``--profile PATH``
+  Profile the whole run with :mod:`cProfile`, writing ``pstats`` output to ``PATH`` and
+  the stacks sampled over the same run to ``PATH.collapsed``, one ``a;b;c count`` line
+  per stack as used by ``flamegraph.pl``, speedscope and friends.
+
+``--profile-sample PATH``
+  Just sample the stacks, which costs little enough to leave on for a long run.
+
+``--profile-signal PATH``
+  Sample a long-running process, such as a :class:`~common.Run` loop, only while
+  asked to: ``kill -USR1 <pid>`` starts sampling and the next one writes what was
+  sampled to a time-stamped file next to ``PATH``.
+
+Only the main thread is profiled; work done in worker processes is not included.
+"""
+import atexit
+import cProfile
+import logging
+import os
+import signal
+import sys
+from argparse import Action, ArgumentParser
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from threading import Event, Thread, main_thread
+from types import FrameType
+
+# seconds between samples:
+INTERVAL = 0.005
+
+
+def frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f'{code.co_qualname} ({Path(code.co_filename).name}:{code.co_firstlineno})'
+
+
+def collapsed_stack(frame: FrameType | None) -> str:
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler:
+    """
+    Sample the stack of a thread from a background thread, counting how often each
+    stack is seen.
+    """
+
+    def __init__(self, interval: float = INTERVAL, thread_id: int | None = None):
+        self.interval = interval
+        self.thread_id = main_thread().ident if thread_id is None else thread_id
+        self.stacks = Counter()
+        self._stop = Event()
+        self._thread: Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapsed_stack(frame)] += 1
+
+    def start(self) -> None:
+        self.stacks.clear()
+        self._stop.clear()
+        self._thread = Thread(target=self._sample, name='sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def write(self, path: Path) -> None:
+        with path.open('w') as target:
+            for stack, count in self.stacks.most_common():
+                target.write(f'{stack} {count}\n')
+        logging.info(f'wrote {sum(self.stacks.values())} samples to {path}')
+
+
+class Profiler:
+    """
+    Profile from :meth:`start` until :meth:`finish`, which is also called at exit.
+    """
+
+    def __init__(self, path: Path, deterministic: bool = True, interval: float = INTERVAL):
+        self.path = path
+        self.profile = cProfile.Profile() if deterministic else None
+        self.sampler = Sampler(interval)
+        self.finished = False
+
+    @property
+    def collapsed_path(self) -> Path:
+        if self.profile is None:
+            return self.path
+        return self.path.with_name(self.path.name + '.collapsed')
+
+    def start(self) -> None:
+        self.sampler.start()
+        if self.profile is not None:
+            self.profile.enable()
+        atexit.register(self.finish)
+
+    def finish(self) -> None:
+        if self.finished:
+            return
+        self.finished = True
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.path)
+            logging.info(f'wrote profile to {self.path}')
+        self.sampler.stop()
+        self.sampler.write(self.collapsed_path)
+
+
+class SignalSampler:
+    """
+    Start and stop sampling each time `signum` is received.
+    """
+
+    def __init__(self, path: Path, signum: int = signal.SIGUSR1, interval: float = INTERVAL):
+        self.path = path
+        self.sampler = Sampler(interval)
+        signal.signal(signum, self.toggle)
+
+    def toggle(self, signum: int | None = None, frame: FrameType | None = None) -> None:
+        if self.sampler.running:
+            self.sampler.stop()
+            stamp = datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
+            self.sampler.write(self.path.with_name(f'{self.path.stem}-{stamp}{self.path.suffix}'))
+        else:
+            logging.info(f'sampling process {os.getpid()}')
+            self.sampler.start()
+
+
+class _ProfileAction(Action):
+
+    def __call__(self, parser, namespace, value, option_string=None):
+        path = Path(value)
+        if self.const == 'signal':
+            profiler = SignalSampler(path)
+        else:
+            profiler = Profiler(path, deterministic=self.const == 'profile')
+            profiler.start()
+        setattr(namespace, self.dest, profiler)
+
+
+def add_profile(parser: ArgumentParser) -> None:
+    """
+    Add the profiling options, which start profiling as soon as they are parsed.
+    """
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--profile', action=_ProfileAction, const='profile', metavar='PATH',
+                       help='profile with cProfile, writing pstats here and stacks to PATH.collapsed')
+    group.add_argument('--profile-sample', action=_ProfileAction, const='sample', metavar='PATH',
+                       help='sample stacks, writing them here in collapsed form')
+    group.add_argument('--profile-signal', action=_ProfileAction, const='signal', metavar='PATH',
+                       help='sample stacks between one SIGUSR1 and the next')
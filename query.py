@@ -0,0 +1,255 @@
+"""
+A local HTTP service answering queries over the storage directory from memory, so
+notebooks can fetch just the slice of data they plot rather than each re-reading
+a file per day:
+
+``GET /series/{source}?start=2024-01-01&end=2024-02-01&resolution=30min&how=mean&columns=a,b``
+  The readings for `source` from `start` up to, but not including, `end`, optionally
+  resampled in local time. Days read are kept with compacted columns until their
+  file changes.
+
+``GET /tariff?at=2024-01-10T12:00``
+  The agreement and unit rates recorded in the dispatch snapshot current at `at`, or
+  the latest one, along with the Tesla tariff that would have been built from them.
+
+``GET /dispatches?start=2024-01-01&end=2024-02-01``
+  Every dispatch seen in the snapshots recorded between `start` and `end`.
+
+Series are returned as ``{"index": [...], "columns": {name: [...]}}``, or as csv
+with ``format=csv``. Use :func:`series` to turn one back into a DataFrame.
+"""
+import json
+import logging
+from argparse import ArgumentParser
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+from aiohttp import web
+from configurator import Config
+
+from common import add_log_level, configure_logging, root_from, select, snapshot_paths, snapshot_time
+from loaders import SOURCES, TIMEZONE, load_day
+from schedule import make_seasons_and_energy_charges
+from segments import SegmentLog
+
+PORT = 8765
+PREFIX = 'octopus-dispatches'
+# days of data to keep in memory, where a day of zappi data is about 110kB:
+MAX_DAYS = 1000
+HOW = ('mean', 'sum', 'min', 'max', 'first', 'last')
+
+
+class Store:
+    """
+    Days of data read from `root`, kept with compacted columns and reread when the
+    raw file changes.
+    """
+
+    def __init__(self, root: Path, max_days: int = MAX_DAYS):
+        self.root = root
+        self.max_days = max_days
+        # (source, day) -> (mtime_ns, frame)
+        self.days: OrderedDict[tuple[str, date], tuple[int, pd.DataFrame]] = OrderedDict()
+        self.snapshots: dict[Path, Any] = {}
+
+    def day(self, source: str, day: date) -> pd.DataFrame | None:
+        raw_path = SOURCES[source].raw_path(self.root, day)
+        if raw_path is None:
+            return None
+        mtime = raw_path.stat().st_mtime_ns
+        key = source, day
+        hit = self.days.get(key)
+        if hit is None or hit[0] != mtime:
+            frame = load_day(self.root, SOURCES[source], day, compacted=True)
+            hit = self.days[key] = mtime, frame
+            while len(self.days) > self.max_days:
+                self.days.popitem(last=False)
+        self.days.move_to_end(key)
+        return hit[1]
+
+    def series(
+            self,
+            source: str,
+            start: date,
+            end: date,
+            columns: list[str] | None = None,
+            resolution: str | None = None,
+            how: str = 'mean',
+    ) -> pd.DataFrame:
+        days = SOURCES[source].file_days(start, end)
+        frames = [f for f in (self.day(source, d) for d in days) if f is not None]
+        if not frames:
+            return pd.DataFrame()
+        frame = pd.concat(frames).tz_convert(TIMEZONE)
+        first, last = (pd.Timestamp(d, tz=TIMEZONE) for d in (start, end))
+        frame = frame[(frame.index >= first) & (frame.index < last)]
+        if columns:
+            frame = frame[columns]
+        if resolution:
+            frame = frame.resample(resolution).agg(how).dropna(how='all')
+        return frame
+
+    def snapshot(self, path: Path) -> Any:
+        # snapshot files are never changed once written:
+        state = self.snapshots.get(path)
+        if state is None:
+            state = self.snapshots[path] = json.loads(path.read_bytes())
+        return state
+
+    def states(self, start: datetime | None, end: datetime | None) -> list[tuple[datetime, Any]]:
+        log = SegmentLog(self.root, PREFIX)
+        if log.days():
+            return list(log.items(start, end))
+        return [(snapshot_time(p), self.snapshot(p)) for p in select(snapshot_paths(self.root, PREFIX), start, end)]
+
+    def state_at(self, when: datetime | None) -> tuple[datetime, Any] | None:
+        log = SegmentLog(self.root, PREFIX)
+        if log.days():
+            return log.latest() if when is None else log.at(when)
+        paths = select(snapshot_paths(self.root, PREFIX), None, when)
+        if not paths:
+            return None
+        return snapshot_time(paths[-1]), self.snapshot(paths[-1])
+
+
+STORE = web.AppKey('store', Store)
+
+
+def parse(request: web.Request, name: str, kind, default=None):
+    text = request.query.get(name)
+    if text is None:
+        return default
+    try:
+        return kind(text)
+    except ValueError:
+        raise web.HTTPBadRequest(text=f'bad {name}: {text!r}')
+
+
+def column_values(values: pd.Series) -> list[float | None]:
+    array = values.to_numpy()
+    if array.dtype == 'float32':
+        # via the shortest text for each float32, so 0.3 isn't sent as 0.30000001192092896:
+        array = array.astype(str).astype('float64')
+    return [None if pd.isna(v) else v for v in array.tolist()]
+
+
+def frame_payload(frame: pd.DataFrame) -> dict:
+    return {
+        'index': [ts.isoformat() for ts in frame.index],
+        'columns': {name: column_values(values) for name, values in frame.items()},
+    }
+
+
+async def get_series(request: web.Request) -> web.Response:
+    store = request.app[STORE]
+    source = request.match_info['source']
+    if source not in SOURCES:
+        raise web.HTTPNotFound(text=f'no source called {source!r}')
+    start = parse(request, 'start', date.fromisoformat)
+    end = parse(request, 'end', date.fromisoformat, start and start + timedelta(days=1))
+    if start is None:
+        raise web.HTTPBadRequest(text='start is required')
+    columns = parse(request, 'columns', lambda text: text.split(','))
+    how = request.query.get('how', 'mean')
+    if how not in HOW:
+        raise web.HTTPBadRequest(text=f'how must be one of {HOW}')
+    try:
+        frame = store.series(source, start, end, columns, request.query.get('resolution'), how)
+    except KeyError as e:
+        raise web.HTTPBadRequest(text=f'unknown column: {e}')
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+    if request.query.get('format') == 'csv':
+        return web.Response(text=frame.to_csv(), content_type='text/csv')
+    return web.json_response(frame_payload(frame))
+
+
+async def get_tariff(request: web.Request) -> web.Response:
+    store = request.app[STORE]
+    at = parse(request, 'at', datetime.fromisoformat)
+    found = store.state_at(at)
+    if found is None or not isinstance(found[1], dict) or 'unit_rates' not in found[1]:
+        raise web.HTTPNotFound(text='no snapshot with unit rates')
+    recorded, state = found
+    tz = ZoneInfo(TIMEZONE)
+    now = pd.Timestamp(at or recorded)
+    if now.tzinfo is None:
+        now = now.tz_localize(tz, ambiguous=True, nonexistent='shift_forward')
+    try:
+        tesla = make_seasons_and_energy_charges(now, state['unit_rates'], state['dispatches'], tz)
+    except Exception as e:
+        tesla = {'error': f'{type(e).__name__}: {e}'}
+    return web.json_response({
+        'recorded': recorded.isoformat(),
+        'agreement': state.get('agreement'),
+        'unit_rates': state['unit_rates'],
+        'tesla': tesla,
+    })
+
+
+async def get_dispatches(request: web.Request) -> web.Response:
+    store = request.app[STORE]
+    start = parse(request, 'start', datetime.fromisoformat)
+    end = parse(request, 'end', datetime.fromisoformat)
+    seen = {}
+    for at, state in store.states(start, end):
+        # older snapshots only recorded the dispatches:
+        dispatches = state.get('dispatches', state) if isinstance(state, dict) else {}
+        for kind in 'completedDispatches', 'plannedDispatches':
+            for dispatch in dispatches.get(kind) or ():
+                key = dispatch['startDtUtc'], dispatch['endDtUtc']
+                entry = seen.setdefault(key, {**dispatch, 'first_seen': at.isoformat(), 'completed': False})
+                entry['last_seen'] = at.isoformat()
+                entry['completed'] |= kind == 'completedDispatches'
+    return web.json_response([seen[key] for key in sorted(seen)])
+
+
+def make_app(root: Path, max_days: int = MAX_DAYS) -> web.Application:
+    # handlers run on the event loop, one at a time, so the store needs no locking:
+    app = web.Application()
+    app[STORE] = Store(root, max_days)
+    app.router.add_get('/series/{source}', get_series)
+    app.router.add_get('/tariff', get_tariff)
+    app.router.add_get('/dispatches', get_dispatches)
+    return app
+
+
+def series(url: str, source: str, start: date, end: date | None = None, **params) -> pd.DataFrame:
+    """
+    Fetch a series from a running service as a DataFrame, for use in notebooks.
+    """
+    import requests
+    query = {'start': start, 'end': end, **params}
+    if isinstance(query.get('columns'), (list, tuple)):
+        query['columns'] = ','.join(query['columns'])
+    response = requests.get(f"{url.rstrip('/')}/series/{source}", params={
+        k: v for k, v in query.items() if v is not None
+    })
+    response.raise_for_status()
+    payload = response.json()
+    return pd.DataFrame(payload['columns'], index=pd.to_datetime(payload['index'], utc=True).tz_convert(TIMEZONE))
+
+
+def main():
+    config = Config.from_path('config.yaml')
+    root = root_from(config)
+
+    parser = ArgumentParser(description='Serve the storage directory over HTTP from memory.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--max-days', type=int, default=MAX_DAYS,
+                        help='days of data to keep in memory')
+    add_log_level(parser)
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    logging.info(f'serving {root} on http://{args.host}:{args.port}/')
+    web.run_app(make_app(root, args.max_days), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
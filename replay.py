@@ -0,0 +1,231 @@
+"""
+Replay the ``octopus-dispatches`` snapshots recorded by ``octopus-tesla-sync.py``
+through :func:`~schedule.make_seasons_and_energy_charges`, as at the time each one was
+recorded, checking for exceptions, gaps in the schedule and changes in the output.
+
+The history of real inputs, including every DST change the sync has run over, becomes
+a regression test and benchmark: save the results of one run as a baseline and later
+runs will report any snapshot whose output is no longer the same.
+"""
+import hashlib
+import json
+import logging
+from argparse import ArgumentParser
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+from time import perf_counter
+from typing import Any
+from zoneinfo import ZoneInfo
+
+from configurator import Config
+from pandas import Timestamp
+
+from common import add_log_level, configure_logging, root_from, select, snapshot_paths, snapshot_time
+from loaders import TIMEZONE
+from schedule import make_seasons_and_energy_charges
+from segments import SegmentLog
+
+PREFIX = 'octopus-dispatches'
+# snapshots replayed by each task, enough to keep the per-task overhead down:
+CHUNK = 250
+
+
+@dataclass
+class Result:
+    # local time the snapshot was recorded, as in its name:
+    at: datetime
+    # ok, error, gaps or skipped:
+    status: str
+    digest: str | None = None
+    warnings: list[str] = field(default_factory=list)
+    error: str | None = None
+
+
+class Capture(logging.Handler):
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.messages = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.messages.append(record.getMessage())
+
+
+def digest(output: Any) -> str:
+    return hashlib.sha1(json.dumps(output, sort_keys=True).encode()).hexdigest()
+
+
+def replay(at: datetime, state: Any, tz: ZoneInfo) -> Result:
+    # snapshots from before the rates were recorded can't be replayed:
+    if not isinstance(state, dict) or not {'dispatches', 'unit_rates'} <= state.keys():
+        return Result(at, 'skipped')
+    # the names are local times, so the repeated hour when DST ends is ambiguous:
+    now = Timestamp(at).tz_localize(tz, ambiguous=True, nonexistent='shift_forward')
+    capture = Capture()
+    root = logging.getLogger()
+    root.addHandler(capture)
+    try:
+        output = make_seasons_and_energy_charges(now, state['unit_rates'], state['dispatches'], tz)
+    except Exception as e:
+        status = 'gaps' if str(e).startswith('Gaps in schedule') else 'error'
+        return Result(at, status, warnings=capture.messages, error=f'{type(e).__name__}: {e}')
+    finally:
+        root.removeHandler(capture)
+    return Result(at, 'ok', digest(output), capture.messages)
+
+
+def replay_paths(paths: list[Path], tz: str) -> list[Result]:
+    zone = ZoneInfo(tz)
+    return [replay(snapshot_time(path), json.loads(path.read_bytes()), zone) for path in paths]
+
+
+def replay_day(root: Path, prefix: str, day: date, tz: str) -> list[Result]:
+    zone = ZoneInfo(tz)
+    start = datetime.combine(day, time())
+    log = SegmentLog(root, prefix)
+    return [replay(at, state, zone) for at, state in log.items(start, start + timedelta(days=1))]
+
+
+def replay_all(
+        root: Path,
+        prefix: str = PREFIX,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        tz: str = TIMEZONE,
+        workers: int | None = None,
+) -> list[Result]:
+    """
+    Replay the snapshots recorded from `start` up to `end`, from a segment log if
+    there is one or the json files otherwise, returning the results in time order.
+    """
+    log = SegmentLog(root, prefix)
+    days = log.days()
+    if days:
+        tasks = [
+            (replay_day, root, prefix, day, tz) for day in days
+            if (start is None or day >= start.date()) and (end is None or day <= end.date())
+        ]
+    else:
+        paths = select(snapshot_paths(root, prefix), start, end)
+        tasks = [(replay_paths, paths[i:i + CHUNK], tz) for i in range(0, len(paths), CHUNK)]
+    if workers == 1:
+        chunks = [function(*args) for function, *args in tasks]
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            chunks = [f.result() for f in [executor.submit(*task) for task in tasks]]
+    results = [result for chunk in chunks for result in chunk]
+    return [r for r in results if (start is None or r.at >= start) and (end is None or r.at < end)]
+
+
+def changes(results: list[Result]) -> int:
+    """
+    How many times the output was different from that of the snapshot before.
+    """
+    digests = [r.digest for r in results if r.status == 'ok']
+    return sum(a != b for a, b in zip(digests, digests[1:]))
+
+
+def dst_changes(results: list[Result], tz: str = TIMEZONE) -> list[date]:
+    """
+    The days with a DST change that fell within the schedule of a replayed snapshot.
+    """
+    zone = ZoneInfo(tz)
+    found = set()
+    for day in {r.at.date() for r in results if r.status != 'skipped'}:
+        for candidate in day, day + timedelta(days=1):
+            length = Timestamp(candidate + timedelta(days=1), tz=zone) - Timestamp(candidate, tz=zone)
+            if length != timedelta(days=1):
+                found.add(candidate)
+    return sorted(found)
+
+
+def load_baseline(path: Path) -> dict[datetime, dict]:
+    baseline = {}
+    for line in path.read_text().splitlines():
+        if line:
+            result = json.loads(line)
+            baseline[datetime.fromisoformat(result['at'])] = result
+    return baseline
+
+
+def save_baseline(path: Path, results: list[Result]) -> None:
+    with path.open('w') as target:
+        for result in results:
+            target.write(json.dumps(asdict(result), default=datetime.isoformat) + '\n')
+
+
+def differences(results: list[Result], baseline: dict[datetime, dict]) -> list[tuple[Result, dict]]:
+    """
+    The results, for snapshots in the baseline, that aren't the same as before.
+    """
+    different = []
+    for result in results:
+        before = baseline.get(result.at)
+        if before is not None and (before['status'], before['digest']) != (result.status, result.digest):
+            different.append((result, before))
+    return different
+
+
+def report(
+        results: list[Result],
+        seconds: float,
+        different: list[tuple[Result, dict]] | None = None,
+        tz: str = TIMEZONE,
+) -> str:
+    if not results:
+        return 'No snapshots found'
+    counts = Counter(r.status for r in results)
+    lines = [
+        f'Replayed {len(results)} snapshots from {results[0].at} to {results[-1].at} '
+        f'in {seconds:.1f}s',
+        '  ' + ', '.join(f'{status}: {counts[status]}' for status in ('ok', 'error', 'gaps', 'skipped')),
+        f'  warnings: {sum(len(r.warnings) for r in results)}',
+        f'  output changes between snapshots: {changes(results)}',
+        f"  DST changes covered: {', '.join(map(str, dst_changes(results, tz))) or 'none'}",
+    ]
+    for result in results:
+        if result.error:
+            lines.append(f'{result.at} {result.status}: {result.error}')
+    if different is not None:
+        lines.append(f'Differences from baseline: {len(different)}')
+        for result, before in different:
+            lines.append(
+                f"{result.at} was {before['status']} {before['digest']}, "
+                f"now {result.status} {result.digest}"
+            )
+    return '\n'.join(lines)
+
+
+def main():
+    config = Config.from_path('config.yaml')
+    root = root_from(config)
+
+    parser = ArgumentParser(description='Replay recorded dispatch snapshots to check for regressions.')
+    parser.add_argument('--prefix', default=PREFIX)
+    parser.add_argument('--start', type=datetime.fromisoformat)
+    parser.add_argument('--end', type=datetime.fromisoformat)
+    parser.add_argument('--baseline', type=Path, help='results of an earlier run to compare with')
+    parser.add_argument('--save', type=Path, help='where to write the results, for use as a baseline')
+    parser.add_argument('--workers', type=int)
+    add_log_level(parser)
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    started = perf_counter()
+    results = replay_all(root, args.prefix, args.start, args.end, workers=args.workers)
+    seconds = perf_counter() - started
+    different = None
+    if args.baseline:
+        different = differences(results, load_baseline(args.baseline))
+    print(report(results, seconds, different))
+    if args.save:
+        save_baseline(args.save, results)
+    if any(r.status in ('error', 'gaps') for r in results) or different:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""
+Hourly, daily and monthly sum, min, max and count for every column of each source,
+kept in one table per source and level under ``rollups/`` in the storage directory.
+
+Alongside those is a ``peaks`` table with a row for each day, giving the peak of each
+column, the peaks of its rolling means over :data:`WINDOWS`, when each happened and
+the day's total, so that the days with the highest peaks can be found without reading
+every day file.
+"""
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+
+from loaders import SOURCES, TIMEZONE
+
+STATS = ('sum', 'min', 'max', 'count')
+# how each statistic combines when rolling up further:
+COMBINE = {'sum': 'sum', 'min': 'min', 'max': 'max', 'count': 'sum'}
+LEVELS = {'hour': 'h', 'day': 'D', 'month': 'MS'}
+# rolling means whose peaks are kept, as sustained load matters more than a spike:
+WINDOWS = ('20min', '1h')
+
+
+def table_path(root: Path, source: str, level: str) -> Path:
+    return root / 'rollups' / f'{source}-{level}.pkl'
+
+
+def read(
+        root: Path, source: str, level: str, start: date | None = None, end: date | None = None
+) -> pd.DataFrame:
+    """
+    The rollups for `source` at `level`, from `start` up to but not including `end`,
+    indexed by the local start of each period. Columns are named ``{column}_{stat}``.
+    """
+    path = table_path(root, source, level)
+    if not path.exists():
+        return pd.DataFrame(index=pd.DatetimeIndex([], tz=TIMEZONE))
+    table = pd.read_pickle(path)
+    if start is not None:
+        table = table[table.index >= pd.Timestamp(start, tz=TIMEZONE)]
+    if end is not None:
+        table = table[table.index < pd.Timestamp(end, tz=TIMEZONE)]
+    return table
+
+
+def write(root: Path, source: str, level: str, table: pd.DataFrame) -> None:
+    path = table_path(root, source, level)
+    path.parent.mkdir(exist_ok=True)
+    tmp = path.with_suffix('.tmp')
+    table.to_pickle(tmp)
+    tmp.replace(path)
+
+
+def hourly(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Roll up one day of interval data into local hours.
+    """
+    rolled = frame.tz_convert(TIMEZONE).resample('h').agg(list(STATS))
+    rolled.columns = [f'{column}_{stat}' for column, stat in rolled.columns]
+    return rolled[rolled.filter(like='_count').sum(axis=1) > 0]
+
+
+def roll_up(table: pd.DataFrame, level: str) -> pd.DataFrame:
+    """
+    Combine rows of `table` into periods of `level`.
+    """
+    how = {column: COMBINE[column.rsplit('_', 1)[1]] for column in table.columns}
+    rolled = table.resample(LEVELS[level]).agg(how)
+    return rolled[rolled.filter(like='_count').sum(axis=1) > 0]
+
+
+def month_keys(index: pd.DatetimeIndex) -> pd.Index:
+    return index.year * 100 + index.month
+
+
+def replace_rows(table: pd.DataFrame, rows: pd.DataFrame, drop) -> pd.DataFrame:
+    return pd.concat([table[~drop], rows]).sort_index()
+
+
+def update(root: Path, source: str, hours: dict[date, pd.DataFrame]) -> None:
+    """
+    Replace the rollups for the day files in `hours`, each being the result of
+    :func:`hourly` for that day, and recompute the local days and months they feed.
+    """
+    if not hours:
+        return
+    days = list(hours)
+    new_hours = pd.concat(hours.values())
+
+    # a file's day can differ from the local one, as zappi's are UTC, so the hours it
+    # covers are found in its own time zone:
+    table = read(root, source, 'hour')
+    replaced = pd.Index(table.index.tz_convert(SOURCES[source].tz).date).isin(days)
+    local_days = set(new_hours.index.date) | set(table.index[replaced].date)
+    table = replace_rows(table, new_hours, replaced)
+    write(root, source, 'hour', table)
+
+    # each local day is rolled up again from all of its hours, wherever they came from:
+    new_days = roll_up(table[pd.Index(table.index.date).isin(local_days)], 'day')
+    table = read(root, source, 'day')
+    table = replace_rows(table, new_days, pd.Index(table.index.date).isin(local_days))
+    write(root, source, 'day', table)
+
+    months = [day.year * 100 + day.month for day in local_days]
+    new_months = roll_up(table[month_keys(table.index).isin(months)], 'month')
+    table = read(root, source, 'month')
+    write(root, source, 'month', replace_rows(table, new_months, month_keys(table.index).isin(months)))
+
+
+def peak(values: pd.Series, name: str) -> dict:
+    values = values.dropna()
+    if values.empty:
+        return {name: float('nan'), f'{name}_at': pd.NaT}
+    return {name: values.max(), f'{name}_at': values.idxmax()}
+
+
+def rolling_mean(frame: pd.DataFrame, window: str, interval: pd.Timedelta) -> pd.DataFrame:
+    """
+    Rolling means over `window` of data with readings every `interval`, counted only
+    once the window is full and timed by the end of it.
+    """
+    return frame.rolling(window, min_periods=max(pd.Timedelta(window) // interval, 1)).mean()
+
+
+def day_peaks(frame: pd.DataFrame, interval: pd.Timedelta) -> pd.DataFrame:
+    """
+    The peaks table rows for interval data with readings every `interval`, one for
+    each local day the readings are in.
+    """
+    frame = frame.tz_convert(TIMEZONE).sort_index()
+    rows = {}
+    for day, readings in frame.groupby(frame.index.date):
+        row = rows[pd.Timestamp(day, tz=TIMEZONE)] = {}
+        for column, values in readings.items():
+            row.update(peak(values, f'{column}_max'))
+            for window in WINDOWS:
+                row.update(peak(rolling_mean(values, window, interval), f'{column}_max_{window}'))
+            row[f'{column}_sum'] = values.sum()
+    return pd.DataFrame(list(rows.values()), index=pd.DatetimeIndex(list(rows)))
+
+
+def update_peaks(root: Path, source: str, peaks: dict[date, pd.DataFrame]) -> None:
+    """
+    Replace the rows of the peaks table for the local days in the values of `peaks`,
+    each being the result of :func:`day_peaks` for a day file.
+    """
+    if not peaks:
+        return
+    table = read(root, source, 'peaks')
+    new_rows = pd.concat(peaks.values())
+    # neighbouring files of a source with UTC days both give rows for the local day
+    # they share, read from the same readings:
+    new_rows = new_rows[~new_rows.index.duplicated(keep='last')]
+    replaced = pd.Index(table.index.date).isin(list(new_rows.index.date))
+    write(root, source, 'peaks', replace_rows(table, new_rows, replaced))
+
+
+def top(
+        root: Path,
+        source: str,
+        column: str,
+        n: int = 10,
+        start: date | None = None,
+        end: date | None = None,
+) -> pd.DataFrame:
+    """
+    The `n` days with the highest `column` of the peaks table, such as
+    ``imp_kw_max_20min`` or ``h1b_sum``, highest first.
+    """
+    table = read(root, source, 'peaks', start, end)
+    if table.empty:
+        return table
+    found = table.nlargest(n, column)
+    at = f'{column}_at'
+    return found[[column, at]] if at in found else found[[column]]
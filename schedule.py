@@ -1,10 +1,12 @@
 import logging
 from datetime import UTC
 from collections import defaultdict
+from typing import Any
 from zoneinfo import ZoneInfo
 
 from pandas import Timestamp, Timedelta
 
+from common import compact
 from octopus import Schedule
 
 CHEAP_KEY = "SUPER_OFF_PEAK"
@@ -12,6 +14,7 @@ EXPENSIVE_KEY = "ON_PEAK"
 NEW_CHEAP_KEY = "NEW_SUPER_OFF_PEAK"
 NEW_EXPENSIVE_KEY = "NEW_ON_PEAK"
 MAX_ALLOWABLE_MISSING_STANDARD_UNIT_RATES = Timedelta(hours=4)
+TOU_PERIOD_KEYS = {'fromHour', 'fromMinute', 'toHour', 'toMinute'}
 
 
 def price_in_pounds(price_in_pence: float) -> float:
@@ -32,6 +35,25 @@ def unit_rates_sort_key(rate: dict[str, str | float]) -> Timestamp:
     return Timestamp(rate['validFrom']).astimezone(UTC)
 
 
+def is_tou_period(value: Any) -> bool:
+    return isinstance(value, dict) and TOU_PERIOD_KEYS <= value.keys()
+
+
+def format_tou_period(value: Any) -> str:
+    """
+    Format a Tesla time of use period like ``00:30-04:30``, for use in diffs.
+    Anything else is formatted as compact json.
+    """
+    if is_tou_period(value):
+        return (
+            f"{value['fromHour']:02d}:{value['fromMinute']:02d}-"
+            f"{value['toHour']:02d}:{value['toMinute']:02d}"
+        )
+    if isinstance(value, list) and value and all(isinstance(v, dict) for v in value):
+        return '[' + ', '.join(format_tou_period(v) for v in value) + ']'
+    return compact(value)
+
+
 def make_seasons_and_energy_charges(
         now: Timestamp, unit_rates_schedule: list[dict], dispatches: dict, timezone: ZoneInfo
 ) -> dict:
@@ -0,0 +1,280 @@
+"""
+An append-only store for snapshots of a JSON state that changes rarely but is
+polled often, such as the Octopus dispatches or the Tesla tariff.
+
+Each change is appended as one JSON line to a gzipped segment file for that day,
+which is compacted into a single gzip member once the next day's segment is
+started. The first record in each segment is the full state, later ones are
+deltas against the state before them, so any one segment can be read without
+the others. A sidecar index holds the time of every record, and the latest state
+is kept on its own so it can be loaded without reading any segments.
+"""
+import gzip
+import json
+import logging
+from argparse import ArgumentParser
+from bisect import bisect_right
+from collections.abc import Iterator
+from datetime import UTC, datetime, date
+from itertools import islice
+from pathlib import Path
+from typing import Any
+
+from configurator import Config
+
+from common import add_log_level, configure_logging, root_from, snapshot_time
+
+Delta = list[list]
+
+
+def delta(old: dict, new: dict, path: tuple[str, ...] = ()) -> Iterator[list]:
+    """
+    Yield the operations that turn `old` into `new`: ``[path, value]`` to set a key
+    and ``[path]`` to remove one. Only dictionaries are recursed into.
+    """
+    for key in old:
+        if key not in new:
+            yield [[*path, key]]
+    for key, value in new.items():
+        if key not in old:
+            yield [[*path, key], value]
+        else:
+            current = old[key]
+            if current == value:
+                continue
+            if isinstance(current, dict) and isinstance(value, dict):
+                yield from delta(current, value, (*path, key))
+            else:
+                yield [[*path, key], value]
+
+
+def apply(state: dict, operations: Delta) -> dict:
+    """
+    Return a copy of `state` with `operations` from :func:`delta` applied.
+    Only the dictionaries along changed paths are copied.
+    """
+    state = dict(state)
+    for operation in operations:
+        path = operation[0]
+        target = state
+        for key in path[:-1]:
+            target[key] = target = dict(target[key])
+        if len(operation) == 1:
+            del target[path[-1]]
+        else:
+            target[path[-1]] = operation[1]
+    return state
+
+
+def utc(when: datetime) -> datetime:
+    """
+    `when` in UTC, where a naive `when` is a local time as in snapshot file names.
+    """
+    return when.astimezone(UTC)
+
+
+def local(when: datetime) -> datetime:
+    """
+    `when` as a naive local time, with ``fold`` set in the hour repeated when DST ends.
+    """
+    return datetime.fromtimestamp(when.timestamp())
+
+
+class SegmentLog:
+    """
+    Times are stored in UTC, so they only ever go forwards, and are returned as
+    naive local times. Segments are named for the local day.
+    """
+
+    def __init__(self, target: Path, prefix: str):
+        self.target = target
+        self.prefix = prefix
+        self.latest_path = target / f'{prefix}.latest'
+        self._latest: tuple[datetime, Any] | None = None
+        # the local day and state of the last record in the segment being appended to:
+        self._tail: tuple[date, Any] | None = None
+
+    def segment_path(self, day: date) -> Path:
+        return self.target / f'{self.prefix}-{day:%Y-%m-%d}.jsonl.gz'
+
+    def index_path(self, day: date) -> Path:
+        return self.target / f'{self.prefix}-{day:%Y-%m-%d}.idx'
+
+    def days(self) -> list[date]:
+        days = []
+        for path in self.target.glob(f'{self.prefix}-*.idx'):
+            try:
+                days.append(datetime.strptime(path.name, f'{self.prefix}-%Y-%m-%d.idx').date())
+            except ValueError:
+                pass
+        return sorted(days)
+
+    def index(self, day: date) -> list[datetime]:
+        """
+        The UTC time of each record in the segment for `day`, in order.
+        """
+        path = self.index_path(day)
+        if not path.exists():
+            return []
+        # older indexes also had a byte offset for each record:
+        return [utc(datetime.fromisoformat(line.split('\t')[0])) for line in path.read_text().splitlines()]
+
+    def latest(self) -> tuple[datetime, Any] | None:
+        """
+        The time and content of the most recently appended state.
+        """
+        if self._latest is None:
+            latest = None
+            if self.latest_path.exists():
+                data = json.loads(self.latest_path.read_text())
+                latest = utc(datetime.fromisoformat(data['at'])), data['state']
+            days = self.days()
+            index = self.index(days[-1]) if days else []
+            if index and (latest is None or latest[0] < index[-1]):
+                # a crash between writing a record and the latest file:
+                *_, (at, state) = self._replay(days[-1])
+                latest = utc(at), state
+                self._write_latest(*latest)
+            self._latest = latest
+        if self._latest is None:
+            return None
+        at, state = self._latest
+        return local(at), state
+
+    def _write_latest(self, at: datetime, state: Any) -> None:
+        latest_tmp = self.latest_path.with_suffix('.tmp')
+        latest_tmp.write_text(json.dumps({'at': at.isoformat(), 'state': state}))
+        latest_tmp.replace(self.latest_path)
+
+    def append(self, at: datetime, state: Any) -> Path:
+        at = utc(at)
+        day = local(at).date()
+        path = self.segment_path(day)
+        if path.exists() and path.stat().st_size:
+            # deltas are against the segment's own last state rather than the latest
+            # file, which can be behind it after a crash:
+            if self._tail is None or self._tail[0] != day:
+                *_, (_, previous) = self._replay(day)
+                self._tail = day, previous
+            previous = self._tail[1]
+        else:
+            previous = None
+            earlier = [d for d in self.days() if d < day]
+            if earlier:
+                self.compact(earlier[-1])
+        if isinstance(previous, dict) and isinstance(state, dict):
+            record = {'at': at.isoformat(), 'delta': list(delta(previous, state))}
+        else:
+            record = {'at': at.isoformat(), 'state': state}
+        with path.open('ab') as segment:
+            # a member per record until the day is over and the segment is compacted,
+            # so nothing already written is rewritten while it's being appended to:
+            segment.write(gzip.compress(json.dumps(record).encode() + b'\n'))
+        with self.index_path(day).open('a') as index:
+            index.write(f'{at.isoformat()}\n')
+        self._write_latest(at, state)
+        self._tail = day, state
+        self._latest = at, state
+        return path
+
+    def compact(self, day: date) -> None:
+        """
+        Rewrite the segment for `day` as a single gzip member, so records are
+        compressed together rather than one at a time.
+        """
+        path = self.segment_path(day)
+        if not path.exists():
+            return
+        content = gzip.decompress(path.read_bytes())
+        tmp = path.with_suffix('.tmp')
+        tmp.write_bytes(gzip.compress(content))
+        tmp.replace(path)
+
+    def _replay(self, day: date, count: int | None = None) -> Iterator[tuple[datetime, Any]]:
+        with gzip.open(self.segment_path(day), 'rb') as segment:
+            state = None
+            for line in islice(segment, count):
+                record = json.loads(line)
+                if 'state' in record:
+                    state = record['state']
+                else:
+                    state = apply(state, record['delta'])
+                yield local(utc(datetime.fromisoformat(record['at']))), state
+
+    def at(self, when: datetime) -> tuple[datetime, Any] | None:
+        """
+        The time and content of the state that was current at `when`, or ``None``
+        if nothing had been recorded by then.
+        """
+        when = utc(when)
+        self.latest()
+        if self._latest is not None and self._latest[0] <= when:
+            return local(self._latest[0]), self._latest[1]
+        days = self.days()
+        for day in reversed(days[:bisect_right(days, local(when).date())]):
+            position = bisect_right(self.index(day), when)
+            if position:
+                *_, found = self._replay(day, position)
+                return found
+        return None
+
+    def items(
+            self, start: datetime | None = None, end: datetime | None = None
+    ) -> Iterator[tuple[datetime, Any]]:
+        """
+        Yield the time and content of each state recorded from `start` up to,
+        but not including, `end`.
+        """
+        start = start and utc(start)
+        end = end and utc(end)
+        for day in self.days():
+            if (start is not None and day < local(start).date()) or (end is not None and day > local(end).date()):
+                continue
+            for at, state in self._replay(day):
+                if (start is None or utc(at) >= start) and (end is None or utc(at) < end):
+                    yield at, state
+
+
+def import_snapshots(log: SegmentLog) -> None:
+    latest = log.latest()
+    count = 0
+    for path in sorted(log.target.glob(f'{log.prefix}-*.json')):
+        try:
+            at = snapshot_time(path)
+        except ValueError:
+            continue
+        if latest is not None and at <= latest[0]:
+            continue
+        log.append(at, json.loads(path.read_text()))
+        count += 1
+    logging.info(f'imported {count} snapshots into {log.prefix} segments')
+
+
+def main():
+    parser = ArgumentParser(description='Manage segment logs of DiffDumper snapshots.')
+    parser.add_argument('action', choices=['import', 'compact', 'show'])
+    parser.add_argument('prefix', help='for example: octopus-dispatches')
+    parser.add_argument('--at', type=datetime.fromisoformat, help='defaults to now')
+    add_log_level(parser)
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    config = Config.from_path('config.yaml')
+    log = SegmentLog(root_from(config), args.prefix)
+    if args.action == 'import':
+        import_snapshots(log)
+    elif args.action == 'compact':
+        # segments written before compaction, leaving today's to be appended to:
+        for day in log.days()[:-1]:
+            log.compact(day)
+    else:
+        found = log.at(args.at) if args.at else log.latest()
+        if found is None:
+            raise SystemExit(f'No {args.prefix} state found')
+        at, state = found
+        print(f'{at:%a %d %b %y %H:%M:%S}')
+        print(json.dumps(state, indent=4))
+
+
+if __name__ == '__main__':
+    main()
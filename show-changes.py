@@ -1,15 +1,22 @@
 import difflib
+import json
 import shlex
 from argparse import ArgumentParser
 from dataclasses import dataclass
-from datetime import date, datetime
+from datetime import datetime
+from functools import cached_property
+from itertools import pairwise
 from pathlib import Path
+from typing import Any, Iterable, Iterator
 
 from colorama import Fore
 from configurator import Config
-from pandas import Timestamp
 
-from common import add_log_level, configure_logging, root_from
+from common import (
+    add_log_level, configure_logging, root_from, select, snapshot_paths, snapshot_time,
+    structural_diff,
+)
+from segments import SegmentLog
 
 
 def color_diff(diff):
@@ -18,7 +25,7 @@ def color_diff(diff):
             yield Fore.GREEN + line + Fore.RESET
         elif line.startswith('-'):
             yield Fore.RED + line + Fore.RESET
-        elif line.startswith('^'):
+        elif line.startswith(('^', '~')):
             yield Fore.BLUE + line + Fore.RESET
         else:
             yield line
@@ -27,7 +34,15 @@ def color_diff(diff):
 @dataclass
 class DiffData:
     name: str
-    lines: list[str]
+    text: str
+
+    @cached_property
+    def lines(self) -> list[str]:
+        return self.text.splitlines(keepends=True)
+
+    @cached_property
+    def data(self) -> Any:
+        return json.loads(self.text)
 
 
 def diff(a: DiffData, b: DiffData):
@@ -35,21 +50,19 @@ def diff(a: DiffData, b: DiffData):
     return ''.join(color_diff(raw_diff))
 
 
-PATTERN = "%Y-%m-%d-%H-%M-%S.json"
-DASH_COUNT = PATTERN.count('-')+1
+def json_diff(a: DiffData, b: DiffData):
+    changes = [f'{change}\n' for change in structural_diff(a.data, b.data)]
+    return ''.join(color_diff([f'--- {a.name}\n', f'+++ {b.name}\n', *changes]))
 
 
-def datetime_from_path(path: Path) -> datetime:
-    parts = path.name.rsplit('-', DASH_COUNT)
-    return datetime.strptime('-'.join(parts[1:]), "%Y-%m-%d-%H-%M-%S.json")
+def extract(path: Path) -> DiffData:
+    d = snapshot_time(path)
+    return DiffData(f'{shlex.quote(str(path))} ({d:%a %d %b %y %H:%M:%S})', path.read_text())
 
 
-def extract(path: Path) -> DiffData:
-    d = datetime_from_path(path)
-    return DiffData(
-        f'{shlex.quote(str(path))} ({d:%a %d %b %y %H:%M:%S})',
-        path.read_text().splitlines(keepends=True)
-    )
+def from_log(items: Iterable[tuple[datetime, Any]], log: SegmentLog) -> Iterator[DiffData]:
+    for at, state in items:
+        yield DiffData(f'{log.prefix} ({at:%a %d %b %y %H:%M:%S})', json.dumps(state, indent=4))
 
 
 def main():
@@ -58,21 +71,25 @@ def main():
 
     parser = ArgumentParser()
     parser.add_argument('prefix')
-    parser.add_argument('--start', type=Timestamp)
-    parser.add_argument('--end', type=Timestamp)
+    parser.add_argument('--start', type=datetime.fromisoformat)
+    parser.add_argument('--end', type=datetime.fromisoformat)
+    parser.add_argument('--structural', action='store_true',
+                        help='show the paths that changed rather than a line diff')
     add_log_level(parser)
 
     args = parser.parse_args()
     configure_logging(args.log_level)
 
-    paths = sorted(root.glob(f'{args.prefix}*'))
-    for path1, path2 in zip(paths, paths[1:]):
-        if all((
-            args.start is None or datetime_from_path(path1) > args.start,
-            args.end is None or datetime_from_path(path2) < args.end,
-        )):
-            print(diff(extract(path1), extract(path2)))
-            print()
+    log = SegmentLog(root, args.prefix)
+    if log.days():
+        snapshots = from_log(log.items(args.start, args.end), log)
+    else:
+        snapshots = map(extract, select(snapshot_paths(root, args.prefix), args.start, args.end))
+
+    show = json_diff if args.structural else diff
+    for a, b in pairwise(snapshots):
+        print(show(a, b))
+        print()
 
 
 if __name__ == '__main__':
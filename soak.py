@@ -0,0 +1,299 @@
+"""
+Soak test the ``octopus-tesla-sync.py`` :class:`Syncer` by running it against the
+stand-ins from :mod:`fakes`, cycle after cycle with no wait in between, so that days of
+``--run-every`` cycles pass in minutes.
+
+Memory, traced allocations, live objects, threads and open file descriptors are sampled
+as it goes. Once the warm-up cycles have filled any caches and connection pools, growth
+beyond the limits given fails the run, with the lines that allocated the most since
+then listed to show where a leak is.
+"""
+import csv
+import gc
+import logging
+import os
+import resource
+import subprocess
+import sys
+import threading
+import tracemalloc
+from argparse import ArgumentParser
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, fields
+from datetime import date, timedelta
+from importlib import import_module
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import monotonic, sleep
+
+from configurator import Config
+
+from common import DiffDumper, Run, add_log_level, configure_logging
+from octopus import OctopusGraphQLClient
+from synthetic import Spec, generate
+from tesla import installation_time_zone, tesla_client
+
+MiB = 1024 * 1024
+# how long to wait for the fakes to start:
+STARTUP = 30
+
+
+@dataclass
+class Sample:
+    cycle: int
+    seconds: float
+    rss: int
+    traced: int
+    objects: int
+    threads: int
+    fds: int
+    sockets: int
+
+
+@dataclass
+class Limits:
+    # growth allowed from the end of the warm-up to the end of the run:
+    rss: int = 32 * MiB
+    traced: int = 4 * MiB
+    objects: int = 20_000
+    threads: int = 0
+    fds: int = 2
+    sockets: int = 2
+
+
+def rss() -> int:
+    try:
+        pages = int(Path('/proc/self/statm').read_text().split()[1])
+    except OSError:
+        # no /proc, so use the peak, which still only grows if there's a leak:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def descriptors() -> tuple[int, int]:
+    """
+    The number of open file descriptors, and how many of those are sockets.
+    """
+    fd_dir = Path('/proc/self/fd')
+    if not fd_dir.exists():
+        fd_dir = Path('/dev/fd')
+    fds = sockets = 0
+    for fd in fd_dir.iterdir():
+        try:
+            target = os.readlink(fd)
+        except OSError:
+            # the descriptor used to list the directory has gone:
+            continue
+        fds += 1
+        sockets += target.startswith('socket:')
+    return fds, sockets
+
+
+def take_sample(cycle: int, started: float) -> Sample:
+    gc.collect()
+    fds, sockets = descriptors()
+    return Sample(
+        cycle,
+        monotonic() - started,
+        rss(),
+        tracemalloc.get_traced_memory()[0],
+        len(gc.get_objects()),
+        threading.active_count(),
+        fds,
+        sockets,
+    )
+
+
+@dataclass
+class Soak:
+    samples: list[Sample]
+    baseline: tracemalloc.Snapshot
+    final: tracemalloc.Snapshot
+    warmup: int
+    failures: int
+
+    @property
+    def after_warmup(self) -> Sample:
+        return next(s for s in self.samples if s.cycle >= self.warmup)
+
+    def growth(self, limits: Limits) -> list[str]:
+        """
+        Descriptions of anything that grew by more than `limits` after the warm-up.
+        """
+        start, end = self.after_warmup, self.samples[-1]
+        problems = []
+        for field in fields(Limits):
+            grown = getattr(end, field.name) - getattr(start, field.name)
+            allowed = getattr(limits, field.name)
+            if grown > allowed:
+                problems.append(
+                    f'{field.name} grew by {grown} from cycle {start.cycle} to {end.cycle}, '
+                    f'more than {allowed}'
+                )
+        return problems
+
+    def top_allocations(self, limit: int = 10) -> list[str]:
+        stats = self.final.compare_to(self.baseline, 'lineno')
+        return [str(stat) for stat in stats[:limit] if stat.size_diff > 0]
+
+
+def soak(
+        run: Run,
+        cycles: int,
+        warmup: int,
+        sample_every: int,
+        interval: float = 0,
+        frames: int = 1,
+) -> Soak:
+    """
+    Run `run` for `cycles` cycles, sampling resources every `sample_every` cycles
+    and snapshotting traced allocations at the end of `warmup` cycles and of the run.
+    """
+    warmup = min(warmup, cycles)
+    tracemalloc.start(frames)
+    try:
+        started = monotonic()
+        samples = [take_sample(0, started)]
+        baseline = tracemalloc.take_snapshot() if warmup == 0 else None
+        failures = 0
+        for cycle in range(1, cycles + 1):
+            try:
+                run.run()
+            except Exception:
+                logging.exception(f'cycle {cycle} failed')
+                failures += 1
+            if cycle == warmup:
+                samples.append(take_sample(cycle, started))
+                baseline = tracemalloc.take_snapshot()
+            elif cycle % sample_every == 0 or cycle == cycles:
+                samples.append(take_sample(cycle, started))
+                logging.info(
+                    f'cycle {cycle}: rss={samples[-1].rss / MiB:.1f}MiB '
+                    f'traced={samples[-1].traced / MiB:.2f}MiB fds={samples[-1].fds}'
+                )
+            if interval:
+                sleep(interval)
+        final = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    return Soak(samples, baseline, final, warmup, failures)
+
+
+def report(result: Soak, problems: list[str]) -> str:
+    lines = [
+        f"{'cycle':>7} {'seconds':>8} {'rss MiB':>8} {'traced MiB':>10} "
+        f"{'objects':>8} {'threads':>7} {'fds':>4} {'sockets':>7}"
+    ]
+    for s in result.samples:
+        lines.append(
+            f'{s.cycle:>7} {s.seconds:>8.1f} {s.rss / MiB:>8.1f} {s.traced / MiB:>10.2f} '
+            f'{s.objects:>8} {s.threads:>7} {s.fds:>4} {s.sockets:>7}'
+        )
+    lines.append(f'failed cycles: {result.failures}')
+    lines.append(f'largest allocations since cycle {result.after_warmup.cycle}:')
+    lines.extend(f'  {line}' for line in result.top_allocations())
+    lines.extend(problems or ['no growth beyond the limits'])
+    return '\n'.join(lines)
+
+
+def write_csv(path: Path, samples: list[Sample]) -> None:
+    with path.open('w', newline='') as target:
+        writer = csv.DictWriter(target, [f.name for f in fields(Sample)])
+        writer.writeheader()
+        writer.writerows(asdict(s) for s in samples)
+
+
+@contextmanager
+def fakes_process(source: Path, workdir: Path) -> Iterator[Config]:
+    """
+    Serve `source` through the fakes in another process, so they don't count towards
+    what's measured here, yielding config that uses them.
+    """
+    config_path = workdir / 'config.yaml'
+    process = subprocess.Popen([
+        sys.executable, str(Path(__file__).with_name('fakes.py')),
+        str(source), str(workdir / 'downloaded'), '--config', str(config_path),
+        '--log-level', 'warning',
+    ])
+    try:
+        deadline = monotonic() + STARTUP
+        while not config_path.exists():
+            if process.poll() is not None or monotonic() > deadline:
+                raise RuntimeError('fakes did not start')
+            sleep(0.05)
+        config = Config.from_path(str(config_path))
+        yield config
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def make_syncer(config: Config, storage: Path, segments: bool = False):
+    sync = import_module('octopus-tesla-sync')
+    battery, = tesla_client(config).battery_list()
+    return sync.Syncer(
+        OctopusGraphQLClient(config.octopus.api_key, config.octopus.base_url),
+        config.octopus.account,
+        DiffDumper(storage, prefix='octopus-dispatches', segments=segments),
+        battery,
+        installation_time_zone(battery),
+        sync=True,
+        # so that every cycle dumps and sets the Tesla tariff:
+        force=True,
+    )
+
+
+def main():
+    parser = ArgumentParser(description='Run the sync against fake APIs, checking for leaks.')
+    parser.add_argument('--source', type=Path,
+                        help='storage directory to serve, synthetic data is generated if not given')
+    parser.add_argument('--days', type=float, default=7, help='days of cycles to run')
+    parser.add_argument('--run-every', type=float, default=5,
+                        help='minutes between the cycles being simulated')
+    parser.add_argument('--warmup', type=int, default=50, help='cycles to run before measuring growth')
+    parser.add_argument('--samples', type=int, default=20, help='how many times to sample')
+    parser.add_argument('--interval', type=float, default=0, help='seconds to wait between cycles')
+    parser.add_argument('--frames', type=int, default=1, help='frames of traceback to trace')
+    parser.add_argument('--segments', action='store_true', help='dump to a segment log')
+    parser.add_argument('--csv', type=Path, help='where to write the samples')
+    for field in fields(Limits):
+        unit = ' in MiB' if field.default >= MiB else ''
+        default = field.default // MiB if unit else field.default
+        parser.add_argument(f'--max-{field.name}-growth', type=int, default=default,
+                            help=f'fail if {field.name} grows by more than this{unit}')
+    add_log_level(parser)
+    parser.set_defaults(log_level='warning')
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    limits = Limits(**{
+        f.name: getattr(args, f'max_{f.name}_growth') * (MiB if f.default >= MiB else 1)
+        for f in fields(Limits)
+    })
+    cycles = int(timedelta(days=args.days) / timedelta(minutes=args.run_every))
+
+    with TemporaryDirectory() as workdir:
+        workdir = Path(workdir)
+        source = args.source
+        if source is None:
+            source = workdir / 'source'
+            source.mkdir()
+            generate(Spec(date.today() - timedelta(days=1), 2, kinds=('dispatches',)), source, workers=1)
+        storage = workdir / 'storage'
+        storage.mkdir()
+        with fakes_process(source, workdir) as config:
+            run = Run(make_syncer(config, storage, args.segments), name='soak')
+            print(f'running {cycles} cycles, {args.days} days at every {args.run_every} minutes')
+            result = soak(run, cycles, args.warmup, max(cycles // args.samples, 1), args.interval, args.frames)
+
+    problems = result.growth(limits)
+    print(report(result, problems))
+    if args.csv:
+        write_csv(args.csv, result.samples)
+    if problems or result.failures:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,427 @@
+"""
+Write a storage directory of made-up data in exactly the formats the download scripts
+produce, for benchmarking and soak testing without real accounts.
+
+Every day is generated from its own seeded random state, so days can be written in
+parallel and the same :class:`Spec` always produces the same files. The sources agree
+with each other: the car charging seen by the zappi is in the Tesla's home load, turns
+up as grid import for Octopus and matches the dispatches in the snapshots.
+"""
+import json
+import logging
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from functools import cached_property
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from common import add_log_level, configure_logging, SNAPSHOT_PATTERN
+from loaders import SOURCES, TESLA_APP_COLUMNS, TIMEZONE
+
+KINDS = ('octopus', 'tesla', 'zappi', 'dispatches')
+# each kind of randomness gets its own stream, so changing one doesn't change the others:
+STREAMS = ('load', 'cloud', 'charging', 'gaps', 'missing', 'meter')
+MINUTE = pd.Timedelta(minutes=1)
+# a day's charging starts during the cheap period:
+CHARGE_START = pd.Timedelta(hours=23, minutes=30)
+CHARGER_WATTS = 7000
+BATTERY_WATTS = 5000
+CHUNK_DAYS = 30
+MPAN = '1900000000000'
+METER_SERIAL = '21L0000000'
+EPOCH = date(1970, 1, 1).toordinal()
+# local times of day at which the dispatches are snapshotted:
+SNAPSHOT_TIMES = ('17:03:12', '20:31:45', '22:58:03', '23:46:29', '02:15:51', '05:42:08')
+
+
+@dataclass(frozen=True)
+class Spec:
+    start: date
+    days: int
+    seed: int = 0
+    tz: str = TIMEZONE
+    kinds: tuple[str, ...] = KINDS
+    # how much more is used in winter than on average, and less in summer:
+    seasonality: float = 0.4
+    # multiplies the household consumption:
+    scale: float = 1.0
+    # chance of a day having a run of missing readings, and of a day's file being missing:
+    gap_rate: float = 0.02
+    missing_rate: float = 0.005
+    # also write a Tesla csv, either 'api' as from tesla.py json-to-csv or 'app' for an export:
+    tesla_csv: str | None = None
+    # number of dispatch snapshots each day, up to len(SNAPSHOT_TIMES):
+    snapshots: int = 4
+    zappi_serial: str = '12345678'
+
+    def rng(self, stream: str, day: date, kind: str = 'tesla') -> np.random.Generator:
+        return np.random.default_rng(
+            [self.seed, day.toordinal(), STREAMS.index(stream), KINDS.index(kind)]
+        )
+
+    @property
+    def dates(self) -> list[date]:
+        return [self.start + timedelta(days=i) for i in range(self.days)]
+
+
+def charging(spec: Spec, day: date) -> tuple[pd.Timestamp, pd.Timestamp] | None:
+    """
+    When the car charges from the cheap period starting on the evening of `day`, if at all.
+    """
+    rng = spec.rng('charging', day)
+    if rng.random() < 0.4:
+        return None
+    start = pd.Timestamp(day, tz=spec.tz) + CHARGE_START
+    return start, start + pd.Timedelta(minutes=30 * int(rng.integers(2, 12)))
+
+
+def seasonal(day_of_year: np.ndarray, amplitude: float) -> np.ndarray:
+    # coldest in mid January:
+    return 1 + amplitude * np.cos(2 * np.pi * (day_of_year - 15) / 365.25)
+
+
+def wall_minutes(index: pd.DatetimeIndex, tz: str) -> np.ndarray:
+    """
+    Minutes since the epoch of the local time for each of `index`.
+    """
+    return index.tz_convert(tz).tz_localize(None).as_unit('s').asi8 // 60
+
+
+def power(spec: Spec, minutes: pd.DatetimeIndex) -> dict[str, np.ndarray]:
+    """
+    Home load, solar, battery, car and grid power in W for each of `minutes`.
+    """
+    wall = wall_minutes(minutes, spec.tz)
+    hours = (wall % 1440) / 60
+    day_numbers, day_index = np.unique(wall // 1440, return_inverse=True)
+    days = [date.fromordinal(EPOCH + int(d)) for d in day_numbers]
+    day_of_year = np.array([d.timetuple().tm_yday for d in days])[day_index]
+
+    # a base load with morning and evening peaks, more in winter:
+    profile = (
+        300
+        + 900 * np.exp(-((hours - 7.5) ** 2) / 1.5)
+        + 1500 * np.exp(-((hours - 18.5) ** 2) / 4)
+    )
+    load = profile * seasonal(day_of_year, spec.seasonality) * spec.scale
+    load *= spec.rng('load', days[0]).lognormal(0, 0.25, len(minutes))
+
+    # sunshine is longer and stronger in summer, and each day has its own cloud cover:
+    summer = 2 - seasonal(day_of_year, 1)
+    half_day = 4 + 2.5 * summer
+    sun = np.clip(np.cos(np.pi * (hours - 13) / (2 * half_day)), 0, None) ** 1.5
+    sun[np.abs(hours - 13) > half_day] = 0
+    cloud = np.array([spec.rng('cloud', d).uniform(0.2, 1) for d in days])[day_index]
+    solar = 4000 * sun * (0.4 + 0.6 * summer / 2) * cloud
+
+    car = np.zeros(len(minutes))
+    for day in [days[0] - timedelta(days=1), *days]:
+        window = charging(spec, day)
+        if window is not None:
+            car[minutes.searchsorted(window[0]):minutes.searchsorted(window[1])] = CHARGER_WATTS
+
+    # the battery covers what it can of any shortfall, except while the car charges:
+    battery = np.clip(load - solar, -BATTERY_WATTS, BATTERY_WATTS) * np.where(car > 0, 0, 0.8)
+    grid = load + car - solar - battery
+    return {'load': load + car, 'solar': solar, 'battery': battery, 'car': car, 'grid': grid}
+
+
+# formatting timestamps one by one is far too slow for years of data, so these
+# are put together from their parts:
+TIMES_OF_DAY = [f'{m // 60:02d}:{m % 60:02d}:00' for m in range(24 * 60)]
+
+
+def isoformat(index: pd.DatetimeIndex, tz: str) -> list[str]:
+    """
+    The same strings as ``Timestamp.isoformat()`` for each of `index`, in `tz`.
+    """
+    utc = wall_minutes(index, 'UTC')
+    wall = wall_minutes(index, tz)
+    dates = {d: date.fromordinal(EPOCH + d).isoformat() for d in set((wall // 1440).tolist())}
+    offsets = {
+        o: f"{'-' if o < 0 else '+'}{abs(o) // 60:02d}:{abs(o) % 60:02d}"
+        for o in set((wall - utc).tolist())
+    }
+    return [
+        f'{dates[w // 1440]}T{TIMES_OF_DAY[w % 1440]}{offsets[w - u]}'
+        for w, u in zip(wall.tolist(), utc.tolist())
+    ]
+
+
+def kept(spec: Spec, kind: str, day: date, length: int) -> tuple[slice, slice] | None:
+    """
+    The parts of a day's `length` readings to keep, if some are to be dropped as a gap.
+    """
+    rng = spec.rng('gaps', day, kind)
+    if rng.random() >= spec.gap_rate:
+        return None
+    size = int(rng.integers(1, max(length // 10, 2)))
+    start = int(rng.integers(0, length - size))
+    return slice(0, start), slice(start + size, length)
+
+
+def with_gap(values: list | np.ndarray, keep: tuple[slice, slice] | None):
+    if keep is None:
+        return values
+    if isinstance(values, np.ndarray):
+        return np.concatenate([values[keep[0]], values[keep[1]]])
+    return values[keep[0]] + values[keep[1]]
+
+
+def missing(spec: Spec, kind: str, day: date) -> bool:
+    return spec.rng('missing', day, kind).random() < spec.missing_rate
+
+
+@dataclass
+class Chunk:
+    """
+    The power flows for a run of days, covering both their local and UTC extents.
+    """
+    spec: Spec
+    days: list[date]
+
+    @cached_property
+    def minutes(self) -> pd.DatetimeIndex:
+        first, after = self.days[0], self.days[-1] + timedelta(days=1)
+        start = min(pd.Timestamp(first, tz=self.spec.tz), pd.Timestamp(first, tz='UTC'))
+        end = max(pd.Timestamp(after, tz=self.spec.tz), pd.Timestamp(after, tz='UTC'))
+        return pd.date_range(start.tz_convert('UTC'), end.tz_convert('UTC'), freq=MINUTE, inclusive='left')
+
+    @cached_property
+    def flows(self) -> dict[str, np.ndarray]:
+        return power(self.spec, self.minutes)
+
+    def day(self, day: date, tz: str, step: int = 1) -> tuple[pd.DatetimeIndex, dict[str, np.ndarray]]:
+        after = day + timedelta(days=1)
+        start = self.minutes.searchsorted(pd.Timestamp(day, tz=tz))
+        end = self.minutes.searchsorted(pd.Timestamp(after, tz=tz))
+        return (
+            self.minutes[start:end:step],
+            {name: values[start:end:step] for name, values in self.flows.items()},
+        )
+
+
+def write_octopus(chunk: Chunk, root: Path, day: date) -> None:
+    spec = chunk.spec
+    index, flows = chunk.day(day, spec.tz)
+    # readings are kWh for each half-hour:
+    kwh = np.clip(flows['grid'], 0, None).reshape(-1, 30).mean(axis=1) / 1000 / 2
+    starts = index[::30]
+    keep = kept(spec, 'octopus', day, len(starts))
+    lines = ['mpan,meter_serial,interval_start,interval_end,consumption']
+    lines.extend(
+        f'{MPAN},{METER_SERIAL},{start},{end},{value}' for start, end, value in zip(
+            with_gap(isoformat(starts, spec.tz), keep),
+            with_gap(isoformat(starts + pd.Timedelta(minutes=30), spec.tz), keep),
+            with_gap(kwh.round(3), keep).tolist(),
+        )
+    )
+    suffix = '' if keep is None else '-suspect'
+    (root / f'octopus-{day:%Y-%m-%d}{suffix}.csv').write_text('\n'.join(lines) + '\n')
+
+
+TESLA_ROW = (
+    '{{"timestamp": "{}", "solar_power": {}, "battery_power": {}, "grid_power": {}, '
+    '"grid_services_power": 0, "generator_power": 0, "load_power": {}}}'
+)
+
+
+def write_tesla(chunk: Chunk, root: Path, day: date) -> None:
+    spec = chunk.spec
+    index, flows = chunk.day(day, spec.tz, step=SOURCES['tesla'].interval // MINUTE)
+    keep = kept(spec, 'tesla', day, len(index))
+    timestamps = with_gap(isoformat(index, spec.tz), keep)
+    columns = {
+        name: with_gap(flows[name].round(1), keep).tolist()
+        for name in ('solar', 'battery', 'grid', 'load')
+    }
+    rows = ', '.join(
+        TESLA_ROW.format(*row) for row in zip(timestamps, *columns.values())
+    )
+    path = root / f'tesla-{day:%Y-%m-%d}.json'
+    path.write_text(
+        '{"battery": {"id": "STE00000000-00000", "site_name": "Synthetic"}, '
+        f'"data": {{"time_series": [{rows}]}}}}'
+    )
+    if spec.tesla_csv == 'api':
+        lines = ['timestamp,solar_power,battery_power,grid_power,grid_services_power,generator_power,load_power']
+        lines.extend(f'{t},{s},{b},{g},0,0,{l}' for t, s, b, g, l in zip(timestamps, *columns.values()))
+    elif spec.tesla_csv == 'app':
+        lines = ['Date time,' + ','.join(TESLA_APP_COLUMNS)]
+        kw = {name: (np.array(values) / 1000).round(3).tolist() for name, values in columns.items()}
+        lines.extend(
+            f'{t},{l},{s},{b},{g}'
+            for t, l, s, b, g in zip(timestamps, kw['load'], kw['solar'], kw['battery'], kw['grid'])
+        )
+    else:
+        return
+    path.with_suffix('.csv').write_text('\n'.join(lines) + '\n')
+
+
+# the API leaves out zero hours and minutes:
+ZAPPI_TIMES = [
+    ''.join(f'"{key}": {value}, ' for key, value in (('hr', m // 60), ('min', m % 60)) if value)
+    for m in range(24 * 60)
+]
+ZAPPI_ROW = '{{{}{}"imp": {}, "exp": {}, "gep": {}, "gen": {}, "h1b": {}, "v1": {}, "frq": {}}}'
+
+
+def write_zappi(chunk: Chunk, root: Path, day: date) -> None:
+    # the myenergi API works in UTC days:
+    index, flows = chunk.day(day, 'UTC')
+    rng = chunk.spec.rng('meter', day, 'zappi')
+    prefix = f'"yr": {day.year}, "mon": {day.month}, "dom": {day.day}, "dow": "{day:%a}", '
+    # joules in each minute:
+    columns = [
+        ZAPPI_TIMES,
+        (np.clip(flows['grid'], 0, None) * 60).round().astype(int),
+        (-np.clip(flows['grid'], None, 0) * 60).round().astype(int),
+        (flows['solar'] * 60).round().astype(int),
+        np.where(flows['solar'] == 0, 60, 0),
+        (flows['car'] * 60).round().astype(int),
+        rng.normal(2400, 30, len(index)).round().astype(int),
+        rng.normal(5000, 5, len(index)).round().astype(int),
+    ]
+    keep = kept(chunk.spec, 'zappi', day, len(index))
+    columns = [with_gap(c, keep) for c in columns]
+    columns = [c if isinstance(c, list) else c.tolist() for c in columns]
+    rows = ', '.join(ZAPPI_ROW.format(prefix, *row) for row in zip(*columns))
+    (root / f'zappi-{day:%Y-%m-%d}.json').write_text(
+        f'{{"U{chunk.spec.zappi_serial}": [{rows}]}}'
+    )
+
+
+def dispatch(window: tuple[pd.Timestamp, pd.Timestamp]) -> dict:
+    start, end = window
+    return {
+        'startDtUtc': str(start.tz_convert('UTC')),
+        'endDtUtc': str(end.tz_convert('UTC')),
+        'chargeKwh': f'{-CHARGER_WATTS / 1000 * (end - start) / pd.Timedelta(hours=1):.2f}',
+        'meta': {'source': 'smart-charge', 'location': 'AT_HOME'},
+    }
+
+
+AGREEMENT = {
+    'productCode': 'INTELLI-VAR-22-10-14',
+    'tariffCode': 'E-1R-INTELLI-VAR-22-10-14-C',
+    'fullName': 'Intelligent Octopus',
+    'displayName': 'Intelligent Octopus',
+}
+
+
+def local(day: date, time: str, tz) -> pd.Timestamp:
+    return pd.Timestamp(f'{day:%Y-%m-%d} {time}', tz=tz)
+
+
+def unit_rates(now: pd.Timestamp) -> list[dict]:
+    """
+    Intelligent Octopus rates around `now`: 23:30 to 05:30 is cheap, and rates are
+    published a day or so ahead.
+    """
+    rates = []
+    for day in pd.date_range(now.date() - pd.Timedelta(days=1), periods=3, freq='D'):
+        previous = day - pd.Timedelta(days=1)
+        rates.append({'value': 7.5, 'validFrom': local(previous, '23:30', now.tz).isoformat(),
+                      'validTo': local(day, '05:30', now.tz).isoformat()})
+        rates.append({'value': 30.6, 'validFrom': local(day, '05:30', now.tz).isoformat(),
+                      'validTo': local(day, '23:30', now.tz).isoformat()})
+    return rates
+
+
+def write_dispatches(chunk: Chunk, root: Path, day: date) -> None:
+    spec = chunk.spec
+    windows = [charging(spec, d) for d in (day - timedelta(days=2), day - timedelta(days=1), day)]
+    for text in SNAPSHOT_TIMES[:spec.snapshots]:
+        when = pd.Timestamp(f'{day} {text}', tz=spec.tz)
+        if when.hour < 12:
+            when += pd.Timedelta(days=1)
+        planned = [dispatch(w) for w in windows if w is not None and w[1] > when]
+        completed = [dispatch(w) for w in windows if w is not None and w[1] <= when]
+        name = f"octopus-dispatches-{when.tz_localize(None).strftime(SNAPSHOT_PATTERN)}"
+        # as recorded by octopus-tesla-sync.py:
+        state = {
+            'dispatches': {'plannedDispatches': planned, 'completedDispatches': completed},
+            'unit_rates': unit_rates(when),
+            'agreement': AGREEMENT,
+        }
+        (root / name).write_text(json.dumps(state, indent=4))
+
+
+WRITERS = {
+    'octopus': write_octopus,
+    'tesla': write_tesla,
+    'zappi': write_zappi,
+    'dispatches': write_dispatches,
+}
+
+
+def write_days(spec: Spec, root: Path, days: list[date]) -> int:
+    chunk = Chunk(spec, days)
+    written = 0
+    for day in days:
+        for kind in spec.kinds:
+            if kind != 'dispatches' and missing(spec, kind, day):
+                continue
+            WRITERS[kind](chunk, root, day)
+            written += 1
+    return written
+
+
+def generate(spec: Spec, root: Path, workers: int | None = None) -> int:
+    """
+    Write the files described by `spec` into `root`, returning how many day files
+    were written.
+    """
+    root.mkdir(parents=True, exist_ok=True)
+    dates = spec.dates
+    # chunks are the same however many workers there are, so the output is too:
+    chunks = [dates[i:i + CHUNK_DAYS] for i in range(0, len(dates), CHUNK_DAYS)]
+    if workers == 1:
+        return sum(write_days(spec, root, chunk) for chunk in chunks)
+    with ProcessPoolExecutor(workers) as executor:
+        return sum(executor.map(write_days, [spec] * len(chunks), [root] * len(chunks), chunks))
+
+
+def main():
+    parser = ArgumentParser(description='Write a storage directory of synthetic data.')
+    parser.add_argument('target', type=Path)
+    parser.add_argument('--start', type=date.fromisoformat, default=date(2015, 1, 1))
+    parser.add_argument('--days', type=int, default=3653)
+    parser.add_argument('--seed', type=int, default=Spec.seed)
+    parser.add_argument('--tz', default=Spec.tz, help='use UTC for no DST changes')
+    parser.add_argument('--kind', choices=KINDS, action='append', dest='kinds')
+    parser.add_argument('--seasonality', type=float, default=Spec.seasonality)
+    parser.add_argument('--scale', type=float, default=Spec.scale)
+    parser.add_argument('--gap-rate', type=float, default=Spec.gap_rate)
+    parser.add_argument('--missing-rate', type=float, default=Spec.missing_rate)
+    parser.add_argument('--tesla-csv', choices=['api', 'app'])
+    parser.add_argument('--snapshots', type=int, default=Spec.snapshots)
+    parser.add_argument('--workers', type=int)
+    add_log_level(parser)
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    spec = Spec(
+        start=args.start,
+        days=args.days,
+        seed=args.seed,
+        tz=args.tz,
+        seasonality=args.seasonality,
+        scale=args.scale,
+        gap_rate=args.gap_rate,
+        missing_rate=args.missing_rate,
+        tesla_csv=args.tesla_csv,
+        snapshots=args.snapshots,
+    )
+    if args.kinds:
+        spec = replace(spec, kinds=tuple(args.kinds))
+    written = generate(spec, args.target, args.workers)
+    logging.info(f'Wrote {written} day files to {args.target}')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,10 +3,10 @@ import sys
 from argparse import ArgumentParser
 
 from configurator import Config
-from teslapy import Tesla, ProductError
+from teslapy import ProductError
 
 from common import add_log_level, configure_logging
-from tesla import battery_site_config
+from tesla import battery_site_config, tesla_client
 
 
 def main():
@@ -19,7 +19,7 @@ def main():
     configure_logging(args.log_level)
 
     config = Config.from_path('config.yaml')
-    tesla = Tesla(config.tesla.email)
+    tesla = tesla_client(config)
     battery, = tesla.battery_list()
 
     info = battery_site_config(battery)
@@ -1,56 +1,198 @@
+import logging
+import os
+import shutil
 import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 from csv import DictReader
+from datetime import date
 from pathlib import Path
+from threading import Lock
 
 import pendulum
 from configurator import Config
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
 
-from common import root_from
+from common import root_from, add_log_level, configure_logging
+from ingest import Pipeline
 
-FILENAME = 'data.csv'  # yeah, thanks Tesla...
+# yeah, thanks Tesla... and a batch export ends up as data.csv, data (1).csv, etc:
+PATTERN = 'data*.csv'
+DATE_TIME = 'Date time'
+# enough to be sure of finding the whole of the last row:
+TAIL_BYTES = 4096
 
 
-def move(source_path: Path, dest: Path):
-    dates = set()
-    with source_path.open() as source:
-        reader = DictReader(source)
-        for row in reader:
-            dates.add(pendulum.parse(row['Date time']).date())
-    assert len(dates) == 1, dates
-    dest_path = dest / f'tesla-{next(iter(dates))}.csv'
-    print(f'Moving {source_path} to {dest_path}')
-    source_path.rename(dest_path)
+def first_and_last_rows(source_path: Path) -> list[dict]:
+    """
+    The first and last rows of an export, or neither if it only has a header.
+    """
+    with source_path.open('rb') as source:
+        header = source.readline()
+        first = source.readline()
+        if not first.strip():
+            return []
+        size = source.seek(0, os.SEEK_END)
+        source.seek(max(size - TAIL_BYTES, 0))
+        last = source.read().rstrip(b'\r\n').rsplit(b'\n', 1)[-1]
+    return list(DictReader(line.decode() for line in (header, first, last)))
+
+
+def csv_date(source_path: Path, full_check: bool = False) -> date:
+    """
+    The single date covered by a Tesla app export, found from its first and
+    last rows or, if `full_check` is true, by checking every row.
+    """
+    if full_check:
+        import pandas as pd
+        column = pd.read_csv(source_path, usecols=[DATE_TIME])[DATE_TIME]
+        # ISO 8601 with a local offset, so the local date is the first 10 characters:
+        dates = pd.to_datetime(column.str[:10], format='%Y-%m-%d').dt.date.unique()
+    else:
+        dates = {pendulum.parse(row[DATE_TIME]).date() for row in first_and_last_rows(source_path)}
+    if len(dates) == 0:
+        raise ValueError(f'{source_path} has no rows')
+    assert len(dates) == 1, f'{source_path} covers {sorted(dates)}'
+    return next(iter(dates))
+
+
+def move(source_path: Path, dest: Path, full_check: bool = False) -> Path:
+    return move_to(source_path, dest, csv_date(source_path, full_check))
+
+
+def move_to(source_path: Path, dest: Path, day: date) -> Path:
+    dest_path = dest / f'tesla-{day}.csv'
+    logging.info(f'Moving {source_path} to {dest_path}')
+    shutil.move(source_path, dest_path)
+    return dest_path
+
+
+def move_all(
+        source_paths: list[Path], dest: Path, full_check: bool = False, workers: int | None = None
+) -> list[Path]:
+    """
+    Move each export to the file for its date. Dates are found in parallel, but
+    exports for the same date are moved one after another, in the order given, so
+    the last one wins rather than whichever happens to finish last.
+    """
+    def _date(source_path: Path) -> date | None:
+        try:
+            return csv_date(source_path, full_check)
+        except Exception:
+            logging.exception(f'Could not move {source_path}')
+
+    def _move(day: date, paths: list[Path]) -> Path | None:
+        moved = None
+        for source_path in paths:
+            try:
+                moved = move_to(source_path, dest, day)
+            except Exception:
+                logging.exception(f'Could not move {source_path}')
+        return moved
+
+    with ThreadPoolExecutor(workers) as executor:
+        by_date: dict[date, list[Path]] = {}
+        for source_path, day in zip(source_paths, executor.map(_date, source_paths)):
+            if day is not None:
+                by_date.setdefault(day, []).append(source_path)
+        return [p for p in executor.map(_move, by_date, by_date.values()) if p is not None]
+
+
+def moved_days(paths: list[Path]) -> list[tuple[str, date]]:
+    return [('tesla', date.fromisoformat(path.stem.removeprefix('tesla-'))) for path in paths]
 
 
 class IncomingEventHandler(FileSystemEventHandler):
+    """
+    Collects arriving export files, only handing them over once their size
+    hasn't changed for `settle` seconds, so partially written files are left alone.
+    """
 
-    def __init__(self, dest: Path):
-        self.dest = dest
+    def __init__(self, settle: float):
+        self.settle = settle
+        self.pending: dict[Path, tuple[int, float]] = {}
+        self.lock = Lock()
+
+    def seen(self, src_path: str) -> None:
+        path = Path(src_path)
+        if path.match(PATTERN):
+            with self.lock:
+                self.pending[path] = (-1, time.monotonic())
 
     def on_created(self, event):
-        source_path = Path(event.src_path)
-        if source_path.name == FILENAME:
-            move(source_path, self.dest)
+        self.seen(event.src_path)
 
+    def on_modified(self, event):
+        self.seen(event.src_path)
+
+    def on_moved(self, event):
+        self.seen(event.dest_path)
+
+    def ready(self) -> list[Path]:
+        now = time.monotonic()
+        ready = []
+        with self.lock:
+            for path, (size, changed) in list(self.pending.items()):
+                try:
+                    current = path.stat().st_size
+                except FileNotFoundError:
+                    del self.pending[path]
+                    continue
+                if current != size:
+                    self.pending[path] = (current, now)
+                elif now - changed >= self.settle:
+                    ready.append(path)
+                    del self.pending[path]
+        return sorted(ready)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('paths', nargs='*', type=Path,
+                        help='export files to move, rather than watching for them')
+    parser.add_argument('--full-check', action='store_true',
+                        help='check every row is for the same date, not just the first and last')
+    parser.add_argument('--settle', type=float, default=2,
+                        help='seconds a file must be unchanged for before it is moved')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--no-pipeline', action='store_false', dest='pipeline',
+                        help="don't convert and roll up the moved files")
+    add_log_level(parser)
+    args = parser.parse_args()
+    configure_logging(args.log_level)
 
-if __name__ == "__main__":
     config = Config.from_path('config.yaml')
     source_dir = Path(config.directories.incoming).expanduser()
     dest = root_from(config)
 
-    path = source_dir / FILENAME
-    if path.exists():
-        move(path, dest)
+    pipeline = Pipeline(dest, args.workers)
 
-    event_handler = IncomingEventHandler(dest)
+    def ingest(paths: list[Path]) -> None:
+        moved = move_all(paths, dest, args.full_check, args.workers)
+        if args.pipeline and moved:
+            pipeline.run(moved_days(moved))
+
+    if args.paths:
+        ingest(args.paths)
+        return
+
+    ingest(sorted(source_dir.glob(PATTERN)))
+
+    event_handler = IncomingEventHandler(args.settle)
     observer = Observer()
     observer.schedule(event_handler, str(source_dir))
     observer.start()
     try:
         while True:
             time.sleep(1)
+            ready = event_handler.ready()
+            if ready:
+                ingest(ready)
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
+
+
+if __name__ == "__main__":
+    main()
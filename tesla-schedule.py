@@ -3,25 +3,27 @@ from argparse import ArgumentParser
 from pathlib import Path
 
 from configurator import Config
-from gql.transport.aiohttp import log as gql_logger
-from teslapy import Tesla
 
 from common import DiffDumper, add_log_level, configure_logging, root_from
+from tesla import tesla_client
 
-gql_logger.setLevel(logging.WARNING)
+# by name, so as not to import gql, which this script doesn't otherwise use:
+logging.getLogger('gql.transport.aiohttp').setLevel(logging.WARNING)
 
 
 def main():
     parser = ArgumentParser()
     add_log_level(parser)
+    parser.add_argument('--segments', action='store_true',
+                        help='record changes in a segment log rather than json files')
 
     args = parser.parse_args()
     configure_logging(args.log_level)
 
     config = Config.from_path('config.yaml')
-    tesla = Tesla(config.tesla.email)
+    tesla = tesla_client(config)
     battery, = tesla.battery_list()
-    dumper = DiffDumper(root_from(config), prefix='tesla-schedule')
+    dumper = DiffDumper(root_from(config), prefix='tesla-schedule', segments=args.segments)
     tariff = battery.get_tariff()
     logging.info(tariff)
     dumper.update(tariff)
@@ -1,22 +1,60 @@
+# pandas and the processing pipeline are only imported by the functions that need them,
+# so that scripts which just talk to the Tesla API start quickly:
+from __future__ import annotations
+
 import csv
 import json
 import logging
-from datetime import timedelta
+from datetime import date, timedelta
 from pathlib import Path
 from time import sleep, time
-from typing import Iterator
+from typing import Iterator, TYPE_CHECKING
+from urllib.parse import urljoin
 from zoneinfo import ZoneInfo
 
 from configurator import Config
-from pandas import Timestamp, Timedelta, date_range
 from requests import HTTPError
 from teslapy import Tesla, Battery
 
 from common import main, collect, json_from_paths
+from metrics import api_call, downloading
+
+if TYPE_CHECKING:
+    from pandas import Timestamp
+
+
+class TeslaClient(Tesla):
+    """
+    A :class:`~teslapy.Tesla` that can send its API requests somewhere other than
+    Tesla's owner API, such as one of the stand-ins in :mod:`fakes`.
+    """
+
+    def __init__(self, email, base_url: str | None = None, **kw):
+        self.base_url = base_url
+        super().__init__(email, **kw)
+
+    def request(self, method, url, serialize=True, **kwargs):
+        if self.base_url and not url.startswith(self.sso_base_url):
+            url = urljoin(self.base_url, url)
+        return super().request(method, url, serialize, **kwargs)
+
+    def api(self, name, path_vars=None, **kwargs):
+        with api_call('tesla', name):
+            return super().api(name, path_vars, **kwargs)
+
+
+def tesla_client(config: Config, **kw) -> TeslaClient:
+    tesla_config = config.tesla
+    for name in 'base_url', 'cache_file':
+        value = tesla_config.get(name)
+        if value is not None:
+            kw.setdefault(name, value)
+    return TeslaClient(tesla_config.email, **kw)
 
 
 def with_tz(dt: Timestamp, tz: ZoneInfo) -> Timestamp:
-    return Timestamp(year=dt.year, month=dt.month, day=dt.day, unit='m', tz=tz)
+    from pandas import Timestamp
+    return Timestamp(year=dt.year, month=dt.month, day=dt.day, tz=tz)
 
 
 def tesla_formatted_dt(dt: Timestamp) -> str:
@@ -30,7 +68,8 @@ def tesla_end_dates(
     end = with_tz(max(start, end), tz)
     while current <= end:
         yield current, current.replace(hour=23, minute=59, second=59)
-        current += timedelta(days=1)
+        # days either side of a DST change aren't 24 hours long:
+        current = with_tz(current.date() + timedelta(days=1), tz)
 
 
 def call_with_retry(c, *args, **kw):
@@ -47,51 +86,57 @@ def call_with_retry(c, *args, **kw):
 
 
 PATTERN = 'tesla-%Y-%m-%d.json'
-EXPECTED_MEASUREMENTS = 24*60/5
 
 
-def check_measurement_count(data, end_date):
-    time_series = data['time_series']
-    actual = len(time_series)
-    if actual != EXPECTED_MEASUREMENTS:
-        earliest = time_series[0]['timestamp']
-        latest = time_series[-1]['timestamp']
-        missing = EXPECTED_MEASUREMENTS - actual
+def check_measurement_count(data, end_date, tz: str | ZoneInfo | None = None):
+    from pandas import to_datetime
+    from gaps import expected_slots, missing_slots, runs
+    from loaders import SOURCES, TIMEZONE
+    tz = tz or TIMEZONE
+    source = SOURCES['tesla']
+    timestamps = to_datetime([row['timestamp'] for row in data['time_series']], utc=True)
+    day = timestamps.min().tz_convert(tz).date()
+    missing = missing_slots(timestamps, day, source.interval, tz)
+    if len(missing):
         logging.warning(
-            f'Expected {EXPECTED_MEASUREMENTS}, '
-            f'got {actual} ({missing * 5} mins missing), '
-            f'earliest found: {earliest}, '
-            f'latest found: {latest}, '
+            f'Expected {len(expected_slots(day, source.interval, tz))}, '
+            f'got {len(timestamps)} ({len(missing) * 5} mins missing), '
+            f'earliest found: {timestamps.min()}, '
+            f'latest found: {timestamps.max()}, '
             f'end_date={end_date}'
         )
-        if missing < 10:
-            earliest_ts = Timestamp(earliest)
-            current = Timestamp(year=earliest_ts.year, month=earliest_ts.month, day=earliest_ts.day, tz=earliest_ts.tz)
-            bad = set(date_range(current, current+Timedelta(days=1), freq='5min', inclusive='left'))
-            for row in time_series:
-                bad.remove(Timestamp(row['timestamp']))
-            if bad:
-                logging.warning('Missing: ' + ', '.join(str(b) for b in sorted(bad)))
+        for gap in runs(source.name, missing, source.interval).itertuples():
+            logging.warning(f'Missing: {gap.start} to {gap.end}')
 
 
-def download(config: Config, start: Timestamp, end: Timestamp, root: Path) -> None:
-    tesla = Tesla(config.tesla.email)
+def fetch(config: Config, start: Timestamp, end: Timestamp, root: Path) -> list[tuple[str, date]]:
+    tesla = tesla_client(config)
+    downloaded = []
     for i, battery in enumerate(call_with_retry(tesla.battery_list)):
         assert i == 0, 'more than one battery found!'
-        installation_time_zone_ = installation_time_zone(battery)
-        for date, end_date in tesla_end_dates(start, end, installation_time_zone_):
-            data = call_with_retry(
-                battery.get_calendar_history_data,
-                kind='power',
-                end_date=tesla_formatted_dt(end_date),
-                period='day'
-            )
+        installation_time_zone_ = call_with_retry(installation_time_zone, battery)
+        for day, end_date in tesla_end_dates(start, end, installation_time_zone_):
+            with downloading('tesla') as rows:
+                data = call_with_retry(
+                    battery.get_calendar_history_data,
+                    kind='power',
+                    end_date=tesla_formatted_dt(end_date),
+                    period='day'
+                )
+                rows.append(len(data.get('time_series', ())) if data else 0)
             if not data:
                 raise ValueError(f'No data for {end_date=}')
-            path = root / date.strftime(PATTERN)
+            path = root / day.strftime(PATTERN)
             path.write_text(json.dumps({'battery': battery, 'data': data}))
             logging.info(f'Downloaded {path}')
-            check_measurement_count(data, end_date)
+            check_measurement_count(data, end_date, installation_time_zone_)
+            downloaded.append(('tesla', day.date()))
+    return downloaded
+
+
+def download(config: Config, start: Timestamp, end: Timestamp, root: Path) -> None:
+    from ingest import Pipeline
+    Pipeline(root).run(fetch(config, start, end, root))
 
 
 def check(config: Config, start: Timestamp, end: Timestamp, root: Path) -> None:
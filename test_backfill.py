@@ -0,0 +1,99 @@
+from datetime import date
+from functools import partial
+
+import pandas as pd
+from testfixtures import LogCapture, compare as compare_
+
+compare = partial(compare_, strict=True)
+
+from backfill import Backfill, Limit, Request, Throttle, plan
+from gaps import COLUMNS
+
+
+def gap_table(*rows) -> pd.DataFrame:
+    return pd.DataFrame([
+        (source, pd.Timestamp(start, tz='UTC'), pd.Timestamp(end, tz='UTC'), missing)
+        for source, start, end, missing in rows
+    ], columns=COLUMNS)
+
+
+def test_plan():
+    gaps = gap_table(
+        # BST, so the local days are the 1st and 2nd:
+        ('tesla', '2024-06-30 23:00', '2024-07-02 23:00', 576),
+        ('tesla', '2024-07-04 10:00', '2024-07-04 10:05', 1),
+        ('octopus', '2024-07-01 10:00', '2024-07-01 10:30', 1),
+        ('octopus', '2024-07-05 10:00', '2024-07-05 10:30', 1),
+        ('octopus', '2024-08-01 10:00', '2024-08-01 10:30', 1),
+    )
+    compare(plan(gaps), expected=[
+        Request('octopus', date(2024, 7, 1), date(2024, 7, 5)),
+        Request('octopus', date(2024, 8, 1), date(2024, 8, 1)),
+        # a day at a time, so every call to the Tesla API is throttled:
+        Request('tesla', date(2024, 7, 1), date(2024, 7, 1)),
+        Request('tesla', date(2024, 7, 2), date(2024, 7, 2)),
+        Request('tesla', date(2024, 7, 4), date(2024, 7, 4)),
+    ])
+
+
+def test_plan_span():
+    gaps = gap_table(('zappi', '2024-01-01', '2024-01-11', 14400))
+    limits = {'zappi': Limit(concurrency=1, interval=0, span=4)}
+    compare([r.days for r in plan(gaps, limits)], expected=[4, 4, 2])
+
+
+def test_plan_zappi_utc_days():
+    # crosses local midnight in BST, but is all in the UTC day of the 1st:
+    gaps = gap_table(('zappi', '2024-07-01 22:30', '2024-07-01 23:30', 60))
+    compare(plan(gaps), expected=[Request('zappi', date(2024, 7, 1), date(2024, 7, 1))])
+
+
+def test_plan_empty():
+    compare(plan(gap_table()), expected=[])
+
+
+def test_throttle():
+    now = [0.]
+    sleeps = []
+
+    def sleep(delay):
+        sleeps.append(delay)
+
+    throttle = Throttle(2, clock=lambda: now[0], sleep=sleep)
+    throttle.wait()
+    throttle.wait()
+    throttle.wait()
+    now[0] = 10
+    throttle.wait()
+    compare(sleeps, expected=[2., 4.])
+
+
+def test_run(tmp_path):
+    calls = []
+
+    def fetch(config, request, root):
+        calls.append(request)
+        if request.source == 'tesla':
+            raise ValueError('boom')
+        return [(request.source, request.start)]
+
+    backfill = Backfill(
+        config=None,
+        root=tmp_path,
+        limits={s: Limit(concurrency=2, interval=0, span=31) for s in ('octopus', 'tesla')},
+        fetchers={'octopus': fetch, 'tesla': fetch},
+    )
+    requests = [
+        Request('octopus', date(2024, 1, 1), date(2024, 1, 2)),
+        Request('octopus', date(2024, 2, 1), date(2024, 2, 1)),
+        Request('tesla', date(2024, 1, 1), date(2024, 1, 1)),
+    ]
+    with LogCapture(attributes=('levelname', 'getMessage')) as log:
+        downloaded = backfill.run(requests)
+    compare(sorted(downloaded), expected=[('octopus', date(2024, 1, 1)), ('octopus', date(2024, 2, 1))])
+    compare(sorted(calls), expected=requests)
+    compare(
+        [r for r in log.actual() if r[0] == 'ERROR'],
+        expected=[('ERROR', 'Could not fetch tesla 2024-01-01 to 2024-01-01 (1 days)')],
+        strict=False,
+    )
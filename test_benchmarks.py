@@ -0,0 +1,31 @@
+from functools import partial
+
+from testfixtures import compare as compare_
+
+compare = partial(compare_, strict=True)
+
+from benchmarks import BENCHMARKS, load_results, previous_results, report, run, save_results
+
+
+def test_all_benchmarks_run():
+    results = run(list(BENCHMARKS), days=1, repeat=1, number=1)
+    compare([r['name'] for r in results if 'error' in r], expected=[])
+    compare(len(results), expected=len(BENCHMARKS))
+
+
+def test_results_round_trip_and_report(tmp_path):
+    path = tmp_path / 'benchmarks.jsonl'
+    compare(load_results(path), expected=[])
+    before = {'name': 'load_octopus', 'days': 1, 'min': 0.02, 'median': 0.03, 'commit': 'abc123'}
+    broken = {'name': 'load_octopus', 'days': 1, 'error': 'oops', 'commit': 'def456'}
+    other = {'name': 'load_octopus', 'days': 365, 'min': 2.0, 'median': 2.5, 'commit': 'abc123'}
+    save_results(path, [before, other])
+    save_results(path, [broken])
+    compare(load_results(path), expected=[before, other, broken])
+
+    after = {'name': 'load_octopus', 'days': 1, 'min': 0.015, 'median': 0.0151, 'commit': 'fff'}
+    failed = {'name': 'octopus_bill', 'days': 1, 'error': "ValueError('x')"}
+    compare(report([after, failed], previous_results(load_results(path))), expected=(
+        "load_octopus  min     15ms  median   15.1ms  -25.0% vs abc123\n"
+        "octopus_bill  error: ValueError('x')"
+    ))
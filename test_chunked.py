@@ -0,0 +1,90 @@
+from datetime import date, timedelta
+from functools import partial
+
+import pandas as pd
+import pytest
+from testfixtures import ShouldRaise, compare as compare_
+
+compare = partial(compare_, strict=True)
+
+from chunked import aggregate, chunks
+from loaders import SOURCES, TIMEZONE, load_day
+from rollups import rolling_mean
+from synthetic import Spec, generate
+
+START, END = date(2024, 3, 29), date(2024, 4, 2)
+
+
+@pytest.fixture(scope='module')
+def root(tmp_path_factory):
+    root = tmp_path_factory.mktemp('storage')
+    # over the spring DST change:
+    generate(Spec(START, 4, kinds=('zappi',), gap_rate=0, missing_rate=0), root, workers=1)
+    return root
+
+
+def everything(root) -> pd.DataFrame:
+    days = (START + timedelta(days=i) for i in range((END - START).days))
+    frame = pd.concat(load_day(root, SOURCES['zappi'], d) for d in days)
+    frame = frame.tz_convert(TIMEZONE).sort_index()[['imp_kw', 'pect1_kw']]
+    first, last = (pd.Timestamp(d, tz=TIMEZONE) for d in (START, END))
+    return frame[(frame.index >= first) & (frame.index < last)]
+
+
+@pytest.mark.parametrize('freq', ['h', 'D', 'MS'])
+def test_matches_in_memory(root, freq):
+    result = aggregate(root, 'zappi', START, END, freq, ['imp_kw', 'pect1_kw'])
+    expected = everything(root).resample(freq).agg(['sum', 'min', 'max', 'count', 'mean'])
+    expected.columns = [f'{column}_{stat}' for column, stat in expected.columns]
+    expected = expected[expected['imp_kw_count'] > 0]
+    pd.testing.assert_frame_equal(result, expected, check_freq=False)
+
+
+def test_local_days(root):
+    result = aggregate(root, 'zappi', START, END, 'D', ['imp_kw'], how=('count',))
+    # the clocks went forward on the 31st, and the first local hour of April 1st is in
+    # the UTC file for March 31st:
+    compare(result['imp_kw_count'].tolist(), expected=[1440, 1440, 1380, 1440])
+    compare(str(result.index[-1]), expected='2024-04-01 00:00:00+01:00')
+
+
+def test_months_in_summer(tmp_path):
+    generate(Spec(date(2024, 6, 28), 3, kinds=('zappi',), gap_rate=0, missing_rate=0), tmp_path, workers=1)
+    # the first local hour of June 29th is in the UTC file for the 28th, and the UTC
+    # file for the 30th ends an hour into July:
+    result = aggregate(tmp_path, 'zappi', date(2024, 6, 29), date(2024, 7, 1), 'MS', ['imp_kw'],
+                       how=('count',))
+    compare([str(ts) for ts in result.index], expected=['2024-06-01 00:00:00+01:00'])
+    compare(result['imp_kw_count'].tolist(), expected=[2880])
+
+
+def test_where_and_rolling(root):
+    result = aggregate(root, 'zappi', START, END, 'D', ['imp_kw'], how=('max',),
+                       where='imp_kw > 1', rolling='20min')
+    frame = everything(root)
+    frame = frame[frame['imp_kw'] > 1][['imp_kw']]
+    expected = rolling_mean(frame, '20min', pd.Timedelta(minutes=1)).resample('D').max().dropna()
+    pd.testing.assert_series_equal(result['imp_kw_max'], expected['imp_kw'], check_names=False,
+                                   check_freq=False)
+
+
+def test_workers(root):
+    compare(
+        aggregate(root, 'zappi', START, END, 'D', where='pect1_kw > 0', workers=2),
+        expected=aggregate(root, 'zappi', START, END, 'D', where='pect1_kw > 0'),
+    )
+
+
+def test_chunks(root):
+    found = list(chunks(root, 'zappi', date(2024, 3, 28), END, ['imp_kw']))
+    compare([day for day, _ in found], expected=[START + timedelta(days=i) for i in range(4)])
+    compare(list(found[0][1].columns), expected=['imp_kw'])
+
+
+def test_unknown_stat(root):
+    with ShouldRaise(ValueError("unknown statistics: ['median']")):
+        aggregate(root, 'zappi', START, END, 'D', how=('median',))
+
+
+def test_nothing_there(root):
+    compare(len(aggregate(root, 'zappi', date(2023, 1, 1), date(2023, 1, 3), 'D')), expected=0)
@@ -0,0 +1,157 @@
+import asyncio
+from functools import partial
+
+from testfixtures import compare as compare_, ShouldRaise, Replace
+
+compare = partial(compare_, strict=True)
+
+from common import Backoff, CircuitBreaker, CircuitOpen, structural_diff
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def flaky(failures: int, exception: type[Exception] = TimeoutError):
+    calls = []
+
+    async def call(value):
+        calls.append(value)
+        if len(calls) <= failures:
+            raise exception()
+        return value
+
+    return call, calls
+
+
+def run(backoff: Backoff, c, *args, deadline: float | None = None):
+    async def _run():
+        return await backoff(deadline, c, *args)
+    with Replace('common.asyncio.sleep', partial(asyncio.sleep, 0)):
+        return asyncio.run(_run())
+
+
+def test_breaker_opens_after_threshold():
+    clock = Clock()
+    breaker = CircuitBreaker('test', threshold=2, reset_after=10, clock=clock)
+    breaker.check()
+    breaker.failure()
+    breaker.check()
+    breaker.failure()
+    with ShouldRaise(CircuitOpen('test circuit open after 2 failures')):
+        breaker.check()
+
+
+def test_breaker_half_open_after_reset():
+    clock = Clock()
+    breaker = CircuitBreaker('test', threshold=1, reset_after=10, clock=clock)
+    breaker.failure()
+    clock.now = 10
+    breaker.check()
+    # only one trial call is let through:
+    with ShouldRaise(CircuitOpen):
+        breaker.check()
+    # one more failure re-opens straight away:
+    breaker.failure()
+    with ShouldRaise(CircuitOpen):
+        breaker.check()
+    clock.now = 20
+    breaker.check()
+    breaker.success()
+    compare(breaker.failures, expected=0)
+    compare(breaker.opened_at, expected=None)
+
+
+def test_breaker_another_trial_if_first_never_finishes():
+    clock = Clock()
+    breaker = CircuitBreaker('test', threshold=1, reset_after=10, clock=clock)
+    breaker.failure()
+    clock.now = 10
+    breaker.check()
+    clock.now = 19
+    with ShouldRaise(CircuitOpen):
+        breaker.check()
+    clock.now = 20
+    breaker.check()
+
+
+def test_backoff_retry_on_function():
+    call, calls = flaky(failures=2, exception=KeyError)
+    backoff = Backoff(lambda e: isinstance(e, KeyError), CircuitBreaker('test'))
+    compare(run(backoff, call, 'x'), expected='x')
+    compare(len(calls), expected=3)
+
+
+def test_backoff_retries_then_succeeds():
+    call, calls = flaky(failures=2)
+    backoff = Backoff((TimeoutError,), CircuitBreaker('test'))
+    compare(run(backoff, call, 'x'), expected='x')
+    compare(calls, expected=['x', 'x', 'x'])
+    compare(backoff.breaker.failures, expected=0)
+
+
+def test_backoff_gives_up_after_attempts():
+    call, calls = flaky(failures=10)
+    backoff = Backoff((TimeoutError,), CircuitBreaker('test', threshold=100), attempts=3)
+    with ShouldRaise(TimeoutError):
+        run(backoff, call, 'x')
+    compare(len(calls), expected=3)
+
+
+def test_backoff_does_not_retry_other_exceptions():
+    call, calls = flaky(failures=1, exception=KeyError)
+    backoff = Backoff((TimeoutError,), CircuitBreaker('test'))
+    with ShouldRaise(KeyError):
+        run(backoff, call, 'x')
+    compare(len(calls), expected=1)
+
+
+def test_backoff_stops_at_deadline():
+    call, calls = flaky(failures=10)
+    backoff = Backoff((TimeoutError,), CircuitBreaker('test', threshold=100), initial=5)
+    with ShouldRaise(TimeoutError):
+        # the deadline is already upon us, so no point sleeping to try again:
+        run(backoff, call, 'x', deadline=0)
+    compare(len(calls), expected=1)
+
+
+def test_backoff_stops_when_circuit_opens():
+    call, calls = flaky(failures=10)
+    backoff = Backoff((TimeoutError,), CircuitBreaker('test', threshold=2))
+    with ShouldRaise(CircuitOpen('test circuit open after 2 failures')):
+        run(backoff, call, 'x')
+    compare(len(calls), expected=2)
+
+
+def test_structural_diff_equal():
+    compare(list(structural_diff({'a': [1, {'b': 2}]}, {'a': [1, {'b': 2}]})), expected=[])
+
+
+def test_structural_diff_dicts():
+    compare(
+        [str(c) for c in structural_diff(
+            {'agreement': {'tariffCode': 'GO', 'validTo': None}, 'gone': 1},
+            {'agreement': {'tariffCode': 'AGILE', 'validTo': None}, 'new': [2]},
+        )],
+        expected=[
+            '~ agreement.tariffCode: "GO" -> "AGILE"',
+            '- gone: 1',
+            '+ new: [2]',
+        ]
+    )
+
+
+def test_structural_diff_lists():
+    a = {'plannedDispatches': [{'start': 1}, {'start': 2}], 'rates': [7.5, 30.1]}
+    b = {'plannedDispatches': [{'start': 2}, {'start': 3}, {'start': 4}], 'rates': [7.5, 31.2]}
+    compare([str(c) for c in structural_diff(a, b)], expected=[
+        '- plannedDispatches[0]: {"start": 1}',
+        '+ plannedDispatches[1]: {"start": 3}',
+        '+ plannedDispatches[2]: {"start": 4}',
+        '~ rates[1]: 30.1 -> 31.2',
+    ])
@@ -0,0 +1,126 @@
+from datetime import date
+from functools import partial
+from threading import Thread
+
+import pytest
+from testfixtures import compare as compare_
+
+compare = partial(compare_, strict=True)
+
+from energy import Context, Server, check_private, execute, main, request
+from synthetic import Spec, generate
+
+CONFIG = """
+directories:
+  storage: {root}
+  incoming: {root}
+octopus:
+  api_key: sk_test
+  account: A-TEST
+  charges:
+    standing: 0.5
+    normal: 0.3
+    cheap: 0.1
+"""
+
+
+@pytest.fixture(scope='module')
+def config(tmp_path_factory):
+    root = tmp_path_factory.mktemp('storage')
+    generate(Spec(date(2024, 1, 1), 3, kinds=('octopus',), gap_rate=0, missing_rate=0), root, workers=1)
+    path = root / 'config.yaml'
+    path.write_text(CONFIG.format(root=root))
+    return path
+
+
+def test_bill(config):
+    context = Context(config)
+    status, output = execute(context, ['bill', '2024-01-01', '2024-01-03'])
+    compare(status, expected=0)
+    lines = output.splitlines()
+    compare(lines[0], expected='from 2024-01-01 00:00:00+00:00 to 2024-01-02 23:30:00+00:00')
+    compare(lines[-2], expected='standing: 2 @ 0.5 = 1.00 (0.95 ex vat)')
+    compare(len(context.frames), expected=2)
+    # the same again comes from memory:
+    frames = dict(context.frames)
+    compare(execute(context, ['bill', '2024-01-01', '2024-01-03']), expected=(0, output))
+    compare(context.frames[('octopus', date(2024, 1, 1))][1] is frames[('octopus', date(2024, 1, 1))][1],
+            expected=True)
+
+
+def test_changed_file_reread(config):
+    context = Context(config)
+    execute(context, ['bill', '2024-01-01', '2024-01-02'])
+    before = context.frames[('octopus', date(2024, 1, 1))]
+    path = config.parent / 'octopus-2024-01-01.csv'
+    path.write_text(path.read_text())
+    execute(context, ['bill', '2024-01-01', '2024-01-02'])
+    compare(context.frames[('octopus', date(2024, 1, 1))] is before, expected=False)
+
+
+def test_frames_bounded(config):
+    context = Context(config, max_frames=2)
+    load = context.loader('octopus')
+    first = load(config.parent, date(2024, 1, 1))
+    load(config.parent, date(2024, 1, 2))
+    # used recently, so kept when the third day is loaded:
+    load(config.parent, date(2024, 1, 1))
+    load(config.parent, date(2024, 1, 3))
+    compare(list(context.frames), expected=[('octopus', date(2024, 1, 1)), ('octopus', date(2024, 1, 3))])
+    compare(load(config.parent, date(2024, 1, 1)) is first, expected=True)
+
+
+def test_missing_day(config):
+    context = Context(config)
+    compare(context.loader('octopus')(config.parent, date(2023, 12, 31)), expected=None)
+    compare(len(context.frames), expected=0)
+
+
+def test_errors(config):
+    context = Context(config)
+    status, output = execute(context, ['bill', '2024-13-01', '2024-01-02'])
+    compare(status, expected=2)
+    assert "invalid fromisoformat value: '2024-13-01'" in output, output
+    status, output = execute(context, ['tariff'])
+    compare(status, expected=1)
+    assert output.startswith("ERROR:root:['tariff'] failed"), output
+
+
+def test_daemon(config, tmp_path):
+    path = tmp_path / 'energy.sock'
+    compare(request(path, ['status']), expected=None)
+    context = Context(config)
+    with Server(path, context) as server:
+        thread = Thread(target=server.serve_forever)
+        thread.start()
+        argv = ['bill', '2024-01-01', '2024-01-02']
+        compare(request(path, argv), expected=execute(Context(config), argv))
+        status, output = request(path, ['status'])
+        assert 'days of data in memory: 1' in output, output
+        status, output = request(path, ['status'], config.parent / 'other.yaml')
+        compare(status, expected=1)
+        assert output.startswith(f'daemon is using {config}, use --local for '), output
+        compare(request(path, ['stop'])[0], expected=0)
+        thread.join(timeout=5)
+        compare(thread.is_alive(), expected=False)
+    compare(oct(path.stat().st_mode & 0o777), expected='0o600')
+
+
+def test_config_used_in_process(config, tmp_path, capsys):
+    with pytest.raises(SystemExit) as info:
+        main(['--socket', str(tmp_path / 'energy.sock'), '--config', str(config),
+              'bill', '2024-01-01', '2024-01-02'])
+    compare(info.value.code, expected=0)
+    assert 'standing: 1 @ 0.5' in capsys.readouterr().out
+
+
+def test_check_private(tmp_path):
+    check_private(tmp_path / 'missing')
+    directory = tmp_path / 'energy'
+    directory.mkdir(mode=0o700)
+    check_private(directory)
+    directory.chmod(0o755)
+    with pytest.raises(SystemExit, match='must be a directory owned by you that only you can use'):
+        check_private(directory)
+    with pytest.raises(SystemExit, match='must be a directory owned by you'):
+        main(['--socket', str(directory / 'energy.sock'), 'status'])
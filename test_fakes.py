@@ -0,0 +1,119 @@
+import asyncio
+import json
+from datetime import date
+from functools import partial
+
+import pytest
+from requests.exceptions import HTTPError, ReadTimeout
+from testfixtures import compare as compare_
+
+compare = partial(compare_, strict=True)
+
+from backfill import Backfill, Limit, Request
+from fakes import ACCOUNT, API_KEY, FakeServer, Fakes, Faults
+from octopus import THROTTLED_ATTEMPTS, OctopusGraphQLClient, OctopusRESTClient
+from synthetic import Spec, generate
+from tesla import tesla_client
+
+NO_LIMITS = {source: Limit(concurrency=2, interval=0, span=31) for source in ('octopus', 'tesla', 'zappi')}
+
+
+@pytest.fixture(scope='module')
+def source(tmp_path_factory):
+    root = tmp_path_factory.mktemp('source')
+    # over the spring DST change:
+    generate(Spec(date(2024, 3, 30), 3, gap_rate=0, missing_rate=0), root, workers=1)
+    return root
+
+
+def test_backfill(source, tmp_path):
+    storage = tmp_path / 'storage'
+    storage.mkdir()
+    with Fakes(source, page_size=50) as fakes:
+        config = fakes.config(storage, tmp_path / 'cache.json')
+        # settings other scripts keep alongside the ones downloads need:
+        config.data['octopus']['charges'] = {'standing': 0.5}
+        downloaded = Backfill(config, storage, NO_LIMITS).run([
+            Request(name, date(2024, 3, 30), date(2024, 4, 1)) for name in ('octopus', 'tesla', 'zappi')
+        ])
+        # 144 readings in pages of 50:
+        compare(len(fakes.octopus.requests), expected=4)
+    compare(len(downloaded), expected=9)
+    for name in 'octopus-2024-03-31.csv', 'zappi-2024-03-31.json':
+        compare((storage / name).read_text(), expected=(source / name).read_text())
+    compare(
+        json.loads((storage / 'tesla-2024-03-31.json').read_text())['data'],
+        expected=json.loads((source / 'tesla-2024-03-31.json').read_text())['data'],
+    )
+
+
+def test_retry_after(source, tmp_path):
+    with Fakes(source, Faults(throttle_every=2, retry_after=0)) as fakes:
+        config = fakes.config(tmp_path, tmp_path / 'cache.json')
+        downloaded = Backfill(config, tmp_path, NO_LIMITS).run([
+            Request('octopus', date(2024, 3, 30), date(2024, 3, 31)),
+            Request('tesla', date(2024, 3, 30), date(2024, 3, 31)),
+        ])
+    compare(len(downloaded), expected=4)
+    compare(fakes.octopus.requests[1], expected=fakes.octopus.requests[2])
+
+
+def test_throttled_gives_up(source, tmp_path):
+    with Fakes(source, Faults(throttle_every=1, retry_after=0)) as fakes:
+        client = OctopusRESTClient(API_KEY, fakes.octopus.base_url)
+        with pytest.raises(HTTPError, match='HTTP 429 for /accounts/A-FAKE0001/ 5 times, giving up'):
+            client.get(f'/accounts/{ACCOUNT}/')
+    compare(len(fakes.octopus.requests), expected=THROTTLED_ATTEMPTS)
+
+
+def test_graphql_token_expiry(source, tmp_path):
+    async def dispatches_twice(client, fakes):
+        async with client:
+            await client.dispatches(ACCOUNT)
+            fakes.octopus.expire_tokens()
+            return await client.dispatches(ACCOUNT)
+
+    with Fakes(source) as fakes:
+        config = fakes.config(tmp_path, tmp_path / 'cache.json')
+        client = OctopusGraphQLClient(config.octopus.api_key, config.octopus.base_url)
+        data = asyncio.run(dispatches_twice(client, fakes))
+    compare(sorted(data), expected=['completedDispatches', 'plannedDispatches'])
+    compare(len(fakes.octopus.tokens), expected=2)
+
+
+def test_graphql_one_token_for_concurrent_queries(source, tmp_path):
+    async def both(client):
+        async with client:
+            return await asyncio.gather(client.dispatches(ACCOUNT), client.tariff(ACCOUNT))
+
+    with Fakes(source) as fakes:
+        config = fakes.config(tmp_path, tmp_path / 'cache.json')
+        client = OctopusGraphQLClient(config.octopus.api_key, config.octopus.base_url)
+        asyncio.run(both(client))
+        compare(len(fakes.octopus.tokens), expected=1)
+        # and only one new one when they both find it has expired:
+        fakes.octopus.expire_tokens()
+        asyncio.run(both(client))
+    compare(len(fakes.octopus.tokens), expected=2)
+
+
+def test_tesla_tariff(source, tmp_path):
+    with Fakes(source) as fakes:
+        battery, = tesla_client(fakes.config(tmp_path, tmp_path / 'cache.json')).battery_list()
+        battery.set_tariff({'code': 'NEW'})
+        compare(dict(battery.get_tariff()), expected={'code': 'NEW'})
+
+
+def test_stall(source, tmp_path):
+    with Fakes(source, Faults(stall_every=1, stall=5)) as fakes:
+        tesla = tesla_client(fakes.config(tmp_path, tmp_path / 'cache.json'), timeout=0.1)
+        with pytest.raises(ReadTimeout):
+            tesla.battery_list()
+
+
+def test_fake_server_needs_routes(tmp_path):
+    class NoRoutes(FakeServer):
+        pass
+
+    with pytest.raises(TypeError, match='routes'):
+        NoRoutes(tmp_path)
@@ -0,0 +1,115 @@
+import json
+from datetime import date
+from functools import partial
+
+import pandas as pd
+import pendulum
+from testfixtures import LogCapture, compare as compare_
+
+compare = partial(compare_, strict=True)
+
+from gaps import expected_slots, merge, missing_slots, runs, scan
+from ingest import Pipeline
+from loaders import SOURCES
+from synthetic import Spec, generate
+from tesla import check_measurement_count
+from test_ingest import write_octopus
+
+HALF_HOUR = pd.Timedelta(minutes=30)
+
+
+def utc(text: str) -> pd.Timestamp:
+    return pd.Timestamp(text, tz='UTC')
+
+
+def test_expected_slots_dst():
+    compare(len(expected_slots(date(2024, 3, 30), HALF_HOUR)), expected=48)
+    compare(len(expected_slots(date(2024, 3, 31), HALF_HOUR)), expected=46)
+    compare(len(expected_slots(date(2024, 10, 27), HALF_HOUR)), expected=50)
+    compare(len(expected_slots(pendulum.Date(2024, 10, 27), HALF_HOUR)), expected=50)
+    compare(expected_slots(date(2024, 7, 1), HALF_HOUR)[0], expected=utc('2024-06-30 23:00'))
+
+
+def test_runs():
+    slots = expected_slots(date(2024, 1, 1), HALF_HOUR)
+    missing = slots[[0, 1, 2, 10, 47]]
+    compare(runs('octopus', missing, HALF_HOUR).to_dict('records'), expected=[
+        {'source': 'octopus', 'start': utc('2024-01-01 00:00'), 'end': utc('2024-01-01 01:30'), 'missing': 3},
+        {'source': 'octopus', 'start': utc('2024-01-01 05:00'), 'end': utc('2024-01-01 05:30'), 'missing': 1},
+        {'source': 'octopus', 'start': utc('2024-01-01 23:30'), 'end': utc('2024-01-02 00:00'), 'missing': 1},
+    ], strict=False)
+
+
+def test_merge_across_midnight():
+    day1 = expected_slots(date(2024, 1, 1), HALF_HOUR)
+    day2 = expected_slots(date(2024, 1, 2), HALF_HOUR)
+    gaps = merge([
+        runs('octopus', day1[-2:], HALF_HOUR),
+        runs('octopus', day2[:3], HALF_HOUR),
+        runs('tesla', day2[:1], HALF_HOUR),
+        runs('octopus', day2[:0], HALF_HOUR),
+    ])
+    compare(gaps.to_dict('records'), expected=[
+        {'source': 'octopus', 'start': utc('2024-01-01 23:00'), 'end': utc('2024-01-02 01:30'), 'missing': 5},
+        {'source': 'tesla', 'start': utc('2024-01-02 00:00'), 'end': utc('2024-01-02 00:30'), 'missing': 1},
+    ], strict=False)
+
+
+def test_scan(tmp_path):
+    write_octopus(tmp_path, '2024-03-30')
+    write_octopus(tmp_path, '2024-04-02')
+    # drop the last hour of a day:
+    path = tmp_path / 'octopus-2024-04-02.csv'
+    path.write_text(''.join(path.read_text().splitlines(keepends=True)[:-2]))
+    # the first day goes via the stats fast path:
+    Pipeline(tmp_path).run([('octopus', date(2024, 3, 30))])
+
+    gaps = scan(tmp_path, date(2024, 3, 30), date(2024, 4, 2), ['octopus'], workers=2)
+    compare(gaps.to_dict('records'), expected=[
+        {'source': 'octopus', 'start': utc('2024-03-31 00:00'), 'end': utc('2024-04-01 23:00'), 'missing': 94},
+        {'source': 'octopus', 'start': utc('2024-04-02 22:00'), 'end': utc('2024-04-02 23:00'), 'missing': 2},
+    ], strict=False)
+
+
+def test_missing_slots_other_timezone():
+    timestamps = expected_slots(date(2024, 1, 1), HALF_HOUR, 'America/New_York')[1:]
+    missing = missing_slots(timestamps, date(2024, 1, 1), HALF_HOUR, 'America/New_York')
+    compare(list(missing), expected=[utc('2024-01-01 05:00')])
+
+
+def test_check_measurement_count_dst():
+    interval = SOURCES['tesla'].interval
+    slots = expected_slots(date(2024, 10, 27), interval)
+    data = {'time_series': [{'timestamp': ts.isoformat()} for ts in slots[:-2]]}
+    with LogCapture() as log:
+        check_measurement_count(data, end_date='x')
+    log.check(
+        ('root', 'WARNING',
+         'Expected 300, got 298 (10 mins missing), '
+         'earliest found: 2024-10-26 23:00:00+00:00, latest found: 2024-10-27 23:45:00+00:00, '
+         'end_date=x'),
+        ('root', 'WARNING', 'Missing: 2024-10-27 23:50:00+00:00 to 2024-10-28 00:00:00+00:00'),
+    )
+
+
+def test_check_measurement_count_complete():
+    slots = expected_slots(date(2024, 3, 31), SOURCES['tesla'].interval)
+    with LogCapture() as log:
+        check_measurement_count({'time_series': [{'timestamp': ts.isoformat()} for ts in slots]}, 'x')
+    log.check()
+
+
+def test_scan_zappi_utc_days_in_summer(tmp_path):
+    generate(Spec(date(2024, 6, 1), 5, kinds=('zappi',), gap_rate=0, missing_rate=0), tmp_path, workers=1)
+    compare(len(scan(tmp_path, date(2024, 6, 2), date(2024, 6, 4), ['zappi'], workers=1)), expected=0)
+
+    # drop the readings either side of local midnight, which are in the UTC day's file:
+    path = tmp_path / 'zappi-2024-06-02.json'
+    data = json.loads(path.read_text())
+    records, = data.values()
+    data = {key: [r for r in records if not (22 <= r.get('hr', 0) < 24)] for key in data}
+    path.write_text(json.dumps(data))
+    gaps = scan(tmp_path, date(2024, 6, 2), date(2024, 6, 4), ['zappi'], workers=1)
+    compare(gaps.to_dict('records'), expected=[
+        {'source': 'zappi', 'start': utc('2024-06-02 22:00'), 'end': utc('2024-06-03 00:00'), 'missing': 120},
+    ], strict=False)
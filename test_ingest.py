@@ -0,0 +1,242 @@
+import json
+from datetime import date
+from functools import partial
+
+import pandas as pd
+from configurator import Config
+from testfixtures import compare as compare_
+
+compare = partial(compare_, strict=True)
+
+import rollups
+from ingest import Pipeline, read_stats, stats_path
+from loaders import SOURCES, compact, load_day, load_octopus, load_range, memory, read_zappi
+from myenergi import json_to_csv as zappi_json_to_csv
+from synthetic import Spec, generate
+
+
+def write_octopus(root, day: str, consumption: float = 0.5):
+    starts = pd.date_range(day, periods=48, freq='30min', tz='Europe/London')
+    pd.DataFrame({
+        'mpan': '123',
+        'meter_serial': 'ABC',
+        'interval_start': [ts.isoformat() for ts in starts],
+        'interval_end': [(ts + pd.Timedelta(minutes=30)).isoformat() for ts in starts],
+        'consumption': consumption,
+    }).to_csv(root / f'octopus-{day}.csv', index=False)
+
+
+def write_zappi(root, day: str, minutes: int = 3):
+    ts = pd.Timestamp(day)
+    records = []
+    for minute in range(minutes):
+        record = {'yr': ts.year, 'mon': ts.month, 'dom': ts.day, 'dow': ts.strftime('%a'),
+                  'imp': 60000 * (minute + 1), 'v1': 2400, 'frq': 5000}
+        if minute:
+            record['min'] = minute
+        records.append(record)
+    (root / f'zappi-{day}.json').write_text(json.dumps({'U123': records}))
+
+
+def test_zappi_json_matches_csv(tmp_path):
+    write_zappi(tmp_path, '2024-02-18')
+    from_json = read_zappi(tmp_path / 'zappi-2024-02-18.json')
+    config = Config({'myenergi': {'zappi_serial': '123'}})
+    zappi_json_to_csv(config, pd.Timestamp('2024-02-18'), pd.Timestamp('2024-02-18'), tmp_path)
+    from_csv = read_zappi(tmp_path / 'zappi-2024-02-18.csv')
+    pd.testing.assert_frame_equal(
+        from_json.sort_index(axis=1), from_csv.sort_index(axis=1), check_dtype=False
+    )
+    compare(list(from_json['imp_kw']), expected=[1.0, 2.0, 3.0])
+
+
+def test_pipeline(tmp_path):
+    write_octopus(tmp_path, '2024-03-30', consumption=0.5)
+    write_octopus(tmp_path, '2024-04-01', consumption=0.25)
+    write_zappi(tmp_path, '2024-03-30')
+
+    Pipeline(tmp_path, workers=2).run([
+        ('octopus', date(2024, 3, 30)),
+        ('octopus', date(2024, 3, 31)),
+        ('octopus', date(2024, 4, 1)),
+        ('zappi', date(2024, 3, 30)),
+    ])
+
+    octopus = SOURCES['octopus']
+    compare(octopus.frame_path(tmp_path, date(2024, 3, 30)).exists(), expected=True)
+    compare(octopus.frame_path(tmp_path, date(2024, 3, 31)).exists(), expected=False)
+    frame = load_day(tmp_path, octopus, date(2024, 3, 30))
+    compare(list(frame.columns), expected=['consumption'])
+
+    stats = read_stats(tmp_path, 'octopus', date(2024, 3, 30))
+    compare(stats['rows'], expected=48)
+    compare(stats['columns']['consumption'], expected={
+        'sum': 24.0, 'min': 0.5, 'max': 0.5, 'mean': 0.5, 'count': 48
+    })
+
+    hours = rollups.read(tmp_path, 'octopus', 'hour', date(2024, 3, 30), date(2024, 3, 31))
+    compare(len(hours), expected=24)
+    compare(float(hours['consumption_sum'].iloc[0]), expected=1.0)
+    days = rollups.read(tmp_path, 'octopus', 'day')
+    compare([str(d.date()) for d in days.index], expected=['2024-03-30', '2024-04-01'])
+    compare(list(days['consumption_sum']), expected=[24.0, 12.0])
+    months = rollups.read(tmp_path, 'octopus', 'month')
+    compare(list(months['consumption_sum']), expected=[24.0, 12.0])
+    compare(list(months['consumption_count']), expected=[48, 48])
+
+    # re-processing a day replaces its rollups rather than adding to them:
+    write_octopus(tmp_path, '2024-03-30', consumption=1)
+    Pipeline(tmp_path).run([('octopus', date(2024, 3, 30))])
+    compare(list(rollups.read(tmp_path, 'octopus', 'day')['consumption_sum']), expected=[48.0, 12.0])
+    compare(list(rollups.read(tmp_path, 'octopus', 'month')['consumption_sum']), expected=[48.0, 12.0])
+
+    zappi = rollups.read(tmp_path, 'zappi', 'day')
+    compare(list(zappi['imp_sum']), expected=[360000])
+
+
+def test_load_day_uses_raw_file_when_newer(tmp_path):
+    write_octopus(tmp_path, '2024-03-30', consumption=0.5)
+    Pipeline(tmp_path).run([('octopus', date(2024, 3, 30))])
+    write_octopus(tmp_path, '2024-03-30', consumption=2)
+    frame = load_day(tmp_path, SOURCES['octopus'], date(2024, 3, 30))
+    compare(float(frame['consumption'].sum()), expected=96.0)
+
+
+def test_only_changed_days_processed(tmp_path):
+    write_octopus(tmp_path, '2024-01-10', consumption=0.5)
+    write_octopus(tmp_path, '2024-01-11', consumption=0.5)
+    days = [('octopus', date(2024, 1, 10)), ('octopus', date(2024, 1, 11)), ('octopus', date(2024, 1, 12))]
+    Pipeline(tmp_path).run(days)
+    first, second = (stats_path(tmp_path, 'octopus', date(2024, 1, d)).stat().st_mtime_ns for d in (10, 11))
+
+    write_octopus(tmp_path, '2024-01-11', consumption=1)
+    Pipeline(tmp_path).run(days)
+    compare(stats_path(tmp_path, 'octopus', date(2024, 1, 10)).stat().st_mtime_ns, expected=first)
+    assert stats_path(tmp_path, 'octopus', date(2024, 1, 11)).stat().st_mtime_ns > second
+    compare(list(rollups.read(tmp_path, 'octopus', 'day')['consumption_sum']), expected=[24.0, 48.0])
+
+    Pipeline(tmp_path).run(days, force=True)
+    assert stats_path(tmp_path, 'octopus', date(2024, 1, 10)).stat().st_mtime_ns > first
+
+
+def test_peaks(tmp_path):
+    write_octopus(tmp_path, '2024-01-10', consumption=0.5)
+    write_octopus(tmp_path, '2024-01-11', consumption=0.25)
+    write_zappi(tmp_path, '2024-01-10', minutes=30)
+    Pipeline(tmp_path).run([('octopus', date(2024, 1, 10)), ('octopus', date(2024, 1, 11)),
+                            ('zappi', date(2024, 1, 10))])
+
+    found = rollups.top(tmp_path, 'octopus', 'consumption_sum', n=1)
+    compare([str(d) for d in found.index], expected=['2024-01-10 00:00:00+00:00'])
+    compare(list(found['consumption_sum']), expected=[24.0])
+
+    zappi = rollups.read(tmp_path, 'zappi', 'peaks').iloc[0]
+    compare(float(zappi['imp_kw_max']), expected=30.0)
+    compare(str(zappi['imp_kw_max_at']), expected='2024-01-10 00:29:00+00:00')
+    # the mean of the last full 20 minutes, not of the first few readings:
+    compare(float(zappi['imp_kw_max_20min']), expected=20.5)
+    compare(str(zappi['imp_kw_max_20min_at']), expected='2024-01-10 00:29:00+00:00')
+    assert pd.isna(zappi['imp_kw_max_1h']), zappi['imp_kw_max_1h']
+
+    # re-processing a day replaces its peaks:
+    write_octopus(tmp_path, '2024-01-11', consumption=1)
+    Pipeline(tmp_path).run([('octopus', date(2024, 1, 11))])
+    compare(list(rollups.top(tmp_path, 'octopus', 'consumption_sum')['consumption_sum']), expected=[48.0, 24.0])
+
+
+def test_zappi_peaks_in_summer(tmp_path):
+    def write(day, *readings):
+        ts = pd.Timestamp(day)
+        records = [{'yr': ts.year, 'mon': ts.month, 'dom': ts.day, 'hr': hour, 'min': minute,
+                    'imp': 60000 * kw, 'v1': 2400, 'frq': 5000} for hour, minute, kw in readings]
+        (tmp_path / f'zappi-{day}.json').write_text(json.dumps({'U123': records}))
+
+    # UTC days, so the reading at 23:30 is at half past midnight on the 2nd in BST:
+    write('2024-07-01', (12, 0, 2), (23, 30, 7))
+    write('2024-07-02', (12, 0, 3))
+    Pipeline(tmp_path).run([('zappi', date(2024, 7, 1)), ('zappi', date(2024, 7, 2))])
+    peaks = rollups.read(tmp_path, 'zappi', 'peaks')
+    compare([str(d) for d in peaks.index], expected=['2024-07-01 00:00:00+01:00', '2024-07-02 00:00:00+01:00'])
+    compare([float(v) for v in peaks['imp_kw_max']], expected=[2.0, 7.0])
+    compare(str(peaks['imp_kw_max_at'].iloc[1]), expected='2024-07-02 00:30:00+01:00')
+
+    # processing one file again still leaves the day it shares with the next complete:
+    Pipeline(tmp_path).run([('zappi', date(2024, 7, 1))], force=True)
+    peaks = rollups.read(tmp_path, 'zappi', 'peaks')
+    compare([float(v) for v in peaks['imp_kw_max']], expected=[2.0, 7.0])
+    compare([float(v) for v in peaks['imp_kw_sum']], expected=[2.0, 10.0])
+
+
+def test_file_days():
+    compare(SOURCES['octopus'].file_days(date(2024, 6, 2), date(2024, 6, 4)),
+            expected=[date(2024, 6, 2), date(2024, 6, 3)])
+    # UTC files: the first local hour of a summer day is in the day before's file:
+    compare(SOURCES['zappi'].file_days(date(2024, 6, 2), date(2024, 6, 4)),
+            expected=[date(2024, 6, 1), date(2024, 6, 2), date(2024, 6, 3)])
+    compare(SOURCES['zappi'].file_days(date(2024, 1, 2), date(2024, 1, 4)),
+            expected=[date(2024, 1, 2), date(2024, 1, 3)])
+
+
+def test_compact():
+    frame = pd.DataFrame({
+        'small': [1, 2, 3, 4],
+        'whole': [0., 1., 2., 40000.],
+        'kw': [0.1, 0.25, 1.5, 7.4],
+        'big': [1e9 + 0.5, 0., 0., 0.],
+        'serial': ['ABC', 'ABC', 'ABC', 'DEF'],
+        'unique': ['a', 'b', 'c', 'd'],
+    })
+    compacted = compact(frame)
+    compare({column: str(dtype) for column, dtype in compacted.dtypes.items()}, expected={
+        'small': 'int32', 'whole': 'float32', 'kw': 'float32', 'big': 'float64',
+        'serial': 'category', 'unique': str(frame.dtypes['unique']),
+    })
+    compare(compacted['whole'].tolist(), expected=[0., 1., 2., 40000.])
+    assert memory(compacted) < memory(frame)
+
+
+def test_compact_arithmetic():
+    compacted = compact(pd.DataFrame({'imp': [0., 100., 120.], 'count': [1, 2, 3]}))
+    compare((compacted['imp'] * 5).tolist(), expected=[0., 500., 600.])
+    compare((compacted['imp'] * 1000).tolist(), expected=[0., 100000., 120000.])
+    compare((compacted['count'] * 1000).tolist(), expected=[1000, 2000, 3000])
+
+
+def test_load_range(tmp_path, caplog):
+    write_octopus(tmp_path, '2024-01-10', consumption=0.5)
+    write_zappi(tmp_path, '2024-01-10')
+    write_zappi(tmp_path, '2024-01-11', minutes=200)
+    with caplog.at_level('INFO'):
+        frame = load_range(tmp_path, SOURCES['zappi'], date(2024, 1, 9), date(2024, 1, 12), ['imp', 'imp_kw'])
+    compare(list(frame.columns), expected=['imp', 'imp_kw'])
+    compare(len(frame), expected=203)
+    compare(str(frame.dtypes['imp_kw']), expected='float32')
+    compare(str(frame.dtypes['imp']), expected='int32')
+    compare(float(frame['imp_kw'].sum()), expected=float(sum(range(1, 4)) + sum(range(1, 201))))
+    message, = caplog.messages
+    assert message.startswith('zappi from 2024-01-09 to 2024-01-12: 203 rows of 2 columns in '), message
+    compare(len(load_range(tmp_path, SOURCES['zappi'], date(2024, 1, 1), date(2024, 1, 2))), expected=0)
+
+    octopus = load_octopus(tmp_path, date(2024, 1, 10), ['consumption'])
+    compare(list(octopus.columns), expected=['consumption'])
+    compare(octopus.index.name, expected='interval_start')
+    octopus = load_octopus(tmp_path, date(2024, 1, 10), ['consumption'], compacted=True)
+    compare(str(octopus.dtypes['consumption']), expected='float32')
+
+
+def test_rollups_zappi_utc_days_in_summer(tmp_path):
+    # each UTC day's file also has the first local hour of the next day in it:
+    generate(Spec(date(2024, 6, 1), 2, kinds=('zappi',), gap_rate=0, missing_rate=0), tmp_path, workers=1)
+    Pipeline(tmp_path).run([('zappi', date(2024, 6, 1))])
+    Pipeline(tmp_path).run([('zappi', date(2024, 6, 2))])
+    Pipeline(tmp_path).run([('zappi', date(2024, 6, 1))], force=True)
+
+    hours = rollups.read(tmp_path, 'zappi', 'hour')
+    compare(hours.index.is_unique, expected=True)
+    compare(len(hours), expected=48)
+    compare(int(hours['imp_count'].sum()), expected=2880)
+    days = rollups.read(tmp_path, 'zappi', 'day')
+    compare([str(d.date()) for d in days.index], expected=['2024-06-01', '2024-06-02', '2024-06-03'])
+    compare(days['imp_count'].tolist(), expected=[1380, 1440, 60])
+    months = rollups.read(tmp_path, 'zappi', 'month')
+    compare(months['imp_count'].tolist(), expected=[2880])
@@ -0,0 +1,69 @@
+from datetime import date, timedelta
+from functools import partial
+
+import pandas as pd
+import pytest
+from testfixtures import compare as compare_
+
+compare = partial(compare_, strict=True)
+
+from ingest import Pipeline
+from loaders import TIMEZONE
+from lod import plot_data, readings, step_for
+from synthetic import Spec, generate
+
+
+@pytest.fixture(scope='module')
+def root(tmp_path_factory):
+    root = tmp_path_factory.mktemp('storage')
+    # over the spring DST change:
+    spec = Spec(date(2024, 3, 20), 20, kinds=('zappi',), gap_rate=0, missing_rate=0)
+    generate(spec, root, workers=1)
+    Pipeline(root, workers=1).run(('zappi', spec.start + timedelta(days=i)) for i in range(spec.days))
+    return root
+
+
+def test_step_for():
+    compare(step_for(pd.Timedelta(seconds=30)), expected=('1min', None))
+    compare(step_for(pd.Timedelta(minutes=44)), expected=('h', 'hour'))
+    compare(step_for(pd.Timedelta(hours=13)), expected=('D', 'day'))
+    compare(step_for(pd.Timedelta(days=40)), expected=('3MS', 'month'))
+    compare(step_for(pd.Timedelta(days=4000)), expected=('YS', 'month'))
+
+
+@pytest.mark.parametrize('points, freq', [(5000, '10min'), (400, '2h'), (30, 'D')])
+def test_peaks_kept(root, points, freq):
+    start, end = date(2024, 3, 20), date(2024, 4, 9)
+    data = plot_data(root, 'zappi', start, end, ['imp_kw'], points=points)
+    assert len(data) <= points, len(data)
+    raw = readings(root, 'zappi', start, end, ['imp_kw'])
+    raw = raw[(raw.index >= pd.Timestamp(start, tz=TIMEZONE)) & (raw.index < pd.Timestamp(end, tz=TIMEZONE))]
+    expected = raw.resample(freq).agg({'imp_kw_min': 'min', 'imp_kw_max': 'max', 'imp_kw_sum': 'sum',
+                                       'imp_kw_count': 'sum'})
+    expected = expected[expected['imp_kw_count'] > 0]
+    compare(list(data.columns), expected=['imp_kw_min', 'imp_kw_max', 'imp_kw_mean'])
+    compare(data.index.equals(expected.index), expected=True)
+    pd.testing.assert_series_equal(data['imp_kw_max'], expected['imp_kw_max'])
+    pd.testing.assert_series_equal(data['imp_kw_min'], expected['imp_kw_min'])
+    pd.testing.assert_series_equal(
+        data['imp_kw_mean'], expected['imp_kw_sum'] / expected['imp_kw_count'], check_names=False
+    )
+
+
+def test_readings_local_days_in_summer(root):
+    # zappi files cover UTC days, so the first local hour is in the day before's file:
+    raw = readings(root, 'zappi', date(2024, 4, 2), date(2024, 4, 3), ['imp_kw'])
+    compare(len(raw), expected=1440)
+    compare(str(raw.index[0]), expected='2024-04-02 00:00:00+01:00')
+    compare(str(raw.index[-1]), expected='2024-04-02 23:59:00+01:00')
+
+
+def test_local_days(root):
+    data = plot_data(root, 'zappi', date(2024, 3, 30), date(2024, 4, 1), ['imp_kw'], points=2)
+    compare([str(ts) for ts in data.index],
+            expected=['2024-03-30 00:00:00+00:00', '2024-03-31 00:00:00+00:00'])
+
+
+def test_nothing_there(root):
+    data = plot_data(root, 'zappi', date(2023, 1, 1), date(2023, 1, 2))
+    compare(len(data), expected=0)
@@ -3,7 +3,8 @@ from zoneinfo import ZoneInfo
 
 from pandas import Timestamp
 
-from schedule import make_seasons_and_energy_charges
+from common import diff
+from schedule import make_seasons_and_energy_charges, format_tou_period, is_tou_period
 from testfixtures import compare, ShouldRaise, log_capture, LogCapture
 
 London = ZoneInfo('Europe/London')
@@ -432,3 +433,29 @@ def test_unit_rates_changing():
         timezone=London
     )
     compare(json.loads(json.dumps(actual)), expected=CHANGING_RATES_SCHEDULE)
+
+
+def test_diff_tou_periods():
+    actual = make_seasons_and_energy_charges(
+        now=Timestamp('2024-02-29T16:42:12', tz=London),
+        unit_rates_schedule=SAMPLE_UNIT_RATES_29_FEB,
+        dispatches={'plannedDispatches': [{
+            'startDtUtc': '2024-02-29T19:00:00+00:00',
+            'endDtUtc': '2024-02-29T20:00:00+00:00',
+            'meta': {'source': 'smart-charge'},
+        }]},
+        timezone=London
+    )
+    compare(
+        diff(BASIC_SCHEDULE, actual, format_value=format_tou_period, atomic=is_tou_period),
+        expected=(
+            '- seasons.Summer.tou_periods.ON_PEAK[0]: 05:30-23:30\n'
+            '+ seasons.Summer.tou_periods.ON_PEAK[0]: 05:30-19:00\n'
+            '+ seasons.Summer.tou_periods.ON_PEAK[1]: 20:00-23:30\n'
+            '+ seasons.Summer.tou_periods.SUPER_OFF_PEAK[1]: 19:00-20:00\n'
+        )
+    )
+
+
+def test_diff_no_changes():
+    compare(diff(BASIC_SCHEDULE, json.loads(json.dumps(BASIC_SCHEDULE))), expected='')
@@ -0,0 +1,154 @@
+import asyncio
+from datetime import date
+from functools import partial
+from threading import Event, Thread
+from urllib.request import urlopen
+
+import pytest
+import requests
+from testfixtures import compare as compare_
+
+compare = partial(compare_, strict=True)
+
+import metrics
+from common import Run
+from fakes import Fakes, Faults
+from metrics import Counter, Histogram, Metric, Registry, api_call, failure_kind
+from octopus import download_consumption
+from synthetic import Spec, generate
+
+
+def test_render():
+    registry = Registry()
+    errors = Counter('errors_total', 'Errors.', ['api', 'kind'], registry)
+    seconds = Histogram('request_seconds', 'Requests.', ['api'], registry, buckets=(0.1, 1))
+    errors.labels('tesla', 'timeout').inc()
+    errors.labels('tesla', 'timeout').inc(2)
+    seconds.labels('tesla').observe(0.05)
+    seconds.labels('tesla').observe(0.5)
+    seconds.labels('tesla').observe(5)
+    compare(registry.render().splitlines(), expected=[
+        '# HELP errors_total Errors.',
+        '# TYPE errors_total counter',
+        'errors_total{api="tesla",kind="timeout"} 3',
+        '# HELP request_seconds Requests.',
+        '# TYPE request_seconds histogram',
+        'request_seconds_bucket{api="tesla",le="0.1"} 1',
+        'request_seconds_bucket{api="tesla",le="1"} 2',
+        'request_seconds_bucket{api="tesla",le="+Inf"} 3',
+        'request_seconds_sum{api="tesla"} 5.55',
+        'request_seconds_count{api="tesla"} 3',
+    ])
+
+
+def test_label_values_escaped():
+    registry = Registry()
+    errors = Counter('errors_total', 'Errors.', ['operation'], registry)
+    errors.labels('a "b"\\c\nd').inc()
+    compare(registry.render().splitlines()[-1], expected='errors_total{operation="a \\"b\\"\\\\c\\nd"} 1')
+
+
+def test_reading_values_adds_nothing():
+    registry = Registry()
+    errors = Counter('errors_total', 'Errors.', ['api'], registry)
+    seconds = Histogram('request_seconds', 'Requests.', ['api'], registry)
+    compare(errors.value('tesla'), expected=0.)
+    compare(seconds.count('tesla'), expected=0)
+    compare(registry.render().splitlines(), expected=[
+        '# HELP errors_total Errors.',
+        '# TYPE errors_total counter',
+        '# HELP request_seconds Requests.',
+        '# TYPE request_seconds histogram',
+    ])
+
+
+def test_samples_while_recording():
+    registry = Registry()
+    seconds = Histogram('request_seconds', 'Requests.', ['api'], registry, buckets=(1,))
+    seconds.labels('octopus').observe(0.5)
+    samples = seconds.samples()
+    compare(next(samples), expected='request_seconds_bucket{api="octopus",le="1"} 1')
+    # as the HTTP thread might see while rendering, which should still add up:
+    seconds.labels('octopus').observe(5)
+    seconds.labels('tesla').observe(0.5)
+    compare(list(samples), expected=[
+        'request_seconds_bucket{api="octopus",le="+Inf"} 1',
+        'request_seconds_sum{api="octopus"} 0.5',
+        'request_seconds_count{api="octopus"} 1',
+    ])
+
+
+def test_metric_needs_new_and_samples():
+    class Incomplete(Metric):
+        kind = 'gauge'
+
+        def new(self):
+            return [0]
+
+    with pytest.raises(TypeError, match='samples'):
+        Incomplete('incomplete', 'help', registry=Registry())
+
+
+def test_failure_kind():
+    response = requests.Response()
+    response.status_code = 429
+    compare(failure_kind(requests.ReadTimeout()), expected='timeout')
+    compare(failure_kind(requests.HTTPError(response=response)), expected='throttled')
+    compare(failure_kind(ValueError()), expected='error')
+    compare(failure_kind(asyncio.CancelledError()), expected='cancelled')
+
+
+def test_api_call():
+    before = metrics.API_ERRORS.value('test', 'timeout')
+    with pytest.raises(TimeoutError):
+        with api_call('test', 'op'):
+            raise TimeoutError()
+    with api_call('test', 'op'):
+        pass
+    compare(metrics.API_ERRORS.value('test', 'timeout'), expected=before + 1)
+    compare(metrics.API_SECONDS.count('test', 'op'), expected=2)
+
+
+def test_textfile_and_http(tmp_path):
+    registry = Registry()
+    Counter('things_total', 'Things.', registry=registry).inc()
+    registry.write(tmp_path / 'energy.prom')
+    compare((tmp_path / 'energy.prom').read_text().splitlines()[-1], expected='things_total 1')
+    compare([p.name for p in tmp_path.iterdir()], expected=['energy.prom'])
+    server = registry.serve(0)
+    try:
+        with urlopen(f'http://127.0.0.1:{server.server_port}/metrics') as response:
+            compare(response.read().decode(), expected=registry.render())
+    finally:
+        server.shutdown()
+
+
+def test_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics.REGISTRY, 'textfile', tmp_path / 'energy.prom')
+
+    def fail():
+        raise ValueError()
+
+    Run(lambda: None, name='test-ok').once()
+    with pytest.raises(ValueError):
+        Run(fail, name='test-fail').once()
+    compare(metrics.RUN_SECONDS.count('test-ok'), expected=1)
+    compare(metrics.RUN_FAILURES.value('test-fail'), expected=1.)
+    assert 'energy_run_failures_total{name="test-fail"} 1' in (tmp_path / 'energy.prom').read_text()
+
+
+def test_download_throughput(tmp_path):
+    source = tmp_path / 'source'
+    source.mkdir()
+    generate(Spec(date(2024, 1, 1), 2, kinds=('octopus',), gap_rate=0, missing_rate=0), source, workers=1)
+    rows = metrics.DOWNLOAD_ROWS.value('octopus')
+    throttled = metrics.API_ERRORS.value('octopus', 'throttled')
+    with Fakes(source, Faults(throttle_every=2, retry_after=0)) as fakes:
+        config = fakes.config(tmp_path, tmp_path / 'cache.json')
+        download_consumption(
+            config.octopus.account, config.octopus.api_key, tmp_path,
+            start=None, end=None, base_url=config.octopus.base_url,
+        )
+    compare(metrics.DOWNLOAD_ROWS.value('octopus'), expected=rows + 96)
+    compare(metrics.API_ERRORS.value('octopus', 'throttled'), expected=throttled + 1)
+    assert metrics.API_SECONDS.count('octopus', 'consumption') >= 2
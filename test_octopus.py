@@ -1,4 +1,5 @@
-from datetime import time, datetime
+from datetime import UTC, time, datetime, timedelta
+from email.utils import format_datetime
 from functools import partial
 from zoneinfo import ZoneInfo
 
@@ -10,7 +11,7 @@ from testfixtures import compare as compare_, ShouldRaise, ShouldAssert
 compare = partial(compare_, strict=True)
 
 
-from octopus import Schedule, ScheduleEntry, TimeSlot
+from octopus import Schedule, ScheduleEntry, TimeSlot, retry_after
 
 
 def ts(time: str, date: str = "2024-02-18", tz: str | ZoneInfo='+00:00') -> Timestamp:
@@ -565,3 +566,27 @@ def test_multiple_entries_during_ambiguous_second_dst_extra_hours():
         TimeSlot(start=time(21, 0), end=time(22, 0), cost=50),
         TimeSlot(start=time(22, 0), end=time(0, 0), cost=60)
     ])
+
+
+def test_add_utc_over_dst_extra_hours():
+    schedule = Schedule(ts("18:12", '2024-10-26', TZ))
+    schedule.add(ts("17:00", '2024-10-26'), ts("22:30", '2024-10-26'), 20)
+    schedule.add(ts("22:30", '2024-10-26'), ts("05:30", '2024-10-27'), 10)
+    schedule.add(ts("05:30", '2024-10-27'), ts("23:30", '2024-10-27'), 20)
+    compare(schedule.final(), expected=[
+        ScheduleEntry(ts("18:00", '2024-10-26', TZ), ts("23:30", '2024-10-26', TZ), 20),
+        ScheduleEntry(ts("23:30", '2024-10-26', TZ), ts("05:30", '2024-10-27', TZ), 10),
+        ScheduleEntry(ts("05:30", '2024-10-27', TZ), ts("18:00", '2024-10-27', TZ), 20),
+    ])
+
+
+def test_retry_after():
+    compare(retry_after('3'), expected=3.0)
+    compare(retry_after('1.5'), expected=1.5)
+    compare(retry_after(None), expected=1)
+    compare(retry_after('soon'), expected=1)
+    compare(retry_after('inf'), expected=1)
+    compare(retry_after('-5'), expected=0)
+    compare(retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), expected=0)
+    later = format_datetime(datetime.now(UTC) + timedelta(seconds=60), usegmt=True)
+    assert 55 < retry_after(later) <= 60, retry_after(later)
@@ -0,0 +1,118 @@
+from functools import partial
+from importlib import import_module
+from zoneinfo import ZoneInfo
+
+import pytest
+from requests import ConnectionError, HTTPError, ReadTimeout, Response
+from testfixtures import compare as compare_, Replace
+
+compare = partial(compare_, strict=True)
+
+sync = import_module('octopus-tesla-sync')
+
+
+class FakeGraphQLClient:
+
+    def __init__(self, timeouts: int = 0):
+        self.timeouts = timeouts
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def dispatches(self, account):
+        self.calls.append(('dispatches', account))
+        if self.timeouts:
+            self.timeouts -= 1
+            raise TimeoutError()
+        return {'plannedDispatches': [], 'completedDispatches': []}
+
+    async def tariff(self, account):
+        self.calls.append(('tariff', account))
+        return {'tariffCode': 'E-1R-GO', 'fullName': 'Octopus Go', 'unitRates': []}
+
+
+class FakeBattery:
+
+    def __init__(self):
+        self.tariff = {'code': 'OLD', 'seasons': {}}
+        self.calls = []
+
+    def get_tariff(self):
+        self.calls.append('get_tariff')
+        return dict(self.tariff)
+
+    def set_tariff(self, tariff):
+        self.calls.append('set_tariff')
+        self.tariff = tariff
+
+
+def make_syncer(graphql_client, battery, **kw):
+    return sync.Syncer(
+        graphql_client, 'A-123', None, battery, ZoneInfo('Europe/London'),
+        sync=True, force=False, **kw
+    )
+
+
+def fake_seasons(now, unit_rates_schedule, dispatches, timezone):
+    return {'seasons': {'Summer': {}}}
+
+
+def test_cycle_updates_tesla():
+    graphql_client = FakeGraphQLClient()
+    battery = FakeBattery()
+    syncer = make_syncer(graphql_client, battery)
+    with Replace('octopus-tesla-sync.make_seasons_and_energy_charges', fake_seasons):
+        syncer()
+    compare(battery.calls, expected=['get_tariff', 'set_tariff', 'get_tariff'])
+    compare(syncer.tesla_tariff['code'], expected='E-1R-GO')
+    # a second cycle doesn't touch the battery unless something has changed:
+    with Replace('octopus-tesla-sync.make_seasons_and_energy_charges', fake_seasons):
+        syncer()
+    compare(battery.calls, expected=['get_tariff', 'set_tariff', 'get_tariff'])
+
+
+def test_cycle_retries_timeouts():
+    graphql_client = FakeGraphQLClient(timeouts=1)
+    battery = FakeBattery()
+    syncer = make_syncer(graphql_client, battery)
+    syncer.octopus.initial = 0
+    with Replace('octopus-tesla-sync.make_seasons_and_energy_charges', fake_seasons):
+        syncer()
+    compare(graphql_client.calls, expected=[
+        ('dispatches', 'A-123'), ('tariff', 'A-123'), ('dispatches', 'A-123'),
+    ])
+    compare(battery.calls, expected=['get_tariff', 'set_tariff', 'get_tariff'])
+
+
+def test_cycle_deadline():
+    graphql_client = FakeGraphQLClient(timeouts=100)
+    battery = FakeBattery()
+    syncer = make_syncer(graphql_client, battery, deadline=0.05)
+    syncer.octopus.initial = 0.01
+    syncer.octopus.breaker.threshold = 1000
+    syncer.octopus.attempts = 1000
+    with pytest.raises(ExceptionGroup) as info:
+        syncer()
+    compare(info.value.exceptions, expected=[TimeoutError()], strict=False)
+    compare(battery.calls, expected=['get_tariff'])
+
+
+def http_error(status: int) -> HTTPError:
+    response = Response()
+    response.status_code = status
+    return HTTPError(response=response)
+
+
+def test_tesla_retryable():
+    compare(sync.tesla_retryable(TimeoutError()), expected=True)
+    compare(sync.tesla_retryable(ReadTimeout()), expected=True)
+    compare(sync.tesla_retryable(ConnectionError()), expected=True)
+    compare(sync.tesla_retryable(http_error(503)), expected=True)
+    compare(sync.tesla_retryable(http_error(429)), expected=True)
+    compare(sync.tesla_retryable(http_error(401)), expected=False)
+    compare(sync.tesla_retryable(http_error(404)), expected=False)
+    compare(sync.tesla_retryable(KeyError()), expected=False)
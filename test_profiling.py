@@ -0,0 +1,75 @@
+import os
+import pstats
+import signal
+from argparse import ArgumentParser
+from functools import partial
+from time import monotonic
+
+from testfixtures import compare as compare_
+
+compare = partial(compare_, strict=True)
+
+from profiling import Sampler, SignalSampler, add_profile
+
+
+def busy(seconds: float = 0.1) -> None:
+    end = monotonic() + seconds
+    while monotonic() < end:
+        pass
+
+
+BUSY = f'busy (test_profiling.py:{busy.__code__.co_firstlineno})'
+
+
+def parse(*args: str):
+    parser = ArgumentParser()
+    add_profile(parser)
+    return parser.parse_args(args)
+
+
+def test_sampler():
+    sampler = Sampler(interval=0.001)
+    sampler.start()
+    busy()
+    sampler.stop()
+    stack, count = sampler.stacks.most_common(1)[0]
+    assert stack.endswith(f';test_sampler (test_profiling.py:30);{BUSY}'), stack
+
+
+def test_profile(tmp_path):
+    path = tmp_path / 'run.prof'
+    args = parse('--profile', str(path))
+    busy()
+    args.profile.finish()
+    # atexit calling it again does nothing:
+    args.profile.finish()
+    functions = {name for _, _, name in pstats.Stats(str(path)).stats}
+    assert 'busy' in functions
+    lines = (tmp_path / 'run.prof.collapsed').read_text().splitlines()
+    assert any(f'{BUSY} ' in line for line in lines), lines
+
+
+def test_sample(tmp_path):
+    path = tmp_path / 'run.collapsed'
+    args = parse('--profile-sample', str(path))
+    busy()
+    args.profile_sample.finish()
+    compare([p.name for p in tmp_path.iterdir()], expected=['run.collapsed'])
+    stack, count = path.read_text().splitlines()[0].rsplit(' ', 1)
+    assert stack.endswith(BUSY), stack
+
+
+def test_signal(tmp_path):
+    previous = signal.getsignal(signal.SIGUSR1)
+    try:
+        sampler = SignalSampler(tmp_path / 'sync.collapsed', interval=0.001)
+        os.kill(os.getpid(), signal.SIGUSR1)
+        compare(sampler.sampler.running, expected=True)
+        busy()
+        os.kill(os.getpid(), signal.SIGUSR1)
+        compare(sampler.sampler.running, expected=False)
+    finally:
+        signal.signal(signal.SIGUSR1, previous)
+    path, = tmp_path.iterdir()
+    assert path.name.startswith('sync-') and path.suffix == '.collapsed', path
+    assert BUSY in path.read_text()
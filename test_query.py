@@ -0,0 +1,103 @@
+import asyncio
+from datetime import date
+from functools import partial
+from threading import Thread
+
+import pytest
+import requests
+from aiohttp import web
+from testfixtures import compare as compare_
+
+compare = partial(compare_, strict=True)
+
+from query import Store, make_app, series
+from synthetic import Spec, generate
+
+
+@pytest.fixture(scope='module')
+def root(tmp_path_factory):
+    root = tmp_path_factory.mktemp('storage')
+    generate(Spec(date(2024, 1, 1), 3, gap_rate=0, missing_rate=0), root, workers=1)
+    return root
+
+
+@pytest.fixture(scope='module')
+def url(root):
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(make_app(root), access_log=None)
+
+    async def setup():
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', 0).start()
+
+    thread = Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(setup(), loop).result()
+    host, port = runner.addresses[0][:2]
+    yield f'http://{host}:{port}'
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+
+
+def test_series(url):
+    frame = series(url, 'octopus', date(2024, 1, 1), date(2024, 1, 3))
+    compare(len(frame), expected=96)
+    compare(str(frame.index[0]), expected='2024-01-01 00:00:00+00:00')
+    resampled = series(url, 'zappi', date(2024, 1, 1), resolution='1h', how='sum', columns=['imp', 'exp'])
+    compare(list(resampled.columns), expected=['imp', 'exp'])
+    compare(len(resampled), expected=24)
+
+
+def test_series_csv(url):
+    response = requests.get(f'{url}/series/octopus', params={'start': '2024-01-01', 'format': 'csv'})
+    compare(response.headers['Content-Type'], expected='text/csv; charset=utf-8')
+    lines = response.text.splitlines()
+    compare(len(lines), expected=49)
+
+
+def test_series_errors(url):
+    for path, params, status in (
+        ('/series/nope', {'start': '2024-01-01'}, 404),
+        ('/series/octopus', {}, 400),
+        ('/series/octopus', {'start': '2024-13-01'}, 400),
+        ('/series/octopus', {'start': '2024-01-01', 'how': 'median'}, 400),
+        ('/series/octopus', {'start': '2024-01-01', 'columns': 'nope'}, 400),
+        ('/series/octopus', {'start': '2024-01-01', 'resolution': 'nope'}, 400),
+    ):
+        response = requests.get(url + path, params=params)
+        compare(response.status_code, expected=status, prefix=f'{path} {params}')
+
+
+def test_store_zappi_local_days_in_summer(tmp_path):
+    generate(Spec(date(2024, 6, 1), 3, kinds=('zappi',), gap_rate=0, missing_rate=0), tmp_path, workers=1)
+    # zappi files cover UTC days, so the first local hour is in the day before's file:
+    frame = Store(tmp_path).series('zappi', date(2024, 6, 2), date(2024, 6, 3))
+    compare(len(frame), expected=1440)
+    compare(str(frame.index[0]), expected='2024-06-02 00:00:00+01:00')
+    compare(str(frame.index[-1]), expected='2024-06-02 23:59:00+01:00')
+
+
+def test_store_reread_on_change(root):
+    store = Store(root, max_days=2)
+    first = store.day('octopus', date(2024, 1, 1))
+    compare(store.day('octopus', date(2024, 1, 1)) is first, expected=True)
+    compare(str(first.dtypes.iloc[0]), expected='float32')
+    path = root / 'octopus-2024-01-01.csv'
+    path.write_text(path.read_text())
+    compare(store.day('octopus', date(2024, 1, 1)) is first, expected=False)
+    store.day('octopus', date(2024, 1, 2))
+    store.day('octopus', date(2024, 1, 3))
+    compare(list(store.days), expected=[('octopus', date(2024, 1, 2)), ('octopus', date(2024, 1, 3))])
+    compare(store.day('octopus', date(2024, 2, 1)), expected=None)
+
+
+def test_tariff_and_dispatches(url):
+    tariff = requests.get(f'{url}/tariff', params={'at': '2024-01-02T12:00'}).json()
+    assert tariff['recorded'] <= '2024-01-02T12:00', tariff['recorded']
+    assert tariff['unit_rates'], tariff
+    assert 'energy_charges' in tariff['tesla'], tariff['tesla']
+    dispatches = requests.get(f'{url}/dispatches', params={'start': '2024-01-01', 'end': '2024-01-04'}).json()
+    assert dispatches, dispatches
+    assert {'first_seen', 'last_seen', 'completed', 'startDtUtc'} <= set(dispatches[0]), dispatches[0]
+    compare(requests.get(f'{url}/tariff', params={'at': '2023-01-01T00:00'}).status_code, expected=404)
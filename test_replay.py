@@ -0,0 +1,81 @@
+import json
+from datetime import date, datetime
+from functools import partial
+
+import pandas as pd
+from testfixtures import compare as compare_
+
+compare = partial(compare_, strict=True)
+
+from replay import differences, dst_changes, load_baseline, replay_all, report, save_baseline
+from segments import SegmentLog, import_snapshots
+from synthetic import Spec, generate, unit_rates
+
+# over the end of DST:
+SPEC = Spec(date(2024, 10, 26), 2, kinds=('dispatches',))
+
+
+def write(root, at: str, state) -> None:
+    (root / f"octopus-dispatches-{at}.json").write_text(json.dumps(state))
+
+
+def test_replay_synthetic(tmp_path):
+    generate(SPEC, tmp_path, workers=1)
+    results = replay_all(tmp_path, workers=2)
+    compare(len(results), expected=8)
+    compare({r.status for r in results}, expected={'ok'})
+    compare(results[0].at, expected=datetime(2024, 10, 26, 17, 3, 12))
+    compare(dst_changes(results), expected=[date(2024, 10, 27)])
+
+
+def test_problems(tmp_path):
+    now = pd.Timestamp('2024-01-10 12:00', tz='Europe/London')
+    rates = unit_rates(now)
+    dispatches = {'plannedDispatches': [], 'completedDispatches': []}
+    write(tmp_path, '2024-01-10-11-00-00', {'plannedDispatches': [], 'completedDispatches': []})
+    write(tmp_path, '2024-01-10-12-00-00', {'dispatches': dispatches, 'unit_rates': rates})
+    write(tmp_path, '2024-01-10-13-00-00', {'dispatches': dispatches, 'unit_rates': []})
+    # rates that only start tomorrow leave today's slots empty:
+    write(tmp_path, '2024-01-10-14-00-00', {'dispatches': dispatches, 'unit_rates': rates[4:]})
+    results = replay_all(tmp_path, workers=1)
+    compare([r.status for r in results], expected=['skipped', 'ok', 'error', 'gaps'])
+    compare(results[2].error, expected='AssertionError: empty unit rates?')
+    compare(results[3].error.startswith("ValueError: Gaps in schedule: ['2024-01-10 14:00:00+00:00'"),
+            expected=True)
+    text = report(results, seconds=0.5)
+    compare(text.splitlines()[:3], expected=[
+        'Replayed 4 snapshots from 2024-01-10 11:00:00 to 2024-01-10 14:00:00 in 0.5s',
+        '  ok: 1, error: 1, gaps: 1, skipped: 1',
+        '  warnings: 0',
+    ])
+
+
+def test_segments_match_files(tmp_path):
+    generate(SPEC, tmp_path, workers=1)
+    from_files = replay_all(tmp_path, workers=1)
+    import_snapshots(SegmentLog(tmp_path, 'octopus-dispatches'))
+    for path in tmp_path.glob('octopus-dispatches-*.json'):
+        path.unlink()
+    compare(replay_all(tmp_path, workers=1), expected=from_files)
+
+
+def test_start_and_end(tmp_path):
+    generate(SPEC, tmp_path, workers=1)
+    results = replay_all(tmp_path, start=datetime(2024, 10, 26, 18), end=datetime(2024, 10, 26, 23), workers=1)
+    compare([str(r.at) for r in results], expected=['2024-10-26 20:31:45', '2024-10-26 22:58:03'])
+
+
+def test_baseline(tmp_path):
+    generate(SPEC, tmp_path, workers=1)
+    results = replay_all(tmp_path, workers=1)
+    save_baseline(tmp_path / 'baseline.jsonl', results)
+    baseline = load_baseline(tmp_path / 'baseline.jsonl')
+    compare(differences(results, baseline), expected=[])
+
+    path = sorted(tmp_path.glob('octopus-dispatches-*.json'))[1]
+    state = json.loads(path.read_text())
+    for rate in state['unit_rates']:
+        rate['value'] += 1
+    path.write_text(json.dumps(state))
+    different = differences(replay_all(tmp_path, workers=1), baseline)
+    compare([r.at for r, _ in different], expected=[results[1].at])
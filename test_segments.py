@@ -0,0 +1,202 @@
+import gzip
+import json
+import time
+from datetime import UTC, datetime
+from functools import partial
+
+import pytest
+from testfixtures import compare as compare_
+
+compare = partial(compare_, strict=True)
+
+from common import DiffDumper
+from segments import SegmentLog, delta, apply, import_snapshots
+
+STATE1 = {
+    'dispatches': {'plannedDispatches': [], 'completedDispatches': [{'start': 'a'}]},
+    'unit_rates': [{'value': 7.5}],
+    'agreement': {'tariffCode': 'GO', 'validTo': None},
+}
+
+STATE2 = {
+    'dispatches': {'plannedDispatches': [{'start': 'b'}], 'completedDispatches': [{'start': 'a'}]},
+    'unit_rates': [{'value': 7.5}],
+    'agreement': {'tariffCode': 'GO'},
+}
+
+STATE3 = {
+    'dispatches': {'plannedDispatches': [], 'completedDispatches': [{'start': 'b'}]},
+    'unit_rates': [{'value': 8.5}],
+}
+
+
+def test_delta_round_trip():
+    operations = list(delta(STATE1, STATE2))
+    compare(operations, expected=[
+        [['dispatches', 'plannedDispatches'], [{'start': 'b'}]],
+        [['agreement', 'validTo']],
+    ])
+    compare(apply(STATE1, operations), expected=STATE2)
+    compare(apply(STATE2, list(delta(STATE2, STATE3))), expected=STATE3)
+
+
+def test_apply_does_not_mutate():
+    original = json.loads(json.dumps(STATE1))
+    apply(STATE1, list(delta(STATE1, STATE3)))
+    compare(STATE1, expected=original)
+
+
+def test_latest_and_point_in_time(tmp_path):
+    log = SegmentLog(tmp_path, 'octopus-dispatches')
+    compare(log.latest(), expected=None)
+    log.append(datetime(2024, 2, 18, 10), STATE1)
+    log.append(datetime(2024, 2, 18, 11), STATE2)
+    log.append(datetime(2024, 2, 19, 9), STATE3)
+
+    # a fresh instance only needs the latest file:
+    log = SegmentLog(tmp_path, 'octopus-dispatches')
+    compare(log.latest(), expected=(datetime(2024, 2, 19, 9), STATE3))
+
+    compare(log.at(datetime(2024, 2, 18, 9)), expected=None)
+    compare(log.at(datetime(2024, 2, 18, 10)), expected=(datetime(2024, 2, 18, 10), STATE1))
+    compare(log.at(datetime(2024, 2, 18, 10, 30)), expected=(datetime(2024, 2, 18, 10), STATE1))
+    compare(log.at(datetime(2024, 2, 18, 12)), expected=(datetime(2024, 2, 18, 11), STATE2))
+    # before the first record of a day, so falls back to the day before:
+    compare(log.at(datetime(2024, 2, 19, 8)), expected=(datetime(2024, 2, 18, 11), STATE2))
+    compare(log.at(datetime(2024, 3, 1)), expected=(datetime(2024, 2, 19, 9), STATE3))
+
+
+def test_items(tmp_path):
+    log = SegmentLog(tmp_path, 'tesla-schedule')
+    log.append(datetime(2024, 2, 18, 10), STATE1)
+    log.append(datetime(2024, 2, 18, 11), STATE2)
+    log.append(datetime(2024, 2, 19, 9), STATE3)
+    compare(list(log.items()), expected=[
+        (datetime(2024, 2, 18, 10), STATE1),
+        (datetime(2024, 2, 18, 11), STATE2),
+        (datetime(2024, 2, 19, 9), STATE3),
+    ])
+    compare(list(log.items(datetime(2024, 2, 18, 10, 30), datetime(2024, 2, 19, 9))), expected=[
+        (datetime(2024, 2, 18, 11), STATE2),
+    ])
+
+
+def test_segments_are_rotated_daily(tmp_path):
+    log = SegmentLog(tmp_path, 'octopus-dispatches')
+    log.append(datetime(2024, 2, 18, 10), STATE1)
+    log.append(datetime(2024, 2, 19, 9), STATE2)
+    compare(sorted(p.name for p in tmp_path.iterdir()), expected=[
+        'octopus-dispatches-2024-02-18.idx',
+        'octopus-dispatches-2024-02-18.jsonl.gz',
+        'octopus-dispatches-2024-02-19.idx',
+        'octopus-dispatches-2024-02-19.jsonl.gz',
+        'octopus-dispatches.latest',
+    ])
+    # once the next day is started, the earlier segment is a single gzip member:
+    content = (tmp_path / 'octopus-dispatches-2024-02-18.jsonl.gz').read_bytes()
+    compare(content.count(b'\x1f\x8b\x08'), expected=1)
+    # the first record in each segment is the full state:
+    compare(list(log._replay(datetime(2024, 2, 19).date())), expected=[
+        (datetime(2024, 2, 19, 9), STATE2),
+    ])
+
+
+def test_import_snapshots(tmp_path):
+    (tmp_path / 'octopus-dispatches-2024-02-18-10-00-00.json').write_text(json.dumps(STATE1))
+    (tmp_path / 'octopus-dispatches-2024-02-18-11-00-00.json').write_text(json.dumps(STATE2))
+    log = SegmentLog(tmp_path, 'octopus-dispatches')
+    import_snapshots(log)
+    # importing again doesn't duplicate anything:
+    import_snapshots(log)
+    compare(list(log.items()), expected=[
+        (datetime(2024, 2, 18, 10), STATE1),
+        (datetime(2024, 2, 18, 11), STATE2),
+    ])
+
+
+def test_diff_dumper_segments(tmp_path):
+    (tmp_path / 'octopus-dispatches-2024-02-18-10-00-00.json').write_text(json.dumps(STATE1))
+    dumper = DiffDumper(tmp_path, 'octopus-dispatches', segments=True)
+    # falls back to the json files until the segment log has something in it:
+    compare(dumper.state, expected=STATE1)
+    dumper.update(STATE1)
+    compare(SegmentLog(tmp_path, 'octopus-dispatches').latest(), expected=None)
+    dumper.update(STATE2)
+    dumper = DiffDumper(tmp_path, 'octopus-dispatches', segments=True)
+    compare(dumper.state, expected=STATE2)
+
+
+@pytest.fixture()
+def london(monkeypatch):
+    monkeypatch.setenv('TZ', 'Europe/London')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_dst_ends(tmp_path, london):
+    log = SegmentLog(tmp_path, 'octopus-dispatches')
+    # 01:30 BST, then 01:10 GMT, which is later even though the local time is earlier:
+    log.append(datetime(2024, 10, 27, 0, 30, tzinfo=UTC), STATE1)
+    log.append(datetime(2024, 10, 27, 1, 10, tzinfo=UTC), STATE2)
+    log.append(datetime(2024, 10, 27, 3, tzinfo=UTC), STATE3)
+    second = datetime(2024, 10, 27, 1, 10, fold=1)
+    compare(log.at(datetime(2024, 10, 27, 1, 20, fold=1)), expected=(second, STATE2))
+    compare(log.at(datetime(2024, 10, 27, 1, 40)), expected=(datetime(2024, 10, 27, 1, 30), STATE1))
+    compare([at for at, _ in log.items()], expected=[
+        datetime(2024, 10, 27, 1, 30), second, datetime(2024, 10, 27, 3),
+    ])
+    compare([at.fold for at, _ in log.items()], expected=[0, 1, 0])
+
+
+def test_records_compressed_together(tmp_path):
+    log = SegmentLog(tmp_path, 'octopus-dispatches')
+    for minute in range(60):
+        log.append(datetime(2024, 2, 18, 10, minute), {**STATE1, 'minute': minute})
+    path = tmp_path / 'octopus-dispatches-2024-02-18.jsonl.gz'
+    before = path.stat().st_size
+    log.compact(datetime(2024, 2, 18).date())
+    assert path.stat().st_size < before / 2, (path.stat().st_size, before)
+    compare(log.at(datetime(2024, 2, 18, 10, 30, 30)), expected=(
+        datetime(2024, 2, 18, 10, 30), {**STATE1, 'minute': 30}
+    ))
+
+
+def test_stale_latest(tmp_path):
+    log = SegmentLog(tmp_path, 'octopus-dispatches')
+    log.append(datetime(2024, 2, 18, 10), STATE1)
+    stale = log.latest_path.read_bytes()
+    log.append(datetime(2024, 2, 18, 11), STATE2)
+    # as if the process died after writing the record but before the latest file:
+    log.latest_path.write_bytes(stale)
+
+    log = SegmentLog(tmp_path, 'octopus-dispatches')
+    compare(log.latest(), expected=(datetime(2024, 2, 18, 11), STATE2))
+    log.append(datetime(2024, 2, 18, 12), STATE3)
+    compare(list(log.items()), expected=[
+        (datetime(2024, 2, 18, 10), STATE1),
+        (datetime(2024, 2, 18, 11), STATE2),
+        (datetime(2024, 2, 18, 12), STATE3),
+    ])
+
+
+def test_delta_base_from_segment(tmp_path):
+    log = SegmentLog(tmp_path, 'octopus-dispatches')
+    log.append(datetime(2024, 2, 18, 10), STATE1)
+    log.append(datetime(2024, 2, 18, 11), STATE2)
+    # a latest file that's drifted from the segment, even though it's the newest:
+    log.latest_path.write_text(json.dumps({'at': '2024-02-18T11:00:00', 'state': STATE3}))
+
+    log = SegmentLog(tmp_path, 'octopus-dispatches')
+    log.append(datetime(2024, 2, 18, 12), STATE1)
+    compare(list(log.items())[-1], expected=(datetime(2024, 2, 18, 12), STATE1))
+
+
+def test_legacy_index(tmp_path):
+    log = SegmentLog(tmp_path, 'octopus-dispatches')
+    path = log.segment_path(datetime(2024, 2, 18).date())
+    records = [{'at': '2024-02-18T10:00:00', 'state': STATE1}, {'at': '2024-02-18T11:00:00', 'state': STATE2}]
+    path.write_bytes(b''.join(gzip.compress(json.dumps(r).encode() + b'\n') for r in records))
+    log.index_path(datetime(2024, 2, 18).date()).write_text('2024-02-18T10:00:00\t0\n2024-02-18T11:00:00\t90\n')
+    compare(log.at(datetime(2024, 2, 18, 10, 30)), expected=(datetime(2024, 2, 18, 10), STATE1))
@@ -0,0 +1,53 @@
+from datetime import datetime
+from functools import partial
+from importlib import import_module
+
+from testfixtures import compare as compare_
+
+compare = partial(compare_, strict=True)
+
+show_changes = import_module('show-changes')
+
+
+def test_select(tmp_path):
+    for name in (
+        'octopus-dispatches-2024-02-18-10-00-00.json',
+        'octopus-dispatches-2024-02-18-11-00-00.json',
+        'octopus-dispatches-2024-02-18-12-00-00.json',
+        'octopus-dispatches-2024-02-19-12-00-00.json',
+        'octopus-dispatches-2024-02-19.jsonl.gz',
+        'octopus-dispatches.latest',
+    ):
+        (tmp_path / name).write_text('{}')
+    paths = show_changes.snapshot_paths(tmp_path, 'octopus-dispatches')
+    compare(len(paths), expected=4)
+    compare(
+        [p.name for p in show_changes.select(
+            paths, datetime(2024, 2, 18, 10), datetime(2024, 2, 19, 12)
+        )],
+        expected=[
+            'octopus-dispatches-2024-02-18-11-00-00.json',
+            'octopus-dispatches-2024-02-18-12-00-00.json',
+        ]
+    )
+    compare(show_changes.select(paths, None, None), expected=paths)
+
+
+def test_main_start_end(tmp_path, monkeypatch, capsys):
+    for name, value in (
+        ('octopus-dispatches-2024-02-17-12-00-00.json', 0),
+        ('octopus-dispatches-2024-02-18-10-00-00.json', 1),
+        ('octopus-dispatches-2024-02-18-11-00-00.json', 2),
+        ('octopus-dispatches-2024-02-19-12-00-00.json', 3),
+    ):
+        (tmp_path / name).write_text(f'{{"value": {value}}}')
+    (tmp_path / 'config.yaml').write_text(f'directories:\n  storage: {tmp_path}\n')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr('sys.argv', [
+        'show-changes.py', 'octopus-dispatches', '--structural', '--start', '2024-02-18', '--end', '2024-02-19',
+    ])
+    show_changes.main()
+    output = capsys.readouterr().out
+    # only the change between the two snapshots in range:
+    compare([line.partition('~ ')[2] for line in output.splitlines() if '~ ' in line],
+            expected=['value: 1 -> 2'])
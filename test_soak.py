@@ -0,0 +1,54 @@
+from datetime import date, timedelta
+from functools import partial
+
+from testfixtures import compare as compare_
+
+compare = partial(compare_, strict=True)
+
+from common import Run
+from soak import Limits, MiB, fakes_process, make_syncer, soak
+from synthetic import Spec, generate
+
+
+def test_no_growth():
+    result = soak(Run(lambda: None), cycles=20, warmup=5, sample_every=5)
+    compare([s.cycle for s in result.samples], expected=[0, 5, 10, 15, 20])
+    compare(result.growth(Limits()), expected=[])
+    compare(result.failures, expected=0)
+
+
+def test_leaks(tmp_path):
+    kept = []
+
+    def leak():
+        kept.append(bytearray(MiB // 4))
+        kept.append((tmp_path / 'file').open('w'))
+
+    try:
+        result = soak(Run(leak), cycles=20, warmup=10, sample_every=5)
+    finally:
+        for item in kept[1::2]:
+            item.close()
+    problems = result.growth(Limits(rss=100 * MiB, traced=MiB, objects=100_000))
+    compare([problem.split()[0] for problem in problems], expected=['traced', 'fds'])
+    assert 'test_soak.py' in result.top_allocations()[0], result.top_allocations()
+
+
+def test_failures():
+    def fail():
+        raise ValueError()
+
+    compare(soak(Run(fail), cycles=3, warmup=1, sample_every=1).failures, expected=3)
+
+
+def test_syncer(tmp_path):
+    source = tmp_path / 'source'
+    source.mkdir()
+    generate(Spec(date.today() - timedelta(days=1), 2, kinds=('dispatches',)), source, workers=1)
+    storage = tmp_path / 'storage'
+    storage.mkdir()
+    with fakes_process(source, tmp_path) as config:
+        result = soak(Run(make_syncer(config, storage)), cycles=10, warmup=5, sample_every=5)
+    compare(result.failures, expected=0)
+    compare(result.samples[-1].threads - result.samples[1].threads, expected=0)
+    assert list(storage.glob('octopus-dispatches-*.json'))
@@ -0,0 +1,64 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+HERE = Path(__file__).parent
+# many of the small scripts run from cron every few minutes, so shouldn't spend most of
+# that time importing things they don't use:
+HEAVY = ('pandas', 'numpy', 'gql', 'aiohttp', 'mailinglogger')
+# the budgets are wall-clock times, which a busy machine can blow, so they're only
+# checked when this is set, to 1 on a quiet machine or more on a slower one:
+SCALE = float(os.environ.get('IMPORT_BUDGET_SCALE', 0))
+
+MEASURE = """
+import importlib, json, sys, time
+started = time.perf_counter()
+importlib.import_module(sys.argv[1])
+print(json.dumps({'seconds': time.perf_counter() - started, 'modules': sorted(sys.modules)}))
+"""
+
+
+def cold_import(name: str) -> tuple[float, set[str]]:
+    """
+    The quickest of three imports of `name` in a fresh interpreter, or of just one if
+    the budgets aren't being checked, along with the top-level packages that ended
+    up imported.
+    """
+    results = []
+    for _ in range(3 if SCALE else 1):
+        output = subprocess.run(
+            [sys.executable, '-c', MEASURE, name], cwd=HERE, capture_output=True, text=True, check=True
+        ).stdout
+        results.append(json.loads(output))
+    seconds = min(r['seconds'] for r in results)
+    return seconds, {m.split('.')[0] for m in results[0]['modules']}
+
+
+@pytest.mark.parametrize('name, budget, also_not', [
+    ('pretty', 0.05, ('teslapy', 'requests', 'configurator')),
+    ('energy', 0.05, ('teslapy', 'requests', 'configurator')),
+    ('common', 0.1, ('teslapy', 'requests')),
+    ('show-changes', 0.2, ('teslapy', 'requests')),
+    ('tesla-backup', 0.3, ()),
+    ('tesla-login', 0.3, ()),
+    ('tesla-schedule', 0.3, ()),
+])
+def test_cold_start(name, budget, also_not):
+    seconds, modules = cold_import(name)
+    unexpected = sorted(modules & set(HEAVY + also_not))
+    assert not unexpected, f'{name} imports {unexpected}'
+    if SCALE:
+        assert seconds < budget * SCALE, f'{name} took {seconds:.3f}s to import, budget is {budget}s'
+
+
+def test_sync_cold_start():
+    # the sync needs pandas and the GraphQL client, but not the processing pipeline:
+    seconds, modules = cold_import('octopus-tesla-sync')
+    unexpected = sorted(modules & {'gaps', 'ingest', 'loaders', 'rollups'})
+    assert not unexpected, f'octopus-tesla-sync imports {unexpected}'
+    if SCALE:
+        assert seconds < 1.5 * SCALE, f'octopus-tesla-sync took {seconds:.3f}s to import, budget is 1.5s'
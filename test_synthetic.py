@@ -0,0 +1,90 @@
+import json
+from dataclasses import replace
+from datetime import date
+from functools import partial
+
+import pandas as pd
+from configurator import Config
+from testfixtures import compare as compare_
+
+compare = partial(compare_, strict=True)
+
+import myenergi
+from common import snapshot_time
+from gaps import expected_slots, scan
+from loaders import SOURCES, load_tesla, read_octopus, read_tesla, read_zappi
+from synthetic import Spec, generate, isoformat
+
+# over the start of BST:
+SPEC = Spec(date(2024, 3, 30), days=3, gap_rate=0, missing_rate=0, tesla_csv='app')
+
+
+def test_isoformat():
+    index = pd.date_range('2024-10-27 00:00', periods=4, freq='30min', tz='UTC')
+    compare(isoformat(index, 'Europe/London'), expected=[ts.isoformat() for ts in index.tz_convert('Europe/London')])
+    compare(isoformat(index[:1], 'Asia/Kolkata'), expected=['2024-10-27T05:30:00+05:30'])
+
+
+def test_formats(tmp_path):
+    compare(generate(SPEC, tmp_path, workers=1), expected=12)
+
+    octopus = read_octopus(tmp_path / 'octopus-2024-03-31.csv')
+    compare(len(octopus), expected=46)
+    compare(octopus.index[0], expected=pd.Timestamp('2024-03-31 00:00', tz='UTC'))
+    compare(bool((octopus['consumption'] >= 0).all()), expected=True)
+
+    tesla = read_tesla(tmp_path / 'tesla-2024-03-31.json')
+    compare(len(tesla), expected=276)
+    compare(list(tesla.columns), expected=[
+        'solar_power', 'battery_power', 'grid_power', 'grid_services_power', 'generator_power', 'load_power'
+    ])
+    app = read_tesla(tmp_path / 'tesla-2024-03-31.csv')
+    compare(list(app.index), expected=list(tesla.index))
+    compare(len(load_tesla(tmp_path, date(2024, 3, 30))), expected=48)
+
+    zappi = read_zappi(tmp_path / 'zappi-2024-03-31.json')
+    compare(len(zappi), expected=1440)
+    config = Config({'myenergi': {'zappi_serial': SPEC.zappi_serial}})
+    myenergi.json_to_csv(config, pd.Timestamp('2024-03-31'), pd.Timestamp('2024-03-31'), tmp_path)
+    pd.testing.assert_frame_equal(
+        zappi.sort_index(axis=1), read_zappi(tmp_path / 'zappi-2024-03-31.csv').sort_index(axis=1),
+        check_dtype=False,
+    )
+
+    snapshots = sorted(tmp_path.glob('octopus-dispatches-*.json'))
+    compare(len(snapshots), expected=12)
+    compare(str(snapshot_time(snapshots[0])), expected='2024-03-30 17:03:12')
+    state = json.loads(snapshots[-1].read_text())
+    compare(sorted(state), expected=['agreement', 'dispatches', 'unit_rates'])
+    compare(sorted(state['dispatches']), expected=['completedDispatches', 'plannedDispatches'])
+
+
+def test_sources_agree(tmp_path):
+    generate(SPEC, tmp_path, workers=1)
+    day = date(2024, 3, 31)
+    octopus = read_octopus(tmp_path / 'octopus-2024-03-31.csv')['consumption']
+    tesla = read_tesla(tmp_path / 'tesla-2024-03-31.json')['grid_power'].clip(lower=0)
+    # octopus is the mean of every minute, tesla samples every five, so only roughly equal:
+    tesla_kwh = tesla.resample('30min').mean() / 1000 / 2
+    compare(bool(abs(octopus.sum() - tesla_kwh.sum()) / octopus.sum() < 0.1), expected=True)
+    compare(len(expected_slots(day, SOURCES['octopus'].interval)), expected=len(octopus))
+
+
+def test_deterministic(tmp_path):
+    generate(SPEC, tmp_path / 'a', workers=1)
+    generate(SPEC, tmp_path / 'b', workers=2)
+    for path in (tmp_path / 'a').iterdir():
+        compare((tmp_path / 'b' / path.name).read_bytes() == path.read_bytes(), expected=True, prefix=path.name)
+
+
+def test_gaps_and_missing(tmp_path):
+    spec = replace(SPEC, days=60, gap_rate=0.2, missing_rate=0.1, kinds=('octopus',), tesla_csv=None)
+    written = generate(spec, tmp_path, workers=1)
+    suspect = list(tmp_path.glob('octopus-*-suspect.csv'))
+    compare(0 < written < 60, expected=True)
+    compare(len(suspect) > 0, expected=True)
+    gaps = scan(tmp_path, spec.start, date(2024, 5, 28), ['octopus'], workers=1)
+    compare(bool(gaps['missing'].sum() > 0), expected=True)
+    days_with_gaps = set(gaps['start'].dt.tz_convert('Europe/London').dt.date)
+    for path in suspect:
+        compare(date.fromisoformat(path.name[8:18]) in days_with_gaps, expected=True)
@@ -1,11 +1,15 @@
 import json
 from functools import partial
+from zoneinfo import ZoneInfo
 
+from pandas import Timestamp
 from testfixtures import Replace, compare as compare_, ShouldRaise, mock_time
 
 compare = partial(compare_, strict=True)
 
-from tesla import parse_tesla_auth_output, parse_tesla_auth_section, seed_tesla_token
+from tesla import (
+    parse_tesla_auth_output, parse_tesla_auth_section, seed_tesla_token, tesla_end_dates
+)
 
 OUTPUT = """
 --------------------------------- ACCESS TOKEN ---------------------------------
@@ -77,3 +81,13 @@ def test_seed_tesla_token_ignores_stale_cache_missing_expires_at(tmp_path):
         json.loads(cache_file.read_text())['person@example.com']['sso'],
         expected=token,
     )
+
+
+def test_tesla_end_dates_over_dst():
+    london = ZoneInfo('Europe/London')
+    ends = [end for _, end in tesla_end_dates(Timestamp('2024-03-30'), Timestamp('2024-04-01'), london)]
+    compare([end.isoformat() for end in ends], expected=[
+        '2024-03-30T23:59:59+00:00', '2024-03-31T23:59:59+01:00', '2024-04-01T23:59:59+01:00',
+    ])
+    ends = list(tesla_end_dates(Timestamp('2024-10-26'), Timestamp('2024-10-28'), london))
+    compare(len(ends), expected=3)
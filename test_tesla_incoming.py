@@ -0,0 +1,108 @@
+from datetime import date
+from functools import partial
+from importlib import import_module
+
+from testfixtures import compare as compare_, ShouldAssert, ShouldRaise, Replace
+
+compare = partial(compare_, strict=True)
+
+incoming = import_module('tesla-incoming')
+
+HEADER = 'Date time,Home (kW),Solar (kW),Powerwall (kW),Grid (kW)\r\n'
+
+
+def write_export(path, *timestamps):
+    path.write_text(HEADER + ''.join(f'{ts},1.0,0,0,1.0\r\n' for ts in timestamps))
+    return path
+
+
+def test_csv_date_over_dst(tmp_path):
+    path = write_export(
+        tmp_path / 'data.csv',
+        '2024-03-31T00:00:00+00:00',
+        '2024-03-31T00:55:00+00:00',
+        '2024-03-31T02:00:00+01:00',
+        '2024-03-31T23:55:00+01:00',
+    )
+    # pendulum's Date is a date subclass:
+    compare(incoming.csv_date(path), expected=date(2024, 3, 31), strict=False)
+    compare(incoming.csv_date(path, full_check=True), expected=date(2024, 3, 31))
+
+
+def test_csv_date_spans_days(tmp_path):
+    path = write_export(
+        tmp_path / 'data.csv', '2024-03-30T23:55:00+00:00', '2024-03-31T00:00:00+00:00'
+    )
+    with ShouldAssert(f'{path} covers [Date(2024, 3, 30), Date(2024, 3, 31)]'):
+        incoming.csv_date(path)
+
+
+def test_header_only(tmp_path):
+    path = write_export(tmp_path / 'data.csv')
+    compare(incoming.first_and_last_rows(path), expected=[])
+    with ShouldRaise(ValueError(f'{path} has no rows')):
+        incoming.csv_date(path)
+    with ShouldRaise(ValueError(f'{path} has no rows')):
+        incoming.csv_date(path, full_check=True)
+
+
+def test_full_check_finds_stray_row(tmp_path):
+    path = write_export(
+        tmp_path / 'data.csv',
+        '2024-03-31T00:00:00+00:00',
+        '2024-04-01T00:00:00+01:00',
+        '2024-03-31T23:55:00+01:00',
+    )
+    compare(incoming.csv_date(path), expected=date(2024, 3, 31), strict=False)
+    with ShouldAssert(f'{path} covers [datetime.date(2024, 3, 31), datetime.date(2024, 4, 1)]'):
+        incoming.csv_date(path, full_check=True)
+
+
+def test_move_all(tmp_path):
+    source = tmp_path / 'incoming'
+    source.mkdir()
+    dest = tmp_path / 'storage'
+    dest.mkdir()
+    paths = [
+        write_export(source / 'data.csv', '2024-03-30T00:00:00+00:00'),
+        write_export(source / 'data (1).csv', '2024-03-31T00:00:00+00:00'),
+        (source / 'data (2).csv'),
+    ]
+    paths[2].write_text('')
+    moved = incoming.move_all(paths, dest)
+    compare(moved, expected=[dest / 'tesla-2024-03-30.csv', dest / 'tesla-2024-03-31.csv'])
+    compare([p.name for p in source.iterdir()], expected=['data (2).csv'])
+
+
+def test_move_all_same_date(tmp_path):
+    source = tmp_path / 'incoming'
+    source.mkdir()
+    dest = tmp_path / 'storage'
+    dest.mkdir()
+    paths = [
+        write_export(source / f'data ({i}).csv', f'2024-03-30T00:0{i}:00+00:00') for i in range(1, 5)
+    ]
+    moved = incoming.move_all(paths, dest, workers=4)
+    compare(moved, expected=[dest / 'tesla-2024-03-30.csv'])
+    # the last one given wins:
+    compare(paths[-1].exists(), expected=False)
+    assert '2024-03-30T00:04:00' in moved[0].read_text()
+
+
+def test_handler_waits_for_file_to_settle(tmp_path):
+    now = [0]
+    path = tmp_path / 'data (3).csv'
+    handler = incoming.IncomingEventHandler(settle=2)
+    with Replace('tesla-incoming.time.monotonic', lambda: now[0]):
+        handler.seen(str(tmp_path / 'other.csv'))
+        handler.seen(str(path))
+        path.write_text(HEADER)
+        compare(handler.ready(), expected=[])
+        now[0] = 1
+        path.write_text(HEADER + '2024-03-31T00:00:00+00:00,1.0,0,0,1.0\r\n')
+        compare(handler.ready(), expected=[])
+        now[0] = 2
+        compare(handler.ready(), expected=[])
+        now[0] = 3
+        compare(handler.ready(), expected=[path])
+        compare(handler.pending, expected={})
@@ -0,0 +1,114 @@
+from datetime import date
+from functools import partial
+
+import pandas as pd
+from click.testing import CliRunner
+from testfixtures import Replace, compare as compare_
+
+compare = partial(compare_, strict=True)
+
+import rollups
+import usage
+from ingest import Pipeline
+from test_ingest import write_octopus
+from usage import cache_path, daily_kwh, read_sheets
+
+
+def write_ods(path, kwh=100):
+    with pd.ExcelWriter(path, engine='odf') as writer:
+        for sheet_name in 'Gas', 'Electricity':
+            pd.DataFrame({
+                'Date': pd.to_datetime(['2024-01-01', '2024-02-01', '2024-03-01']),
+                'kwh': [kwh, kwh, -1],
+                'Cost Since': pd.to_datetime(['2023-12-01', None, None]),
+                'Cost inc VAT': [31.0, 31.0, 29.0],
+                'Cost/day': [1.0, 1.0, 1.0],
+            }).to_excel(writer, sheet_name=sheet_name, index=False)
+
+
+def test_read_sheets_cached(tmp_path):
+    ods = tmp_path / 'usage.ods'
+    write_ods(ods)
+    calls = []
+    read_excel = pd.read_excel
+
+    def counting(*args, **kw):
+        calls.append(kw['sheet_name'])
+        return read_excel(*args, **kw)
+
+    with Replace('usage.pd.read_excel', counting):
+        first = read_sheets(ods, ['Gas', 'Electricity'])
+        second = read_sheets(ods, ['Electricity', 'Gas'])
+        write_ods(ods, kwh=200)
+        third = read_sheets(ods, ['Gas'])
+
+    compare(calls, expected=[['Gas', 'Electricity'], ['Gas']])
+    compare(list(second), expected=['Electricity', 'Gas'])
+    pd.testing.assert_frame_equal(first['Gas'], second['Gas'])
+    compare(list(third['Gas']['kwh']), expected=[200, 200, -1])
+    compare(cache_path(ods, 'Gas').exists(), expected=True)
+
+
+def test_main(tmp_path):
+    ods = tmp_path / 'usage.ods'
+    write_ods(ods)
+    result = CliRunner().invoke(usage.main, ['spreadsheet', str(ods), 'Gas', 'Electricity'])
+    compare(result.exit_code, expected=0, suffix=result.output)
+    compare(result.output.count('usage:'), expected=2)
+    # as it was called before there were other commands:
+    result = CliRunner().invoke(usage.main, [str(ods), 'Electricity'])
+    compare(result.exit_code, expected=0, suffix=result.output)
+    compare(result.output.count('Electricity usage:'), expected=1)
+    data = usage.parse_gas_kwh(ods, 'Gas')
+    compare(list(data['Calc Days']), expected=[31, 31])
+
+
+def test_daily_kwh(tmp_path):
+    write_octopus(tmp_path, '2024-03-31', consumption=0.5)
+    Pipeline(tmp_path).run([('octopus', date(2024, 3, 31))])
+    days = rollups.read(tmp_path, 'octopus', 'day')
+    data = daily_kwh(days, 'consumption', pd.Timedelta(minutes=30))
+    # the clocks went forward, so 48 readings run into the next day:
+    compare(data['kwh'].tolist(), expected=[23.0, 1.0])
+    compare(data['Covered Days'].tolist(), expected=[23 / 24, 1 / 24])
+
+
+def test_downloaded(tmp_path, monkeypatch):
+    (tmp_path / 'config.yaml').write_text(f'directories:\n  storage: {tmp_path}\n')
+    write_octopus(tmp_path, '2024-01-01', consumption=0.5)
+    write_octopus(tmp_path, '2024-02-01', consumption=0.25)
+    Pipeline(tmp_path).run([('octopus', date(2024, 1, 1)), ('octopus', date(2024, 2, 1))])
+    monkeypatch.chdir(tmp_path)
+    result = CliRunner().invoke(usage.main, ['downloaded'])
+    compare(result.exit_code, expected=0, suffix=result.output)
+    compare(result.output.splitlines()[-3:], expected=[
+        'octopus usage from 2024-01-01 to 2024-02-01:',
+        '18.0 kWh/day',
+        '6,574 kWh/year, 548 kWh/month',
+    ])
+
+
+def test_downloaded_nothing(tmp_path, monkeypatch):
+    (tmp_path / 'config.yaml').write_text(f'directories:\n  storage: {tmp_path}\n')
+    monkeypatch.chdir(tmp_path)
+    result = CliRunner().invoke(usage.main, ['downloaded'])
+    compare(result.exit_code, expected=1)
+    compare(result.output, expected='Error: No octopus rollups found, run ingest.py process\n')
+
+
+def test_peaks(tmp_path, monkeypatch):
+    (tmp_path / 'config.yaml').write_text(f'directories:\n  storage: {tmp_path}\n')
+    write_octopus(tmp_path, '2024-01-01', consumption=0.5)
+    write_octopus(tmp_path, '2024-01-02', consumption=0.25)
+    Pipeline(tmp_path).run([('octopus', date(2024, 1, 1)), ('octopus', date(2024, 1, 2))])
+    monkeypatch.chdir(tmp_path)
+    result = CliRunner().invoke(usage.main, [
+        'peaks', '--source', 'octopus', '--column', 'consumption', '--stat', 'sum', '--top', '1'
+    ])
+    compare(result.exit_code, expected=0, suffix=result.output)
+    compare(result.output.splitlines(), expected=[
+        '            consumption_sum',
+        '2024-01-01             24.0',
+    ])
+    result = CliRunner().invoke(usage.main, ['peaks', '--source', 'octopus', '--column', 'nope'])
+    compare(result.output, expected='Error: No nope_max_20min in the octopus peaks\n')
@@ -1,17 +1,53 @@
+import pickle
+from datetime import datetime
 from pathlib import Path
 
 import click
 import pandas as pd
-from common import DAYS_PER_YEAR, DAYS_PER_MONTH
+from configurator import Config
+
+import rollups
+from common import DAYS_PER_YEAR, DAYS_PER_MONTH, root_from
+from loaders import SOURCES
 
 DAYS_IN_PERIOD_COL = "Days"
 COST_PER_DAY_COL = "Cost/day"
+DATE_COLUMNS = ["Date", "Cost Since"]
+
+
+def cache_path(ods: Path, sheet_name: str) -> Path:
+    return ods.with_name(f'.{ods.stem}-{sheet_name}.pkl')
+
+
+def read_sheets(ods: Path, sheet_names: list[str]) -> dict[str, pd.DataFrame]:
+    """
+    Read `sheet_names` from `ods`, using a cache of each sheet next to the file that's
+    only trusted while the file's mtime and size are unchanged. Any sheets not in the
+    cache are all parsed in one pass, as the odf engine is very slow.
+    """
+    stat = ods.stat()
+    key = stat.st_mtime_ns, stat.st_size
+    sheets = {}
+    for sheet_name in sheet_names:
+        path = cache_path(ods, sheet_name)
+        if path.exists():
+            cached_key, frame = pickle.loads(path.read_bytes())
+            if cached_key == key:
+                sheets[sheet_name] = frame
+    stale = [sheet_name for sheet_name in sheet_names if sheet_name not in sheets]
+    if stale:
+        parsed = pd.read_excel(ods, sheet_name=stale, engine="odf", parse_dates=DATE_COLUMNS)
+        for sheet_name, frame in parsed.items():
+            cache_path(ods, sheet_name).write_bytes(pickle.dumps((key, frame)))
+            sheets[sheet_name] = frame
+    return {sheet_name: sheets[sheet_name] for sheet_name in sheet_names}
+
 
 def parse_gas_kwh(ods: Path, sheet_name: str):
-    # Load the specific sheet named "Gas"
-    date_columns = ["Date", "Cost Since"]
-    raw = pd.read_excel(ods, sheet_name=sheet_name, engine="odf", parse_dates=date_columns)
+    return kwh_data(read_sheets(ods, [sheet_name])[sheet_name])
+
 
+def kwh_data(raw: pd.DataFrame) -> pd.DataFrame:
     # Filter out negative kWh values
     columns_to_keep = ["Date", "kwh", "Cost Since", 'Cost inc VAT', COST_PER_DAY_COL]
     if DAYS_IN_PERIOD_COL in raw.columns:
@@ -37,18 +73,40 @@ def parse_gas_kwh(ods: Path, sheet_name: str):
     data['Cost Diff'] = data['Cost inc VAT'] - data['Row Cost']
     return data
 
-@click.command()
+
+class Main(click.Group):
+
+    def parse_args(self, ctx: click.Context, args: list[str]) -> list[str]:
+        # summarising a spreadsheet was all this used to do, so keep `usage.py bills.ods Gas` working:
+        if args and args[0] not in self.commands and not args[0].startswith('-'):
+            args = ['spreadsheet', *args]
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=Main)
+def main():
+    pass
+
+
+@main.command()
 @click.argument(
     'path',
     type=click.Path(path_type=Path, exists=True, dir_okay=False, resolve_path=True),
 )
 @click.argument(
-    'sheet_name',
-    default='Gas'
+    'sheet_names',
+    nargs=-1,
 )
 @click.option('--verbose', '-v', is_flag=True)
-def main(path: Path, sheet_name:str, verbose: bool):
-    data = parse_gas_kwh(path, sheet_name)
+def spreadsheet(path: Path, sheet_names: tuple[str, ...], verbose: bool):
+    """
+    Summarise the bills recorded in the sheets of an ODS spreadsheet.
+    """
+    for sheet_name, raw in read_sheets(path, list(sheet_names or ['Gas'])).items():
+        summarise(kwh_data(raw), sheet_name, verbose)
+
+
+def summarise(data: pd.DataFrame, sheet_name: str, verbose: bool):
     if verbose:
         pd.set_option("display.max_rows", None)  # Ensure all rows are printed
         print(data, '\n')
@@ -60,13 +118,85 @@ def main(path: Path, sheet_name:str, verbose: bool):
     monthly_summary(data, 'Row Cost', label='Monthly Cost')
     monthly_summary(data, 'kwh')
 
-    daily_use = data.mean()['kwh per day']
-    daily_cost = data.mean()[COST_PER_DAY_COL]
+    daily_use = data['kwh per day'].mean()
+    daily_cost = data[COST_PER_DAY_COL].mean()
     print(f'{sheet_name} usage:')
     print(f'£{daily_cost * DAYS_PER_YEAR:,.0f}/year, £{daily_cost * DAYS_PER_MONTH:,.0f}/month')
     print(f'{daily_use * DAYS_PER_YEAR:,.0f} kWh/year, {daily_use * DAYS_PER_MONTH:,.0f} kWh/month')
 
 
+@main.command()
+@click.option('--source', type=click.Choice(list(SOURCES)), default='octopus')
+@click.option('--column', default='consumption', help='the column holding kWh')
+@click.option('--start', type=click.DateTime(['%Y-%m-%d']))
+@click.option('--end', type=click.DateTime(['%Y-%m-%d']), help='exclusive')
+@click.option('--verbose', '-v', is_flag=True)
+def downloaded(
+        source: str,
+        column: str,
+        start: datetime | None,
+        end: datetime | None,
+        verbose: bool,
+):
+    """
+    Summarise downloaded interval data from the daily rollups written by ingest.py.
+    """
+    root = root_from(Config.from_path('config.yaml'))
+    days = rollups.read(root, source, 'day', start and start.date(), end and end.date())
+    if days.empty:
+        raise click.ClickException(f'No {source} rollups found, run ingest.py process')
+    data = daily_kwh(days, column, SOURCES[source].interval)
+    if verbose:
+        pd.set_option("display.max_rows", None)
+        print(data, '\n')
+
+    monthly_summary(data, 'kwh')
+    yearly = data.groupby('Year')['kwh'].sum().round(0).map(lambda x: f"{x:,.0f}")
+    print(f"Total kwh by year:\n{yearly.to_string()}\n")
+
+    daily_use = data['kwh'].sum() / data['Covered Days'].sum()
+    print(f'{source} usage from {data.index[0]:%Y-%m-%d} to {data.index[-1]:%Y-%m-%d}:')
+    print(f'{daily_use:,.1f} kWh/day')
+    print(f'{daily_use * DAYS_PER_YEAR:,.0f} kWh/year, {daily_use * DAYS_PER_MONTH:,.0f} kWh/month')
+
+
+@main.command()
+@click.option('--source', type=click.Choice(list(SOURCES)), default='zappi')
+@click.option('--column', default='imp_kw')
+@click.option('--stat', default='max_20min',
+              help='max, max_{window} for a rolling mean or sum, see rollups.WINDOWS')
+@click.option('--top', 'n', type=int, default=10)
+@click.option('--start', type=click.DateTime(['%Y-%m-%d']))
+@click.option('--end', type=click.DateTime(['%Y-%m-%d']), help='exclusive')
+def peaks(source: str, column: str, stat: str, n: int, start: datetime | None, end: datetime | None):
+    """
+    List the days with the highest peaks from the table written by ingest.py.
+    """
+    root = root_from(Config.from_path('config.yaml'))
+    name = f'{column}_{stat}'
+    try:
+        found = rollups.top(root, source, name, n, start and start.date(), end and end.date())
+    except KeyError:
+        raise click.ClickException(f'No {name} in the {source} peaks')
+    if found.empty:
+        raise click.ClickException(f'No {source} peaks found, run ingest.py reprocess')
+    found.index = found.index.date
+    print(found.to_string())
+
+
+def daily_kwh(days: pd.DataFrame, column: str, interval: pd.Timedelta) -> pd.DataFrame:
+    """
+    Daily kWh from a day rollup table, along with how much of each day had readings
+    so partial days don't drag down the averages.
+    """
+    return pd.DataFrame({
+        'kwh': days[f'{column}_sum'],
+        'Covered Days': days[f'{column}_count'] * interval / pd.Timedelta(days=1),
+        'Year': days.index.year,
+        'Month': days.index.month,
+    })
+
+
 def monthly_summary(data, field: str, label: str | None = None):
     summary = data.groupby(["Year", "Month"])[field].sum().unstack()
     summary = summary.round(0).map(lambda x: f"{x:,.0f}")